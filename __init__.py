@@ -126,6 +126,18 @@ class RigifyPreferences(AddonPreferences):
         update=update_legacy
     )
 
+    def update_developer_reload(self, context):
+        if hasattr(utils, "clear_module_cache"):  # Not in legacy mode
+            utils.clear_module_cache()
+
+    developer_reload = BoolProperty(
+        name='Developer Reload',
+        description='Reload rig type, metarig and UI template modules on every use. '
+                    'Otherwise modules are cached and only reloaded when their file changes',
+        default=False,
+        update=update_developer_reload
+    )
+
     show_expanded = BoolProperty()
 
     def draw(self, context):
@@ -154,6 +166,9 @@ class RigifyPreferences(AddonPreferences):
             split.label('Description:')
             split.label(text='When enabled the add-on will run in legacy mode using the old 2.76b feature set.')
 
+        row = layout.row()
+        row.prop(self, 'developer_reload')
+
         row = layout.row()
         row.label("End of Rigify Preferences")
 
@@ -298,6 +313,7 @@ def register():
     def update_mode(self, context):
         if self.rigify_generate_mode == 'new':
             self.rigify_force_widget_update = False
+            self.rigify_incremental_generation = False
 
     IDStore.rigify_generate_mode = bpy.props.EnumProperty(name="Rigify Generate Rig Mode",
                                                           description="'Generate Rig' mode. In 'overwrite' mode the features of the target rig will be updated as defined by the metarig. In 'new' mode a new rig will be created as defined by the metarig. Current mode",
@@ -309,6 +325,18 @@ def register():
                                                                 description="Forces Rigify to delete and rebuild all the rig widgets. if unset, only missing widgets will be created",
                                                                 default=False)
 
+    IDStore.rigify_incremental_generation = bpy.props.BoolProperty(name="Incremental Update",
+                                                                   description="Only rebuild the rig components whose metarig bones changed since the last generation. Falls back to a full generation when in doubt",
+                                                                   default=False)
+
+    IDStore.rigify_use_generation_cache = bpy.props.BoolProperty(name="Skip Unchanged Rig",
+                                                                 description="Leave the rig as it is when it was generated from the same metarig content, rig types and templates before",
+                                                                 default=True)
+
+    IDStore.rigify_profile_generation = bpy.props.BoolProperty(name="Profile Generation",
+                                                               description="Record where rig generation spends its time, per rig and rig type. The report is written to the rigify_profile.json and rigify_profile.csv text blocks",
+                                                               default=False)
+
     IDStore.rigify_target_rigs = bpy.props.CollectionProperty(type=RigifyName)
     IDStore.rigify_target_rig = bpy.props.StringProperty(name="Rigify Target Rig",
                                                          description="Defines which rig to overwrite. If unset, a new one called 'rig' will be created.",
@@ -335,12 +363,16 @@ def register():
     IDStore.rigify_active_template = bpy.props.IntProperty(name="Rigify Active Template", description="The selected ui template", default=1)
 
     # Add rig parameters
-    for rig in rig_lists.rig_list:
-        r = utils.get_rig_type(rig)
-        try:
-            r.add_parameters(RigifyParameters)
-        except AttributeError:
-            pass
+    if hasattr(rig_lists, 'register_parameters'):
+        rig_lists.register_parameters(RigifyParameters)
+    else:
+        # Legacy mode
+        for rig in rig_lists.rig_list:
+            r = utils.get_rig_type(rig)
+            try:
+                r.add_parameters(RigifyParameters)
+            except AttributeError:
+                pass
 
 
 def unregister():
@@ -354,6 +386,9 @@ def unregister():
     del IDStore.rigify_advanced_generation
     del IDStore.rigify_generate_mode
     del IDStore.rigify_force_widget_update
+    del IDStore.rigify_incremental_generation
+    del IDStore.rigify_use_generation_cache
+    del IDStore.rigify_profile_generation
     del IDStore.rigify_target_rig
     del IDStore.rigify_target_rigs
     del IDStore.rigify_rig_uis
@@ -0,0 +1,410 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+""" Evaluation cost of generated rigs.
+
+    Walks a generated armature and reports, per rig component (metarig
+    bone + rig type), what makes it expensive to evaluate: constraints
+    and drivers by type, drivers that need Python, B-bone segments and
+    the depth of its dependency chains.  It can also time playback:
+
+    blender -b chars/hero.blend --python-expr "import rigify.analyzer; rigify.analyzer.main()" -- --frames 1 100
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+import bpy
+
+from .utils import MetarigError, strip_org
+from .incremental import load_manifest, driver_bone_name
+from .drivers import is_python_driver, all_drivers
+
+REPORT_JSON = "rigify_cost.json"
+REPORT_CSV = "rigify_cost.csv"
+
+# Component that bones not made by any rig instance are attributed to,
+# e.g. the root bone.
+RIG_COMPONENT = "(rig)"
+
+_last = None        # The most recent report
+
+
+#=============================================
+# Drivers
+#=============================================
+
+def driver_target_bones(obj, driver):
+    """ Returns the names of the bones of obj a driver reads.
+    """
+    bones = set()
+    for var in driver.variables:
+        for target in var.targets:
+            if target.id != obj and target.id != obj.data:
+                continue
+            if var.type == 'SINGLE_PROP':
+                name = driver_bone_name(target.data_path)
+            else:
+                name = target.bone_target
+            if name and name in obj.data.bones:
+                bones.add(name)
+    return bones
+
+
+#=============================================
+# Analysis
+#=============================================
+
+def bone_components(obj):
+    """ Maps every bone of a generated rig to the metarig bone of the rig
+        instance that made it, using the manifest stored at generation.
+        Bones no rig instance made (ORG bones, their children) belong to
+        the rig instance of their closest ancestor.
+    """
+    manifest = load_manifest(obj) or {'rigs': {}}
+    rigs = manifest['rigs']
+
+    owner = {}
+    for key, info in rigs.items():
+        for name in info.get('bones', []):
+            owner[name] = key
+
+    components = {}
+    for bone in obj.data.bones:
+        chain = []
+        b = bone
+        while b is not None and b.name not in components:
+            if b.name in owner:
+                components[b.name] = owner[b.name]
+                break
+            if strip_org(b.name) in rigs and b.name != strip_org(b.name):
+                components[b.name] = strip_org(b.name)
+                break
+            chain.append(b.name)
+            b = b.parent
+        key = components[b.name] if b is not None else RIG_COMPONENT
+        for name in chain:
+            components[name] = key
+
+    return components
+
+
+def component_types(obj):
+    """ Returns the rig type of each rig instance of a generated rig.
+    """
+    manifest = load_manifest(obj) or {'rigs': {}}
+    types = {key: info.get('rig_type', "") for key, info in manifest['rigs'].items()}
+
+    # Manifests from before rig types were recorded
+    metarig = bpy.data.objects.get(manifest.get('metarig', ""))
+    if metarig is not None and metarig.type == 'ARMATURE':
+        for key in types:
+            if not types[key] and key in metarig.pose.bones:
+                types[key] = metarig.pose.bones[key].rigify_type.replace(" ", "")
+
+    types[RIG_COMPONENT] = ""
+    return types
+
+
+def dependencies(obj):
+    """ Returns the bones each bone is evaluated after: its parent,
+        the bones its constraints target and the bones its drivers read.
+    """
+    deps = {bone.name: set() for bone in obj.data.bones}
+    for bone in obj.data.bones:
+        if bone.parent:
+            deps[bone.name].add(bone.parent.name)
+    for pbone in obj.pose.bones:
+        for con in pbone.constraints:
+            for target, subtarget in constraint_targets(con):
+                if target == obj and subtarget in deps:
+                    deps[pbone.name].add(subtarget)
+    for fcu in all_drivers(obj):
+        name = driver_bone_name(fcu.data_path)
+        if name in deps:
+            deps[name] |= driver_target_bones(obj, fcu.driver)
+    return deps
+
+
+def constraint_targets(con):
+    """ Returns the (object, bone name) targets of a constraint.
+    """
+    if hasattr(con, 'targets'):
+        return [(t.target, t.subtarget) for t in con.targets]
+    targets = []
+    if getattr(con, 'target', None) is not None:
+        targets.append((con.target, getattr(con, 'subtarget', "")))
+    if getattr(con, 'pole_target', None) is not None:
+        targets.append((con.pole_target, con.pole_subtarget))
+    return targets
+
+
+def chain_depths(deps):
+    """ Returns the length of the longest dependency chain ending at each
+        bone.  Dependency cycles are cut where they are found.
+    """
+    depths = {}
+    for start in deps:
+        if start in depths:
+            continue
+        stack = [(start, iter(deps[start]))]
+        visiting = {start}
+        while stack:
+            name, pending = stack[-1]
+            for dep in pending:
+                if dep not in depths and dep not in visiting:
+                    visiting.add(dep)
+                    stack.append((dep, iter(deps[dep])))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(name)
+                depths[name] = 1 + max([depths[d] for d in deps[name] if d in depths] or [0])
+    return depths
+
+
+def _component(key, rig_type):
+    return {
+        'component': key,
+        'rig_type': rig_type,
+        'bones': 0,
+        'deform_bones': 0,
+        'constraints': 0,
+        'constraint_types': {},
+        'drivers': 0,
+        'driver_types': {},
+        'python_drivers': [],
+        'bbone_segments': 0,
+        'chain_depth': 0,
+    }
+
+
+def _add(counts, key):
+    counts[key] = counts.get(key, 0) + 1
+
+
+def analyze_rig(obj):
+    """ Returns the evaluation cost report of a generated rig, with one
+        entry per rig component, most constraints and drivers first.
+    """
+    if obj is None or obj.type != 'ARMATURE':
+        raise MetarigError("analyzer: not an armature")
+
+    components = bone_components(obj)
+    types = component_types(obj)
+    depths = chain_depths(dependencies(obj))
+
+    entries = {}
+
+    def entry(bone_name):
+        key = components.get(bone_name, RIG_COMPONENT)
+        if key not in entries:
+            entries[key] = _component(key, types.get(key, ""))
+        return entries[key]
+
+    for bone in obj.data.bones:
+        e = entry(bone.name)
+        e['bones'] += 1
+        if bone.use_deform:
+            e['deform_bones'] += 1
+        if bone.bbone_segments > 1:
+            e['bbone_segments'] += bone.bbone_segments
+        e['chain_depth'] = max(e['chain_depth'], depths.get(bone.name, 0))
+
+    for pbone in obj.pose.bones:
+        e = entry(pbone.name)
+        for con in pbone.constraints:
+            e['constraints'] += 1
+            _add(e['constraint_types'], con.type)
+
+    for fcu in all_drivers(obj):
+        e = entry(driver_bone_name(fcu.data_path))
+        e['drivers'] += 1
+        _add(e['driver_types'], fcu.driver.type)
+        if is_python_driver(fcu.driver):
+            e['python_drivers'].append({
+                'data_path': fcu.data_path,
+                'index': fcu.array_index,
+                'expression': fcu.driver.expression,
+            })
+
+    rows = sorted(entries.values(), key=lambda e: (-(e['constraints'] + e['drivers']), e['component']))
+
+    totals = _component("", "")
+    for e in rows:
+        for name in ('bones', 'deform_bones', 'constraints', 'drivers', 'bbone_segments'):
+            totals[name] += e[name]
+        for name in ('constraint_types', 'driver_types'):
+            for t, n in e[name].items():
+                totals[name][t] = totals[name].get(t, 0) + n
+        totals['python_drivers'] += e['python_drivers']
+        totals['chain_depth'] = max(totals['chain_depth'], e['chain_depth'])
+    del totals['component'], totals['rig_type']
+
+    return {
+        'rig': obj.name,
+        'rig_id': obj.data.get("rig_id"),
+        'blender': bpy.app.version_string,
+        'totals': totals,
+        'components': rows,
+        'playback': None,
+    }
+
+
+def measure_playback(context, obj, frame_start=None, frame_end=None):
+    """ Plays the frame range back and returns the frames per second.
+        The rig is tagged for a full evaluation on every frame, whether or
+        not it is animated.
+    """
+    scene = context.scene
+    if frame_start is None:
+        frame_start = scene.frame_start
+    if frame_end is None:
+        frame_end = scene.frame_end
+    if frame_end < frame_start:
+        raise MetarigError("analyzer: empty frame range %d-%d" % (frame_start, frame_end))
+
+    frame = scene.frame_current
+    frames = frame_end - frame_start + 1
+    t = time.perf_counter()
+    for f in range(frame_start, frame_end + 1):
+        obj.update_tag({'OBJECT', 'DATA'})
+        scene.frame_set(f)
+    seconds = time.perf_counter() - t
+    scene.frame_set(frame)
+
+    return {
+        'frame_start': frame_start,
+        'frame_end': frame_end,
+        'time': seconds,
+        'fps': frames / seconds if seconds > 0 else 0.0,
+    }
+
+
+#=============================================
+# Reports
+#=============================================
+
+CSV_COLUMNS = ('component', 'rig_type', 'bones', 'deform_bones', 'constraints', 'drivers',
+               'python_drivers', 'bbone_segments', 'chain_depth')
+
+
+def to_json(report):
+    return json.dumps(report, indent=2, sort_keys=True)
+
+
+def to_csv(report):
+    """ One row per rig component.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(CSV_COLUMNS)
+    for e in report['components']:
+        writer.writerow([len(e[c]) if c == 'python_drivers' else e[c] for c in CSV_COLUMNS])
+    return out.getvalue()
+
+
+def write_texts(report):
+    """ Stores the JSON and CSV reports in text blocks, replacing the
+        reports of the previous analysis.
+    """
+    global _last
+    _last = report
+    for name, text in ((REPORT_JSON, to_json(report)), (REPORT_CSV, to_csv(report))):
+        block = bpy.data.texts.get(name) or bpy.data.texts.new(name)
+        block.clear()
+        block.write(text)
+
+
+def last_report():
+    """ Returns the most recent report, or None.
+    """
+    return _last
+
+
+#=============================================
+# Command line
+#=============================================
+
+def find_rigs(scene, names=None):
+    """ Returns the generated rigs of the scene, or the ones with the given
+        names.
+    """
+    if names:
+        missing = [name for name in names if name not in scene.objects]
+        if missing:
+            raise MetarigError("rigs not found: " + ", ".join(missing))
+        return [scene.objects[name] for name in names]
+    return sorted((obj for obj in scene.objects
+                   if obj.type == 'ARMATURE' and obj.data.get("rig_id") is not None),
+                  key=lambda obj: obj.name)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="blender -b <file> --python-expr \"import rigify.analyzer; rigify.analyzer.main()\" --",
+        description="Report the evaluation cost of the Rigify rigs of the open file.")
+    parser.add_argument("--rig", action='append',
+                        help="only analyze this rig, can be given more than once")
+    parser.add_argument("--frames", type=int, nargs=2, metavar=("START", "END"),
+                        help="frame range to time playback over (default: the scene's)")
+    parser.add_argument("--no-playback", action='store_true', help="don't time playback")
+    parser.add_argument("-o", "--output", help="JSON file for the reports (default: print them)")
+    parser.add_argument("--csv", action='store_true', help="print the component tables as CSV")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Command line entry point.  Takes the arguments after '--' when
+        none are given.
+    """
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parse_args(argv)
+
+    context = bpy.context
+    reports = []
+    for obj in find_rigs(context.scene, args.rig):
+        report = analyze_rig(obj)
+        if not args.no_playback:
+            start, end = args.frames or (None, None)
+            report['playback'] = measure_playback(context, obj, start, end)
+        reports.append(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2, sort_keys=True)
+
+    for report in reports:
+        totals = report['totals']
+        print("Rig '%s': %d bones, %d constraints, %d drivers (%d Python), chain depth %d" % (
+            report['rig'], totals['bones'], totals['constraints'], totals['drivers'],
+            len(totals['python_drivers']), totals['chain_depth']))
+        if report['playback']:
+            print("  playback: %.1f fps over frames %d-%d" % (
+                report['playback']['fps'], report['playback']['frame_start'], report['playback']['frame_end']))
+        if args.csv:
+            print(to_csv(report))
+        elif not args.output:
+            print(to_json(report))
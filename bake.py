@@ -0,0 +1,434 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+import bpy
+import numpy as np
+from mathutils import Quaternion
+
+
+#=============================================
+# Batched matrix math
+#=============================================
+# Matrices are numpy arrays of shape (frames, 4, 4), in the same row/column
+# layout as mathutils.Matrix, so np.array(matrix) converts one frame.
+
+def _inv(m):
+    return np.linalg.inv(m)
+
+
+def _mul(*mats):
+    result = mats[0]
+    for m in mats[1:]:
+        result = np.matmul(result, m)
+    return result
+
+
+def _translation(vectors):
+    """ Returns translation matrices for an array of (frames, 3) vectors.
+    """
+    m = np.tile(np.identity(4), (len(vectors), 1, 1))
+    m[:, :3, 3] = vectors
+    return m
+
+
+def split_transform(m):
+    """ Splits matrices into translation (F, 3), rotation (F, 3, 3) and
+        scale (F, 3), like Matrix.decompose().
+    """
+    loc = m[:, :3, 3].copy()
+    basis = m[:, :3, :3]
+    scale = np.linalg.norm(basis, axis=1)
+    rot = basis / np.where(scale == 0.0, 1.0, scale)[:, np.newaxis, :]
+    return loc, rot, scale
+
+
+def join_transform(loc, rot, scale):
+    m = np.tile(np.identity(4), (len(loc), 1, 1))
+    m[:, :3, :3] = rot * scale[:, np.newaxis, :]
+    m[:, :3, 3] = loc
+    return m
+
+
+def matrix_to_quaternion(rot):
+    """ Converts (F, 3, 3) rotation matrices to (F, 4) quaternions (w, x, y, z),
+        flipping signs so consecutive frames stay on the same hemisphere.
+    """
+    r = rot
+    q = np.empty((len(r), 4))
+    trace = r[:, 0, 0] + r[:, 1, 1] + r[:, 2, 2]
+
+    cases = [
+        (trace > 0.0,
+         lambda s, r: (0.25 * s, (r[:, 2, 1] - r[:, 1, 2]) / s, (r[:, 0, 2] - r[:, 2, 0]) / s, (r[:, 1, 0] - r[:, 0, 1]) / s),
+         1.0 + trace),
+        ((r[:, 0, 0] >= r[:, 1, 1]) & (r[:, 0, 0] >= r[:, 2, 2]),
+         lambda s, r: ((r[:, 2, 1] - r[:, 1, 2]) / s, 0.25 * s, (r[:, 0, 1] + r[:, 1, 0]) / s, (r[:, 0, 2] + r[:, 2, 0]) / s),
+         1.0 + r[:, 0, 0] - r[:, 1, 1] - r[:, 2, 2]),
+        (r[:, 1, 1] >= r[:, 2, 2],
+         lambda s, r: ((r[:, 0, 2] - r[:, 2, 0]) / s, (r[:, 0, 1] + r[:, 1, 0]) / s, 0.25 * s, (r[:, 1, 2] + r[:, 2, 1]) / s),
+         1.0 + r[:, 1, 1] - r[:, 0, 0] - r[:, 2, 2]),
+        (np.ones(len(r), dtype=bool),
+         lambda s, r: ((r[:, 1, 0] - r[:, 0, 1]) / s, (r[:, 0, 2] + r[:, 2, 0]) / s, (r[:, 1, 2] + r[:, 2, 1]) / s, 0.25 * s),
+         1.0 + r[:, 2, 2] - r[:, 0, 0] - r[:, 1, 1]),
+        ]
+
+    todo = np.ones(len(r), dtype=bool)
+    for mask, formula, radicand in cases:
+        mask = mask & todo
+        if mask.any():
+            s = np.sqrt(np.maximum(radicand[mask], 1e-12)) * 2.0
+            q[mask] = np.stack(formula(s, r[mask]), axis=-1)
+        todo &= ~mask
+
+    q /= np.linalg.norm(q, axis=1)[:, np.newaxis]
+    return make_compatible_quaternions(q)
+
+
+def make_compatible_quaternions(q):
+    """ Flips the signs of (F, 4) quaternions in place so consecutive frames
+        take the shortest path, and returns them.
+    """
+    if len(q) > 1:
+        dots = np.einsum('ij,ij->i', q[1:], q[:-1])
+        signs = np.cumprod(np.where(dots < 0.0, -1.0, 1.0))
+        q[1:] *= signs[:, np.newaxis]
+    return q
+
+
+def quaternion_to_axis_angle(q):
+    w = np.clip(q[:, 0], -1.0, 1.0)
+    angle = 2.0 * np.arccos(w)
+    s = np.sqrt(np.maximum(1.0 - w * w, 0.0))
+    axis = np.where(s[:, np.newaxis] > 1e-6, q[:, 1:] / np.where(s > 1e-6, s, 1.0)[:, np.newaxis], [0.0, 1.0, 0.0])
+    return np.column_stack((angle, axis))
+
+
+def quaternion_to_euler(q, order):
+    """ Euler conversion goes through mathutils, which keeps consecutive
+        frames compatible (no 360 degree flips).
+    """
+    result = np.empty((len(q), 3))
+    prev = None
+    for i, quat in enumerate(q):
+        euler = Quaternion(quat).to_euler(order, prev) if prev is not None else Quaternion(quat).to_euler(order)
+        result[i] = euler
+        prev = euler
+    return result
+
+
+#=============================================
+# Sampling
+#=============================================
+
+def sample_pose(obj, frames, bone_names, props=()):
+    """ Evaluates the armature once per frame and records the pose matrices
+        of the given bones, and the values of (bone, custom property) pairs.
+        Returns ({bone: (F, 4, 4) array}, {(bone, prop): (F,) array}).
+    """
+    scene = bpy.context.scene
+    frame_current = scene.frame_current
+    pbones = obj.pose.bones
+
+    bone_names = sorted(set(bone_names))
+    props = sorted(set(props))
+    matrices = np.empty((len(bone_names), len(frames), 4, 4))
+    values = np.empty((len(props), len(frames)))
+
+    for i, f in enumerate(frames):
+        scene.frame_set(int(f), subframe=f - int(f))
+        for j, name in enumerate(bone_names):
+            matrices[j, i] = pbones[name].matrix
+        for j, (name, prop) in enumerate(props):
+            values[j, i] = pbones[name].get(prop, 0.0)
+
+    scene.frame_set(frame_current)
+
+    return ({name: matrices[j] for j, name in enumerate(bone_names)},
+            {key: values[j] for j, key in enumerate(props)})
+
+
+#=============================================
+# Snapping
+#=============================================
+
+class SnapStep:
+    """ Snaps bone to a target pose matrix array, matching only the given
+        channels ('location', 'rotation', 'scale').  A target of None
+        clears the channels to the rest pose.  Steps are solved in order,
+        so a step can use a bone snapped before it as parent.
+    """
+    def __init__(self, bone, target, channels=('location', 'rotation', 'scale')):
+        self.bone = bone
+        self.target = target
+        self.channels = channels
+
+
+def _rest(obj, name):
+    return np.array(obj.data.bones[name].matrix_local)
+
+
+def solve_snap(obj, steps, poses):
+    """ Computes the local transform (in the bone's own rest space) each
+        step's bone needs to reach its target, for all frames at once.
+        This is get_pose_matrix_in_other_space() of the rig UI, batched.
+
+        Returns a list of (step, local matrices).
+    """
+    pbones = obj.pose.bones
+    snapped = {}  # New pose matrices of the bones snapped so far
+    results = []
+
+    for step in steps:
+        pbone = pbones[step.bone]
+        rest = _rest(obj, step.bone)
+        frames = len(poses[step.bone])
+
+        if pbone.parent:
+            parent = pbone.parent.name
+            par_rest = _rest(obj, parent)
+            par_old = poses[parent]
+            par_new = snapped.get(parent, par_old)
+        else:
+            par_rest = np.identity(4)
+            par_old = par_new = np.tile(np.identity(4), (frames, 1, 1))
+
+        rest_space = _mul(_inv(rest), par_rest)
+        current = _mul(rest_space, _inv(par_old), poses[step.bone])
+        if step.target is None:
+            wanted = np.tile(np.identity(4), (frames, 1, 1))
+        else:
+            wanted = _mul(rest_space, _inv(par_new), step.target)
+
+        cur_loc, cur_rot, cur_scale = split_transform(current)
+        loc, rot, scale = split_transform(wanted)
+        if 'location' not in step.channels:
+            loc = cur_loc
+        if 'rotation' not in step.channels:
+            rot = cur_rot
+        if 'scale' not in step.channels:
+            scale = cur_scale
+        local = join_transform(loc, rot, scale)
+
+        snapped[step.bone] = _mul(par_new, _inv(par_rest), rest, local)
+        results.append((step, local))
+
+    return results
+
+
+#=============================================
+# Keyframe writing
+#=============================================
+
+def write_fcurve(action, data_path, index, group, frames, values):
+    """ Keys values at frames on an fcurve with a few foreach_set() calls
+        instead of one insert per key.  Keys already on those frames get
+        the new value in place, keeping their interpolation and handle
+        types, with their handles moved along like keyframe_insert() does.
+        Points are only added for the other frames.
+    """
+    fcu = action.fcurves.find(data_path, index)
+    if fcu is None:
+        fcu = action.fcurves.new(data_path, index, group)
+
+    points = fcu.keyframe_points
+    count = len(points)
+    co = np.empty(count * 2)
+    points.foreach_get('co', co)
+    co = co.reshape(-1, 2)
+    existing = {frame: i for i, frame in enumerate(co[:, 0])}
+
+    delta = np.zeros(count)
+    new = {}
+    for frame, value in zip(np.asarray(frames, dtype=float), np.asarray(values, dtype=float)):
+        i = existing.get(frame)
+        if i is None:
+            new[frame] = value
+        else:
+            delta[i] = value - co[i, 1]
+
+    if delta.any():
+        co[:, 1] += delta
+        for attr in ('handle_left', 'handle_right'):
+            handles = np.empty(count * 2)
+            points.foreach_get(attr, handles)
+            handles[1::2] += delta
+            points.foreach_set(attr, handles)
+
+    if new:
+        # New points go at the end, update() sorts them in with all
+        # their other attributes
+        points.add(len(new))
+        co = np.concatenate((co, np.array(sorted(new.items()), dtype=float)))
+
+    points.foreach_set('co', co.ravel())
+    fcu.update()
+
+
+def write_snap(obj, frames, results):
+    """ Keys the transform channels each snap step changed.
+    """
+    if not obj.animation_data:
+        obj.animation_data_create()
+    if not obj.animation_data.action:
+        obj.animation_data.action = bpy.data.actions.new(obj.name + "Action")
+    action = obj.animation_data.action
+
+    for step, local in results:
+        pbone = obj.pose.bones[step.bone]
+        bone = pbone.bone
+        path = 'pose.bones["%s"].' % step.bone
+        loc, rot, scale = split_transform(local)
+
+        if 'location' in step.channels:
+            if not bone.use_local_location:
+                # Location is applied in parent space, see set_pose_translation()
+                rest = _rest(obj, step.bone)
+                par_rest = _rest(obj, pbone.parent.name) if pbone.parent else np.identity(4)
+                q = split_transform(_mul(_inv(par_rest), rest)[np.newaxis])[1][0]
+                loc = np.einsum('ij,fj->fi', q, loc)
+            for i in range(3):
+                write_fcurve(action, path + 'location', i, step.bone, frames, loc[:, i])
+
+        if 'rotation' in step.channels:
+            quat = matrix_to_quaternion(rot)
+            mode = pbone.rotation_mode
+            if mode == 'QUATERNION':
+                prop, channels = 'rotation_quaternion', quat
+            elif mode == 'AXIS_ANGLE':
+                prop, channels = 'rotation_axis_angle', quaternion_to_axis_angle(quat)
+            else:
+                prop, channels = 'rotation_euler', quaternion_to_euler(quat, mode)
+            for i in range(channels.shape[1]):
+                write_fcurve(action, path + prop, i, step.bone, frames, channels[:, i])
+
+        if 'scale' in step.channels:
+            for i in range(3):
+                write_fcurve(action, path + 'scale', i, step.bone, frames, scale[:, i])
+
+
+#=============================================
+# Limb snapping
+#=============================================
+# These follow the fk2ik_*/ik2fk_* functions of the rig UI template.  names
+# is an entry of rigs.utils.get_limb_generated_names().
+
+def _fk_from_ik_bones(names):
+    c = names['controls']
+    ik = names['ik_ctrl']
+    if names['limb_type'] == 'arm':
+        return [c[1], c[2], c[3]], [c[0], ik[1], c[4]], None, None
+    return [c[1], c[2], c[3]], [c[0], ik[1], ik[2]], c[7], ik[2]
+
+
+def _ik_from_fk_bones(names):
+    c = names['controls']
+    ik = names['ik_ctrl']
+    if names['limb_type'] == 'arm':
+        return [c[1], c[2], c[3]], [c[0], ik[1], c[4]], None, None
+    return [c[1], c[2], c[7]], [c[0], ik[1], c[6]], c[5], ik[2]
+
+
+def snap_bones(obj, names, to_fk):
+    """ Returns the bones whose poses are needed to snap a limb.
+    """
+    pbones = obj.pose.bones
+    fk, ik, extra, extra_ik = _fk_from_ik_bones(names) if to_fk else _ik_from_fk_bones(names)
+    bones = fk + ik + [b for b in (extra, extra_ik) if b]
+    if not to_fk:
+        bones.append(names['pole'])
+    bones += [pbones[b].parent.name for b in bones if pbones[b].parent]
+    return bones
+
+
+def can_snap_to_fk(obj, names):
+    """ Legacy limbs (with auto_stretch) need their stretch property matched,
+        which is left to the rig UI operators.
+    """
+    fk, ik, extra, extra_ik = _fk_from_ik_bones(names)
+    return 'auto_stretch' not in obj.pose.bones[ik[2]].keys()
+
+
+def fk_from_ik_steps(obj, names, poses):
+    """ Snaps the FK chain of a limb to its IK chain (fk2ik_arm/fk2ik_leg).
+    """
+    fk, ik, mfoot, mfooti = _fk_from_ik_bones(names)
+    steps = [
+        SnapStep(fk[0], poses[ik[0]]),
+        SnapStep(fk[1], poses[ik[1]], ('rotation', 'scale')),
+        ]
+    if mfoot is None:
+        steps.append(SnapStep(fk[2], poses[ik[2]]))
+    else:
+        offset = _mul(_inv(_rest(obj, mfoot)), _rest(obj, fk[2]))
+        steps.append(SnapStep(fk[2], _mul(poses[mfooti], offset), ('rotation', 'scale')))
+    return steps
+
+
+def pole_positions(obj, names, poses):
+    """ Places the pole target in the bending plane of the FK chain, at
+        the same distance from the chain center as match_pole_target().
+    """
+    fk, ik, end, end_ik = _ik_from_fk_bones(names)
+    pbones = obj.pose.bones
+    length = pbones[ik[0]].length + pbones[ik[1]].length
+
+    first = poses[fk[0]]
+    second = poses[fk[1]]
+    a = first[:, :3, 3]
+    knee = second[:, :3, 3]
+    b = knee + second[:, :3, 1] / np.linalg.norm(second[:, :3, 1], axis=1)[:, np.newaxis] * pbones[fk[1]].length
+
+    ikv = b - a
+    ikv_dir = ikv / np.linalg.norm(ikv, axis=1)[:, np.newaxis]
+    bend = (knee - a) - ikv_dir * np.einsum('ij,ij->i', knee - a, ikv_dir)[:, np.newaxis]
+    bend_len = np.linalg.norm(bend, axis=1)
+
+    # A straight chain has no bending plane, keep the last known one
+    valid = bend_len > 1e-6 * length
+    if not valid.any():
+        return None
+    index = np.where(valid, np.arange(len(valid)), 0)
+    index = np.maximum.accumulate(index)
+    index[:np.argmax(valid)] = np.argmax(valid)
+    bend = bend[index] / bend_len[index][:, np.newaxis]
+
+    return _translation(a + ikv / 2 + bend * length)
+
+
+def ik_from_fk_steps(obj, names, poses):
+    """ Snaps the IK controls of a limb in pole mode to its FK chain
+        (ik2fk_arm/ik2fk_leg).  Returns None if the pole can't be placed.
+    """
+    fk, ik, footroll, mfooti = _ik_from_fk_bones(names)
+    poles = pole_positions(obj, names, poses)
+    if poles is None:
+        return None
+
+    if footroll is None:
+        steps = [SnapStep(ik[2], poses[fk[2]])]
+    else:
+        offset = _mul(_inv(_rest(obj, mfooti)), _rest(obj, ik[2]))
+        steps = [
+            SnapStep(ik[2], _mul(poses[fk[2]], offset)),
+            SnapStep(footroll, None, ('rotation',)),
+            ]
+
+    steps.append(SnapStep(names['pole'], poles, ('location',)))
+    return steps
@@ -0,0 +1,388 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+""" Headless rig generation.
+
+    Regenerates the rigs of one or more .blend files without a user
+    interface, e.g.:
+
+    blender -b --python-expr "import rigify.batch; rigify.batch.main()" -- --jobs 8 --output results chars/*.blend
+
+    With --jobs N the files are spread over N background Blender processes.
+    Every file gets a JSON result in the output directory, with the time,
+    bone count and error (if any) of each metarig it contains.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+
+import bpy
+
+from . import generate
+from . import profiler
+from .utils import MetarigError
+from .incremental import load_manifest
+
+SUMMARY_FILE = "summary.json"
+
+# Window manager settings a batch run changes, restored before saving
+BATCH_SETTINGS = (
+    'rigify_generate_mode',
+    'rigify_target_rig',
+    'rigify_rig_basename',
+    'rigify_profile_generation',
+    'rigify_use_generation_cache',
+    'rigify_incremental_generation',
+)
+
+
+#=============================================
+# Generation of the open file
+#=============================================
+
+def is_metarig(obj):
+    """ Returns whether the object is a metarig, i.e. an armature with rig
+        types on its bones that isn't a generated rig itself.
+    """
+    if obj.type != 'ARMATURE' or obj.data.get("rig_id") is not None:
+        return False
+    return any(pbone.rigify_type for pbone in obj.pose.bones)
+
+
+def find_metarigs(scene, names=None):
+    """ Returns the metarigs of the scene, or the ones with the given names.
+    """
+    if names:
+        missing = [name for name in names if name not in scene.objects]
+        if missing:
+            raise MetarigError("metarigs not found: " + ", ".join(missing))
+        return [scene.objects[name] for name in names]
+    return sorted((obj for obj in scene.objects if is_metarig(obj)), key=lambda obj: obj.name)
+
+
+def target_rig_name(scene, metarig, metarigs):
+    """ Returns the name of the rig to regenerate from the metarig.  That is
+        the rig it generated last time, or "rig" when the file only has one
+        metarig, like a generation from the Rigify panel would use.
+    """
+    for obj in scene.objects:
+        if obj.type == 'ARMATURE':
+            manifest = load_manifest(obj)
+            if manifest and manifest.get('metarig') == metarig.name:
+                return obj.name
+    if len(metarigs) == 1:
+        return "rig"
+    return metarig.name + "_rig"
+
+
+def generate_metarig(context, metarig, rig_name, use_profile=False, use_cache=True):
+    """ Generates one metarig into the named rig, and returns its result.
+        Errors are recorded in the result instead of raised.
+
+        With use_cache, the file's cache and incremental update settings
+        apply like from the Rigify panel: a rig generated from the same
+        metarig content and add-on source is left as it is.  Without it
+        every rig is built from scratch.
+    """
+    scene = context.scene
+    id_store = context.window_manager
+
+    # The settings are saved with the file, put the artist's values back
+    saved = {name: getattr(id_store, name) for name in BATCH_SETTINGS}
+    try:
+        id_store.rigify_generate_mode = 'overwrite'
+        id_store.rigify_target_rig = rig_name
+        id_store.rigify_rig_basename = ""
+        id_store.rigify_profile_generation = use_profile
+        if not use_cache:
+            id_store.rigify_use_generation_cache = False
+            id_store.rigify_incremental_generation = False
+
+        if context.active_object is not None and context.active_object.mode != 'OBJECT':
+            bpy.ops.object.mode_set(mode='OBJECT')
+        for obj in scene.objects:
+            obj.select = False
+        metarig.select = True
+        scene.objects.active = metarig
+
+        result = {
+            'metarig': metarig.name,
+            'rig': rig_name,
+            'metarig_bones': len(metarig.data.bones),
+            'bones': 0,
+            'time': 0.0,
+            'error': None,
+        }
+
+        t = time.time()
+        try:
+            generate.generate_rig(context, metarig)
+        except MetarigError as e:
+            result['error'] = e.message
+        except Exception:
+            result['error'] = traceback.format_exc()
+        result['time'] = time.time() - t
+
+        rig = scene.objects.get(id_store.rigify_target_rig)
+        if rig is not None:
+            result['rig'] = rig.name
+            result['bones'] = len(rig.data.bones)
+    finally:
+        for name, value in saved.items():
+            setattr(id_store, name, value)
+
+    if use_profile and profiler.last_profile() is not None:
+        result['profile'] = profiler.last_profile().as_dict()
+
+    return result
+
+
+def generate_file(context, metarig_names=None, save=True, use_profile=False, use_cache=True):
+    """ Regenerates the rigs of the open file, and returns the file result.
+    """
+    result = {
+        'file': bpy.data.filepath,
+        'rigs': [],
+        'time': 0.0,
+        'saved': False,
+        'error': None,
+    }
+
+    t = time.time()
+    try:
+        scene = context.scene
+        metarigs = find_metarigs(scene, metarig_names)
+        for metarig in metarigs:
+            rig_name = target_rig_name(scene, metarig, metarigs)
+            print("Rigify batch: generating '%s' from '%s'" % (rig_name, metarig.name))
+            result['rigs'].append(generate_metarig(context, metarig, rig_name, use_profile, use_cache))
+
+        if save and metarigs and not any(rig['error'] for rig in result['rigs']):
+            bpy.ops.wm.save_mainfile()
+            result['saved'] = True
+    except MetarigError as e:
+        result['error'] = e.message
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['time'] = time.time() - t
+
+    return result
+
+
+def failed(result):
+    return bool(result['error'] or any(rig['error'] for rig in result['rigs']))
+
+
+def write_result(path, result):
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+
+#=============================================
+# Worker pool
+#=============================================
+
+def result_paths(files, output):
+    """ Returns the JSON result path of each file.  Files with the same
+        name in different directories get numbered.
+    """
+    paths = []
+    taken = set()
+    for path in files:
+        base = os.path.splitext(os.path.basename(path))[0]
+        name = base
+        i = 1
+        while name in taken:
+            name = "%s.%03d" % (base, i)
+            i += 1
+        taken.add(name)
+        paths.append(os.path.join(output, name + ".json"))
+    return paths
+
+
+def worker_command(blend, result_path, args):
+    """ Returns the command line of a background Blender generating one file.
+    """
+    expr = "import %s.batch as batch; batch.main()" % __package__
+    command = [bpy.app.binary_path, "-b", blend, "--python-expr", expr, "--",
+               "--worker", "--output", result_path]
+    for name in args.metarig or []:
+        command += ["--metarig", name]
+    if args.no_save:
+        command.append("--no-save")
+    if args.profile:
+        command.append("--profile")
+    if args.no_cache:
+        command.append("--no-cache")
+    return command
+
+
+def run_workers(tasks, jobs, timeout=0):
+    """ Runs (key, command, result path) tasks as background processes, up
+        to jobs of them at once, each logging to a file next to its result.
+        Yields (key, result, exit code, seconds) as they finish.  The result
+        is the JSON the process wrote, or None if it wrote nothing; the exit
+        code of a killed process is "timeout".
+    """
+    pending = list(tasks)
+    running = []  # (process, key, result path, log file, start time)
+
+    while pending or running:
+        while pending and len(running) < jobs:
+            key, command, path = pending.pop(0)
+            log = open(os.path.splitext(path)[0] + ".log", 'w')
+            if os.path.exists(path):
+                os.remove(path)
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+            running.append((process, key, path, log, time.time()))
+
+        time.sleep(0.1)
+
+        for job in running[:]:
+            process, key, path, log, started = job
+            code = process.poll()
+            if code is None:
+                if timeout and time.time() - started > timeout:
+                    process.kill()
+                    process.wait()
+                    code = "timeout"
+                else:
+                    continue
+
+            running.remove(job)
+            log.close()
+
+            result = None
+            if os.path.exists(path):
+                with open(path) as f:
+                    result = json.load(f)
+            yield key, result, code, time.time() - started
+
+
+def run_pool(files, args):
+    """ Generates each file in its own background Blender, running up to
+        args.jobs of them at once.  Returns the file results.
+    """
+    paths = dict(zip(files, result_paths(files, args.output)))
+    tasks = [(blend, worker_command(blend, paths[blend], args), paths[blend]) for blend in files]
+    results = {}
+
+    for blend, result, code, seconds in run_workers(tasks, args.jobs, args.timeout):
+        if result is None:
+            # The worker crashed or was killed before writing anything
+            log = os.path.splitext(paths[blend])[0] + ".log"
+            result = {'file': blend, 'rigs': [], 'saved': False, 'time': seconds,
+                      'error': "Blender exited without a result (exit code: %s), see %s" % (code, log)}
+            write_result(paths[blend], result)
+
+        results[blend] = result
+        print("Rigify batch: %s %s (%.1f s)" % ("FAILED" if failed(result) else "done", blend, result['time']))
+
+    return [results[blend] for blend in files]
+
+
+def run_serial(files, args):
+    """ Generates the files one after the other in this Blender.
+    """
+    results = []
+    for blend, path in zip(files, result_paths(files, args.output)):
+        if blend != bpy.data.filepath:
+            bpy.ops.wm.open_mainfile(filepath=blend)
+        result = generate_file(bpy.context, args.metarig, not args.no_save, args.profile, not args.no_cache)
+        write_result(path, result)
+        results.append(result)
+        print("Rigify batch: %s %s (%.1f s)" % ("FAILED" if failed(result) else "done", blend, result['time']))
+    return results
+
+
+#=============================================
+# Command line
+#=============================================
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="blender -b --python-expr \"import rigify.batch; rigify.batch.main()\" --",
+        description="Regenerate the Rigify rigs of .blend files.")
+    parser.add_argument("files", nargs='*',
+                        help="blend files to regenerate, the open file if none are given")
+    parser.add_argument("--metarig", action='append',
+                        help="only generate this metarig, can be given more than once")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of background Blender processes to spread the files over")
+    parser.add_argument("-o", "--output", default="rigify_batch",
+                        help="directory for the JSON results (a file path with --worker)")
+    parser.add_argument("--timeout", type=float, default=0,
+                        help="seconds after which a worker process gets killed")
+    parser.add_argument("--no-save", action='store_true',
+                        help="don't save the files after generating")
+    parser.add_argument("--profile", action='store_true',
+                        help="include a generation profile in the results")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="rebuild every rig, even the ones whose metarig and rig types didn't change")
+    parser.add_argument("--worker", action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Command line entry point.  Takes the arguments after '--' when
+        none are given.
+    """
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parse_args(argv)
+
+    # The add-on may not be enabled in the user preferences
+    if not hasattr(bpy.types.WindowManager, "rigify_generate_mode"):
+        import addon_utils
+        addon_utils.enable(__package__, default_set=False)
+
+    if args.worker:
+        result = generate_file(bpy.context, args.metarig, not args.no_save, args.profile, not args.no_cache)
+        write_result(args.output, result)
+        sys.exit(1 if failed(result) else 0)
+
+    files = [os.path.abspath(path) for path in args.files] or [bpy.data.filepath]
+    if not all(files):
+        raise MetarigError("batch: no .blend files given and the open file isn't saved")
+    args.output = os.path.abspath(args.output)
+    os.makedirs(args.output, exist_ok=True)
+
+    t = time.time()
+    if args.jobs > 1 and len(files) > 1:
+        results = run_pool(files, args)
+    else:
+        results = run_serial(files, args)
+
+    failures = [result['file'] for result in results if failed(result)]
+    summary = {
+        'files': len(results),
+        'failed': failures,
+        'rigs': sum(len(result['rigs']) for result in results),
+        'time': time.time() - t,
+    }
+    write_result(os.path.join(args.output, SUMMARY_FILE), summary)
+
+    print("Rigify batch: %d files, %d failed, %.1f s" % (len(results), len(failures), summary['time']))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,346 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+""" Generation benchmarks.
+
+    Generates every bundled metarig and the sample of every rig type, each
+    in a fresh background Blender, and compares the results against a
+    baseline:
+
+    blender -b --factory-startup --python-expr "import rigify.benchmark; rigify.benchmark.main()" -- --jobs 4
+
+    Run it with --save-baseline to store the results as the new baseline,
+    or with --smoke to only check that generation works at all.
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+import bpy
+
+from . import batch
+from . import generate
+from . import profiler
+from . import template_list
+from .utils import MetarigError, get_rig_type
+from .metarig_menu import get_metarig_list
+
+MODULE_DIR = os.path.dirname(__file__)
+BASELINE_FILE = os.path.join(MODULE_DIR, "benchmark_baseline.json")
+
+# Allowed relative increase of each metric over the baseline.  Counts are
+# exact, a rig type making more bones or mode switches should be noticed.
+DEFAULT_THRESHOLDS = {
+    'time': 0.25,
+    'peak_memory': 0.10,
+    'blend_size': 0.10,
+    'mode_switches': 0.0,
+    'bones': 0.0,
+    'constraints': 0.0,
+    'drivers': 0.0,
+}
+
+# Case generated by --smoke
+SMOKE_CASE = "metarig:Basic/basic_human"
+
+# Increases below these absolute amounts are noise, whatever the threshold.
+NOISE = {
+    'time': 0.05,                   # seconds
+    'peak_memory': 4 * 1024 ** 2,   # bytes
+    'blend_size': 4096,             # bytes
+}
+
+
+#=============================================
+# Cases
+#=============================================
+
+def list_cases():
+    """ Returns the names of all benchmark cases: "metarig:<class>/<name>"
+        for the bundled metarigs and "sample:<rig type>" for the rig types
+        that have a sample.
+    """
+    cases = []
+    for metarig_class, metarigs in sorted(get_metarig_list("").items()):
+        for name, path, data_file in metarigs:
+            cases.append("metarig:%s/%s" % (metarig_class, name))
+
+    from . import rig_lists
+    for rig_type in sorted(rig_lists.rig_list):
+        try:
+            if hasattr(get_rig_type(rig_type), 'create_sample'):
+                cases.append("sample:" + rig_type)
+        except ImportError:
+            pass
+
+    return cases
+
+
+def create_case(context, case):
+    """ Creates the metarig of a case in the current scene, and returns it.
+    """
+    kind, name = case.split(":", 1)
+
+    if kind == 'metarig':
+        metarig_name = name.split("/")[-1]
+        getattr(bpy.ops.object, "armature_%s_metarig_add" % metarig_name)()
+        return context.active_object
+
+    if kind == 'sample':
+        bpy.ops.object.armature_add()
+        obj = context.active_object
+        obj.name = "metarig"
+        bpy.ops.object.mode_set(mode='EDIT')
+        bones = obj.data.edit_bones
+        bones.remove(bones[0])
+        template_list.fill_ui_template_list(obj)
+        get_rig_type(name).create_sample(obj)
+        bpy.ops.object.mode_set(mode='OBJECT')
+        return obj
+
+    raise MetarigError("benchmark: unknown case '%s'" % case)
+
+
+def peak_memory():
+    """ Returns the peak memory use of this process in bytes, or None where
+        the platform doesn't tell.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_case(context, case, repeat=1):
+    """ Generates the case's metarig repeat times, and returns the metrics of
+        the fastest run.
+    """
+    metarig = create_case(context, case)
+    id_store = context.window_manager
+    id_store.rigify_generate_mode = 'overwrite'
+    id_store.rigify_rig_basename = ""
+    id_store.rigify_profile_generation = True
+    # Every repeat has to rebuild the rig, not find it up to date
+    id_store.rigify_use_generation_cache = False
+    id_store.rigify_incremental_generation = False
+
+    times = []
+    for i in range(repeat):
+        context.scene.objects.active = metarig
+        id_store.rigify_target_rig = "rig"
+        t = time.time()
+        generate.generate_rig(context, metarig)
+        times.append(time.time() - t)
+
+    rig = context.scene.objects[id_store.rigify_target_rig]
+    constraints, drivers = generate.count_constraints_drivers(rig)
+    profile = profiler.last_profile()
+
+    path = os.path.join(tempfile.mkdtemp(), "benchmark.blend")
+    bpy.ops.wm.save_as_mainfile(filepath=path, copy=True)
+    blend_size = os.path.getsize(path)
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+    return {
+        'time': min(times),
+        'peak_memory': peak_memory(),
+        'blend_size': blend_size,
+        # set_mode() only profiles the calls that switch modes
+        'mode_switches': profile.totals['calls']['mode'],
+        'bones': len(rig.data.bones),
+        'constraints': constraints,
+        'drivers': drivers,
+    }
+
+
+def smoke(context):
+    """ Generates SMOKE_CASE once, the way a background run does, and
+        returns whether it made a rig.
+    """
+    try:
+        result = run_case(context, SMOKE_CASE)
+    except MetarigError as e:
+        print("Rigify smoke test: %s FAILED: %s" % (SMOKE_CASE, e.message))
+        return False
+    except Exception:
+        print("Rigify smoke test: %s FAILED\n%s" % (SMOKE_CASE, traceback.format_exc()))
+        return False
+
+    if not result['bones']:
+        print("Rigify smoke test: %s FAILED: the rig has no bones" % SMOKE_CASE)
+        return False
+    print("Rigify smoke test: %s %.3f s, %d bones" % (SMOKE_CASE, result['time'], result['bones']))
+    return True
+
+
+#=============================================
+# Baseline comparison
+#=============================================
+
+def compare(results, baseline, thresholds):
+    """ Returns a list of (case, metric, baseline value, value) for every
+        metric that grew past its threshold.
+    """
+    regressions = []
+    for case, metrics in sorted(results.items()):
+        if case not in baseline or 'error' in metrics:
+            continue
+        for metric, threshold in thresholds.items():
+            old = baseline[case].get(metric)
+            new = metrics.get(metric)
+            if old is None or new is None:
+                continue
+            if new - old > old * threshold and new - old > NOISE.get(metric, 0):
+                regressions.append((case, metric, old, new))
+    return regressions
+
+
+def parse_thresholds(values):
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for value in values or []:
+        metric, sep, number = value.partition("=")
+        if metric not in thresholds or not sep:
+            raise MetarigError("benchmark: bad threshold '%s', use <metric>=<relative increase>" % value)
+        thresholds[metric] = float(number)
+    return thresholds
+
+
+#=============================================
+# Command line
+#=============================================
+
+def worker_command(case, result_path, args):
+    expr = "import %s.benchmark as benchmark; benchmark.main()" % __package__
+    return [bpy.app.binary_path, "-b", "--factory-startup", "--python-expr", expr, "--",
+            "--worker", case, "--output", result_path, "--repeat", str(args.repeat)]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="blender -b --factory-startup --python-expr \"import rigify.benchmark; rigify.benchmark.main()\" --",
+        description="Benchmark Rigify generation against a baseline.")
+    parser.add_argument("cases", nargs='*', default=["*"],
+                        help="cases to run, as names or patterns like 'sample:faces.*' (default: all)")
+    parser.add_argument("--list", action='store_true', help="list the cases and exit")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of cases to run at once; timings are steadier with 1")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="generations per case, the fastest one counts")
+    parser.add_argument("-o", "--output", default="rigify_benchmark",
+                        help="directory for the results and worker logs")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action='store_true',
+                        help="store the results of this run as the baseline")
+    parser.add_argument("--threshold", action='append', metavar="METRIC=VALUE",
+                        help="allowed relative increase of a metric, e.g. time=0.5")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds allowed per case")
+    parser.add_argument("--smoke", action='store_true',
+                        help="generate %s once in this Blender and exit, without a baseline" % SMOKE_CASE)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Command line entry point.  Takes the arguments after '--' when
+        none are given.
+    """
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parse_args(argv)
+
+    if not hasattr(bpy.types.WindowManager, "rigify_generate_mode"):
+        import addon_utils
+        addon_utils.enable(__package__, default_set=False)
+
+    if args.worker:
+        try:
+            result = run_case(bpy.context, args.worker, args.repeat)
+        except MetarigError as e:
+            result = {'error': e.message}
+        except Exception:
+            result = {'error': traceback.format_exc()}
+        batch.write_result(args.output, result)
+        sys.exit(1 if 'error' in result else 0)
+
+    if args.smoke:
+        sys.exit(0 if smoke(bpy.context) else 1)
+
+    thresholds = parse_thresholds(args.threshold)
+    all_cases = list_cases()
+    cases = [case for case in all_cases if any(fnmatch.fnmatchcase(case, p) for p in args.cases)]
+    if args.list:
+        print("\n".join(cases))
+        sys.exit(0)
+
+    output = os.path.abspath(args.output)
+    os.makedirs(output, exist_ok=True)
+    paths = {case: os.path.join(output, case.replace(":", "-").replace("/", "-") + ".json") for case in cases}
+    tasks = [(case, worker_command(case, paths[case], args), paths[case]) for case in cases]
+
+    results = {}
+    for case, result, code, seconds in batch.run_workers(tasks, args.jobs, args.timeout):
+        if result is None:
+            result = {'error': "Blender exited without a result (exit code: %s)" % code}
+        results[case] = result
+        if 'error' in result:
+            print("Rigify benchmark: %s FAILED" % case)
+        else:
+            print("Rigify benchmark: %s %.3f s, %d bones" % (case, result['time'], result['bones']))
+    batch.write_result(os.path.join(output, "results.json"), results)
+
+    failures = sorted(case for case, result in results.items() if 'error' in result)
+    for case in failures:
+        print("Failed: %s, see %s" % (case, os.path.splitext(paths[case])[0] + ".log"))
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update((case, result) for case, result in results.items() if 'error' not in result)
+        batch.write_result(args.baseline, baseline)
+        print("Baseline saved to " + args.baseline)
+        sys.exit(1 if failures else 0)
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at %s, run with --save-baseline to create one" % args.baseline)
+        sys.exit(1 if failures else 0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, thresholds)
+    for case, metric, old, new in regressions:
+        print("Regression: %s %s %s -> %s (%+.1f%%)" % (case, metric, old, new, 100.0 * (new - old) / (old or 1)))
+    missing = sorted(set(results) - set(baseline))
+    if missing:
+        print("Not in the baseline: " + ", ".join(missing))
+
+    print("Rigify benchmark: %d cases, %d failed, %d regressions" % (len(results), len(failures), len(regressions)))
+    sys.exit(1 if failures or regressions else 0)
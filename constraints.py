@@ -0,0 +1,116 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+from .utils import MetarigError, set_mode
+
+# Named constraint recipes, see register_recipe()
+RECIPES = {}
+
+
+#=============================================
+# Recipes
+#=============================================
+
+def register_recipe(name, *constraints):
+    """ Registers a named list of constraints that rigs can apply to a bone
+        in one call, e.g.:
+
+        register_recipe('def_tweak',
+                        {'constraint': 'DAMPED_TRACK'},
+                        {'constraint': 'STRETCH_TO'})
+
+        Each constraint is a dict with its type under 'constraint' and the
+        values of its properties, the same format make_constraint() takes.
+        The subtarget is given when the recipe is applied.
+    """
+    RECIPES[name] = [dict(c) for c in constraints]
+
+
+def get_recipe(name):
+    try:
+        return RECIPES[name]
+    except KeyError:
+        raise MetarigError("RIGIFY ERROR: unknown constraint recipe '%s'" % name)
+
+
+#=============================================
+# Constraint creation
+#=============================================
+
+def _new_constraint(obj, pbone, constraint):
+    con = pbone.constraints.new(constraint['constraint'])
+    if hasattr(con, 'target'):
+        con.target = constraint.get('target', obj)
+
+    # Only the properties the constraint type has are set, so one dict
+    # can describe several types
+    for attr, value in constraint.items():
+        if attr not in ('constraint', 'target') and hasattr(con, attr):
+            setattr(con, attr, value)
+    return con
+
+
+def make_constraint(obj, bone, constraint):
+    """ Adds one constraint, described as a dict like the constraints of a
+        recipe, to a bone of obj.  Unless given, the target is obj itself.
+    """
+    set_mode('OBJECT')
+    return _new_constraint(obj, obj.pose.bones[bone], constraint)
+
+
+class ConstraintBatch:
+    """ Collects constraints and recipes for many bones, and adds them all
+        in a single pose pass with apply().  Constraints are created in the
+        order they were added, so code reading constraints[i] afterwards
+        sees the same stack as with immediate creation.
+    """
+    def __init__(self, obj):
+        self.obj = obj
+        self.queue = []     # (bone, constraint dict)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def add(self, bone, constraint):
+        """ Queues one constraint dict, see make_constraint().
+        """
+        self.queue.append((bone, constraint))
+
+    def add_recipe(self, name, bone, subtarget, influence=None, **props):
+        """ Queues the constraints of a recipe on a bone, all targeting
+            subtarget.  influence and any other properties given override
+            the recipe's values.
+        """
+        for constraint in get_recipe(name):
+            constraint = dict(constraint, subtarget=subtarget, **props)
+            if influence is not None:
+                constraint['influence'] = influence
+            self.queue.append((bone, constraint))
+
+    def apply(self):
+        """ Creates every queued constraint, and empties the queue.
+        """
+        if not self.queue:
+            return
+        set_mode('OBJECT')
+        pbones = self.obj.pose.bones
+        queue, self.queue = self.queue, []
+        for bone, constraint in queue:
+            _new_constraint(self.obj, pbones[bone], constraint)
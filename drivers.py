@@ -0,0 +1,341 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+""" Driver creation that keeps drivers off the Python path.
+
+    Blender evaluates scripted drivers whose expression only uses
+    arithmetic, comparisons, conditionals and a few math functions on the
+    driver variables without Python.  The others need the Python
+    interpreter, one at a time.  Rigs build their drivers through
+    make_driver(), and generation runs optimize_drivers() over the whole
+    rig, which rewrite expressions into an equivalent form that qualifies
+    where there is one:
+
+    - a lone variable, a sum of all the variables, or min()/max() of them
+      become SUM/MIN/MAX drivers, which need no expression at all
+    - x ** y becomes pow(x, y), math.sin(x) becomes sin(x)
+    - calls of registered functions (see register_inline()) are replaced
+      by their expression
+"""
+
+import ast
+
+# What Blender's simple expression evaluator handles without Python.
+SIMPLE_FUNCTIONS = {
+    'abs', 'fabs', 'floor', 'ceil', 'trunc', 'int', 'min', 'max', 'radians', 'degrees',
+    'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'atan2', 'exp', 'log', 'sqrt', 'pow', 'fmod',
+}
+SIMPLE_CONSTANTS = {'pi', 'True', 'False', 'frame'}
+
+_CONSTANT = getattr(ast, 'Constant', ast.Num)
+SIMPLE_NODES = (
+    ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.IfExp, ast.Call,
+    ast.Name, ast.Load, ast.Num, ast.NameConstant, _CONSTANT,
+    ast.And, ast.Or, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.UAdd, ast.USub, ast.Not,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+_OPERATORS = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+    ast.UAdd: '+', ast.USub: '-', ast.Not: 'not ',
+    ast.And: ' and ', ast.Or: ' or ',
+    ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+}
+
+# Driver namespace functions that can be replaced by an expression,
+# see register_inline()
+INLINE_FUNCTIONS = {}
+
+
+#=============================================
+# Expressions
+#=============================================
+
+def register_inline(name, params, expression, defaults=None):
+    """ Lets optimize_drivers() replace calls of a driver namespace function
+        by an equivalent expression of its parameters, e.g.:
+
+        register_inline('lerp', ('a', 'b', 't'), "a + (b - a) * t")
+
+        defaults gives the values of optional parameters.
+    """
+    INLINE_FUNCTIONS[name] = (tuple(params), ast.parse(expression, mode='eval').body, dict(defaults or {}))
+
+
+def is_simple_expression(expression, variables=()):
+    """ Returns whether a scripted driver expression can be evaluated by
+        Blender's simple expression evaluator, which doesn't need Python.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        return False
+
+    names = set(variables) | SIMPLE_CONSTANTS
+    for node in ast.walk(tree):
+        if not isinstance(node, SIMPLE_NODES):
+            return False
+        if isinstance(node, _CONSTANT) and isinstance(getattr(node, 'value', 0), (str, bytes)):
+            return False
+        if isinstance(node, ast.Name) and node.id not in names and node.id not in SIMPLE_FUNCTIONS:
+            return False
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in SIMPLE_FUNCTIONS:
+                return False
+            if node.keywords:
+                return False
+    return True
+
+
+def _call(name, args):
+    return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+
+
+def _substitute(node, values):
+    """ Returns a copy of an expression tree with names replaced by trees.
+    """
+    if isinstance(node, ast.Name) and node.id in values:
+        return values[node.id]
+    node = type(node)(**{field: getattr(node, field) for field in node._fields})
+    for field in node._fields:
+        value = getattr(node, field)
+        if isinstance(value, ast.AST):
+            setattr(node, field, _substitute(value, values))
+        elif isinstance(value, list):
+            setattr(node, field, [_substitute(v, values) if isinstance(v, ast.AST) else v for v in value])
+    return node
+
+
+def _rewrite(node):
+    """ Replaces the constructs the simple expression evaluator lacks by
+        equivalent ones it has.  Returns the new tree and whether anything
+        changed.
+    """
+    changed = False
+
+    for field in node._fields:
+        value = getattr(node, field)
+        if isinstance(value, ast.AST):
+            value, c = _rewrite(value)
+            setattr(node, field, value)
+            changed |= c
+        elif isinstance(value, list):
+            items = []
+            for v in value:
+                if isinstance(v, ast.AST):
+                    v, c = _rewrite(v)
+                    changed |= c
+                items.append(v)
+            setattr(node, field, items)
+
+    # math.sin(x) -> sin(x), math.pi -> pi
+    if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'math'
+            and (node.attr in SIMPLE_FUNCTIONS or node.attr == 'pi')):
+        return ast.Name(id=node.attr, ctx=ast.Load()), True
+
+    # x ** y -> pow(x, y)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow):
+        return _call('pow', [node.left, node.right]), True
+
+    # f(a, b) -> the registered expression of f
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in INLINE_FUNCTIONS:
+        params, body, defaults = INLINE_FUNCTIONS[node.func.id]
+        values = {}
+        for param, arg in zip(params, node.args):
+            values[param] = arg
+        for keyword in node.keywords:
+            values[keyword.arg] = keyword.value
+        for param in params:
+            if param not in values and param in defaults:
+                values[param] = ast.parse(repr(defaults[param]), mode='eval').body
+        if set(values) == set(params) and len(node.args) <= len(params):
+            return _substitute(body, values), True
+
+    return node, changed
+
+
+def _source(node):
+    """ Turns an expression tree of the simple subset back into source,
+        with every operation parenthesized.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, (_CONSTANT, ast.Num, ast.NameConstant)):
+        value = node.n if isinstance(node, ast.Num) and not hasattr(node, 'value') else node.value
+        if isinstance(value, (str, bytes)):
+            raise ValueError("strings aren't simple")
+        return repr(value)
+    if isinstance(node, ast.BinOp):
+        return "(%s %s %s)" % (_source(node.left), _OPERATORS[type(node.op)], _source(node.right))
+    if isinstance(node, ast.UnaryOp):
+        return "(%s%s)" % (_OPERATORS[type(node.op)], _source(node.operand))
+    if isinstance(node, ast.BoolOp):
+        return "(%s)" % _OPERATORS[type(node.op)].join(_source(v) for v in node.values)
+    if isinstance(node, ast.Compare):
+        parts = [_source(node.left)]
+        for op, comparator in zip(node.ops, node.comparators):
+            parts += [_OPERATORS[type(op)], _source(comparator)]
+        return "(%s)" % " ".join(parts)
+    if isinstance(node, ast.IfExp):
+        return "(%s if %s else %s)" % (_source(node.body), _source(node.test), _source(node.orelse))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        return "%s(%s)" % (node.func.id, ", ".join(_source(a) for a in node.args))
+    raise ValueError("can't write %s" % type(node).__name__)
+
+
+def _driver_type(node, variables):
+    """ Returns the driver type computing the expression tree without an
+        expression, or None.  That is a lone variable or the sum, min() or
+        max() of all the variables, each used once.
+    """
+    if isinstance(node, ast.Name):
+        names = [node.id]
+        kind = 'SUM'
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in ('min', 'max'):
+        if node.keywords or not all(isinstance(a, ast.Name) for a in node.args):
+            return None
+        names = [a.id for a in node.args]
+        kind = node.func.id.upper()
+    else:
+        names = []
+        terms = [node]
+        while terms:
+            term = terms.pop()
+            if isinstance(term, ast.BinOp) and isinstance(term.op, ast.Add):
+                terms += [term.left, term.right]
+            elif isinstance(term, ast.Name):
+                names.append(term.id)
+            else:
+                return None
+        kind = 'SUM'
+
+    if sorted(names) == sorted(variables) and len(set(names)) == len(names):
+        return kind
+    return None
+
+
+def simplify_expression(expression, variables=()):
+    """ Returns (driver type, expression, simple) for a scripted driver
+        expression on the given variables: the cheapest equivalent driver
+        type and expression, and whether it avoids Python.  Expressions
+        that can't be made simple are returned unchanged.
+    """
+    variables = list(variables)
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        return 'SCRIPTED', expression, False
+
+    # Variables hiding a function or module name keep the expression as is
+    if set(variables) & (set(INLINE_FUNCTIONS) | {'math'}):
+        return 'SCRIPTED', expression, is_simple_expression(expression, variables)
+    tree.body, changed = _rewrite(tree.body)
+
+    driver_type = _driver_type(tree.body, variables)
+    if driver_type is not None:
+        return driver_type, "", True
+
+    if not changed:
+        return 'SCRIPTED', expression, is_simple_expression(expression, variables)
+    try:
+        source = _source(tree.body)
+    except ValueError:
+        return 'SCRIPTED', expression, False
+    if source.startswith("(") and isinstance(tree.body, (ast.BinOp, ast.UnaryOp, ast.BoolOp,
+                                                         ast.Compare, ast.IfExp)):
+        source = source[1:-1]
+    if not is_simple_expression(source, variables):
+        return 'SCRIPTED', expression, False
+    return 'SCRIPTED', source, True
+
+
+#=============================================
+# Drivers
+#=============================================
+
+def is_python_driver(driver):
+    """ Returns whether a driver is evaluated through Python.
+    """
+    if driver.type != 'SCRIPTED':
+        return False
+    if getattr(driver, 'use_self', False):
+        return True
+    return not is_simple_expression(driver.expression, [var.name for var in driver.variables])
+
+
+def optimize_driver(driver):
+    """ Rewrites a scripted driver into its cheapest equivalent form.
+        Returns whether it still needs Python.
+    """
+    if driver.type != 'SCRIPTED' or getattr(driver, 'use_self', False):
+        return is_python_driver(driver)
+
+    driver_type, expression, simple = simplify_expression(
+        driver.expression, [var.name for var in driver.variables])
+    if driver_type != 'SCRIPTED':
+        driver.type = driver_type
+    elif expression != driver.expression:
+        driver.expression = expression
+    return not simple
+
+
+def all_drivers(obj):
+    """ Yields the drivers of an object and its data.
+    """
+    for data in (obj, obj.data):
+        if data is not None and data.animation_data:
+            for fcu in data.animation_data.drivers:
+                yield fcu
+
+
+def optimize_drivers(obj):
+    """ Runs optimize_driver() on every driver of an object and its data.
+        Returns the F-curves of the drivers that still need Python.
+    """
+    return [fcu for fcu in all_drivers(obj) if optimize_driver(fcu.driver)]
+
+
+def make_driver(owner, data_path, index=-1, type='SCRIPTED', expression='', variables=()):
+    """ Adds a driver to owner (an ID or a struct like a pose bone or a
+        constraint) and returns its F-curve.  variables is a list of dicts
+        with 'name', 'type' (default 'SINGLE_PROP') and 'targets', a list of
+        target attribute dicts.  Targets without an 'id' point to owner's ID.
+
+        Scripted expressions are simplified, see simplify_expression().
+    """
+    if type == 'SCRIPTED':
+        type, expression, simple = simplify_expression(expression, [v['name'] for v in variables])
+
+    fcu = owner.driver_add(data_path, index)
+    drv = fcu.driver
+    drv.type = type
+    if type == 'SCRIPTED':
+        drv.expression = expression
+    for var_spec in variables:
+        var = drv.variables.new()
+        var.name = var_spec['name']
+        var.type = var_spec.get('type', 'SINGLE_PROP')
+        for i, tar_spec in enumerate(var_spec['targets']):
+            tar = var.targets[i]
+            tar.id = tar_spec.get('id', owner.id_data)
+            for attr, value in tar_spec.items():
+                if attr != 'id':
+                    setattr(tar, attr, value)
+    return fcu
@@ -19,18 +19,26 @@
 # <pep8 compliant>
 
 import bpy
+import importlib
 import re
 import time
 import traceback
 import sys
+from itertools import groupby
 from rna_prop_ui import rna_idprop_ui_prop_get
 
 from .utils import MetarigError, new_bone, get_rig_type
-from .utils import ORG_PREFIX, MCH_PREFIX, DEF_PREFIX, WGT_PREFIX, ROOT_NAME, make_original_name
+from .utils import set_mode, EditSession
+from . import profiler
+from .plan import GenerationPlan
+from .drivers import optimize_drivers
+from .incremental import metarig_manifest, manifest_id, load_manifest, store_manifest
+from .incremental import damaged_rigs, find_dirty_rigs, reset_rig_components
+from .utils import ORG_PREFIX, MCH_PREFIX, DEF_PREFIX, WGT_PREFIX, ROOT_NAME, make_original_name, strip_org
 from .utils import RIG_DIR
-from .utils import create_root_widget
-from .utils import random_id
-from .utils import copy_attributes
+from .utils import create_root_widget, share_widget_meshes, WGT_SHAPE_PROP
+from .utils import clear_widget_registry, get_widget_object
+from .utils import copy_attributes, copy_keyframe_points, rna_writable_properties
 
 from .utils import gamma_correct
 from .utils import get_ui_template_module
@@ -45,25 +53,31 @@ WGT_LAYERS = [x == 19 for x in range(0, 20)]  # Widgets go on the last scene lay
 
 
 class Timer:
-    def __init__(self):
+    def __init__(self, profile=None):
         self.timez = time.time()
+        self.profile = profile
 
     def tick(self, string):
         t = time.time()
         print(string + "%.3f" % (t - self.timez))
+        if self.profile is not None:
+            self.profile.add_phase(string.rstrip(": "), t - self.timez)
         self.timez = t
 
 
 # TODO: generalize to take a group as input instead of an armature.
 def generate_rig(context, metarig):
     """ Generates a rig from a metarig.
-
+        Returns True if the rig was up to date and left as it is.
     """
-    t = Timer()
+    if len(metarig.data.rigify_templates) == 0:
+        raise MetarigError("RIGIFY ERROR: the metarig has no UI template list, initialize it from the Rigify panel")
 
-    # Random string with time appended so that
-    # different rigs don't collide id's
-    rig_id = random_id(16)
+    profile = None
+    if context.window_manager.rigify_profile_generation:
+        profile = profiler.start(metarig.name)
+    t = Timer(profile)
+    clear_widget_registry()
 
     # Initial configuration
     # mode_orig = context.mode  # UNUSED
@@ -108,9 +122,44 @@ def generate_rig(context, metarig):
     id_store.rigify_target_rig = obj.name
     obj.data.pose_position = 'POSE'
 
-    # Get rid of anim data in case the rig already existed
-    print("Clear rig animation data.")
-    obj.animation_data_clear()
+    # Find the rig components whose metarig bones changed since the last
+    # generation.  dirty_rigs is None when everything must be rebuilt.
+    manifest = metarig_manifest(metarig)
+    manifest['rig_name'] = obj.name
+    manifest['metarig'] = metarig.name
+    old_manifest = load_manifest(obj)
+
+    # The rig id is a hash of the metarig content, so an unchanged metarig
+    # keeps its id, and its UI classes replace themselves when re-run
+    rig_id = manifest_id(manifest)
+    old_rig_id = obj.data.get("rig_id")
+
+    dirty_rigs = None
+    if id_store.rigify_generate_mode == 'overwrite' and not id_store.rigify_force_widget_update \
+            and old_manifest and old_manifest.get('rig_name') == obj.name:
+        # Components whose bones were deleted from the rig since it was
+        # generated get rebuilt, None means the ORG bones are gone too
+        damaged = damaged_rigs(old_manifest, obj)
+        if damaged is not None:
+            if id_store.rigify_use_generation_cache and old_rig_id == rig_id and not damaged:
+                # Generated from the same content before, nothing to rebuild
+                dirty_rigs = set()
+            elif id_store.rigify_incremental_generation:
+                dirty_rigs = find_dirty_rigs(old_manifest, manifest, damaged)
+
+    if dirty_rigs is not None and not dirty_rigs:
+        print("Rig is up to date.")
+        metarig.data.pose_position = rest_backup
+        ensure_rig_ui(id_store.rigify_rig_ui, old_rig_id)
+        profiler.stop()
+        return True
+
+    if dirty_rigs is None:
+        # Get rid of anim data in case the rig already existed
+        print("Clear rig animation data.")
+        obj.animation_data_clear()
+    else:
+        print("Rebuild rig components: " + ", ".join(sorted(dirty_rigs)))
 
     # Select generated rig object
     metarig.select = False
@@ -126,6 +175,9 @@ def generate_rig(context, metarig):
                 context.scene.layers[i] = True
         for wgt in bpy.data.objects[wgts_group_name].children:
             wgt.select = True
+            # Shared widget shapes get rebuilt too
+            if wgt.type == 'MESH' and WGT_SHAPE_PROP in wgt.data:
+                del wgt.data[WGT_SHAPE_PROP]
         bpy.ops.object.delete(use_global=False)
         for i, lyr in enumerate(WGT_LAYERS):
             if lyr:
@@ -140,142 +192,25 @@ def generate_rig(context, metarig):
     for child in obj.children:
         childs[child] = child.parent_bone
 
-    # Remove all bones from the generated rig armature.
-    bpy.ops.object.mode_set(mode='EDIT')
-    for bone in obj.data.edit_bones:
-        obj.data.edit_bones.remove(bone)
-    bpy.ops.object.mode_set(mode='OBJECT')
-
-    # Create temporary duplicates for merging
-    temp_rig_1 = metarig.copy()
-    temp_rig_1.data = metarig.data.copy()
-    scene.objects.link(temp_rig_1)
-
-    temp_rig_2 = metarig.copy()
-    temp_rig_2.data = obj.data
-    scene.objects.link(temp_rig_2)
-
-    # Select the temp rigs for merging
-    for objt in scene.objects:
-        objt.select = False  # deselect all objects
-    temp_rig_1.select = True
-    temp_rig_2.select = True
-    scene.objects.active = temp_rig_2
-
-    # Merge the temporary rigs
-    bpy.ops.object.join()
-
-    # Delete the second temp rig
-    bpy.ops.object.delete()
-
-    # Select the generated rig
-    for objt in scene.objects:
-        objt.select = False  # deselect all objects
-    obj.select = True
-    scene.objects.active = obj
-
-    # Copy over bone properties
-    for bone in metarig.data.bones:
-        bone_gen = obj.data.bones[bone.name]
-
-        # B-bone stuff
-        bone_gen.bbone_segments = bone.bbone_segments
-        bone_gen.bbone_in = bone.bbone_in
-        bone_gen.bbone_out = bone.bbone_out
-
-    # Copy over the pose_bone properties
-    for bone in metarig.pose.bones:
-        bone_gen = obj.pose.bones[bone.name]
-
-        # Rotation mode and transform locks
-        bone_gen.rotation_mode = bone.rotation_mode
-        bone_gen.lock_rotation = tuple(bone.lock_rotation)
-        bone_gen.lock_rotation_w = bone.lock_rotation_w
-        bone_gen.lock_rotations_4d = bone.lock_rotations_4d
-        bone_gen.lock_location = tuple(bone.lock_location)
-        bone_gen.lock_scale = tuple(bone.lock_scale)
-
-        # rigify_type and rigify_parameters
-        bone_gen.rigify_type = bone.rigify_type
-        for prop in dir(bone_gen.rigify_parameters):
-            if (not prop.startswith("_")) \
-            and (not prop.startswith("bl_")) \
-            and (prop != "rna_type"):
-                try:
-                    setattr(bone_gen.rigify_parameters, prop, \
-                            getattr(bone.rigify_parameters, prop))
-                except AttributeError:
-                    print("FAILED TO COPY PARAMETER: " + str(prop))
-
-        # Custom properties
-        for prop in bone.keys():
-            try:
-                bone_gen[prop] = bone[prop]
-            except KeyError:
-                pass
-
-        # Constraints
-        for con1 in bone.constraints:
-            con2 = bone_gen.constraints.new(type=con1.type)
-            copy_attributes(con1, con2)
-
-            # Set metarig target to rig target
-            if "target" in dir(con2):
-                if con2.target == metarig:
-                    con2.target = obj
-
-    # Copy drivers
-    if metarig.animation_data:
-        for d1 in metarig.animation_data.drivers:
-            d2 = obj.driver_add(d1.data_path)
-            copy_attributes(d1, d2)
-            copy_attributes(d1.driver, d2.driver)
-
-            # Remove default modifiers, variables, etc.
-            for m in d2.modifiers:
-                d2.modifiers.remove(m)
-            for v in d2.driver.variables:
-                d2.driver.variables.remove(v)
-
-            # Copy modifiers
-            for m1 in d1.modifiers:
-                m2 = d2.modifiers.new(type=m1.type)
-                copy_attributes(m1, m2)
-
-            # Copy variables
-            for v1 in d1.driver.variables:
-                v2 = d2.driver.variables.new()
-                copy_attributes(v1, v2)
-                for i in range(len(v1.targets)):
-                    copy_attributes(v1.targets[i], v2.targets[i])
-                    # Switch metarig targets to rig targets
-                    if v2.targets[i].id == metarig:
-                        v2.targets[i].id = obj
-
-                    # Mark targets that may need to be altered after rig generation
-                    tar = v2.targets[i]
-                    # If a custom property
-                    if v2.type == 'SINGLE_PROP' \
-                    and re.match('^pose.bones\["[^"\]]*"\]\["[^"\]]*"\]$', tar.data_path):
-                        tar.data_path = "RIGIFY-" + tar.data_path
-
-            # Copy key frames
-            for i in range(len(d1.keyframe_points)):
-                d2.keyframe_points.add()
-                k1 = d1.keyframe_points[i]
-                k2 = d2.keyframe_points[i]
-                copy_attributes(k1, k2)
+    if dirty_rigs is None:
+        duplicate_metarig(context, metarig, obj)
+    else:
+        reset_rig_components(metarig, obj, old_manifest, manifest, dirty_rigs,
+                             lambda bone, bone_gen: copy_pose_settings(metarig, obj, bone, bone_gen))
 
     t.tick("Duplicate rig: ")
     #----------------------------------
     # Make a list of the original bones so we can keep track of them.
-    original_bones = [bone.name for bone in obj.data.bones]
-
-    # Add the ORG_PREFIX to the original bones.
-    bpy.ops.object.mode_set(mode='OBJECT')
-    for i in range(0, len(original_bones)):
-        obj.data.bones[original_bones[i]].name = make_original_name(original_bones[i])
-        original_bones[i] = make_original_name(original_bones[i])
+    set_mode('OBJECT')
+    if dirty_rigs is None:
+        original_bones = [bone.name for bone in obj.data.bones]
+
+        # Add the ORG_PREFIX to the original bones.
+        for i in range(0, len(original_bones)):
+            obj.data.bones[original_bones[i]].name = make_original_name(original_bones[i])
+            original_bones[i] = make_original_name(original_bones[i])
+    else:
+        original_bones = [make_original_name(bone.name) for bone in metarig.data.bones]
 
     # Create a sorted list of the original bones, sorted in the order we're
     # going to traverse them for rigging.
@@ -286,21 +221,28 @@ def generate_rig(context, metarig):
     bones_sorted.sort()  # first sort by names
     bones_sorted.sort(key=lambda bone: len(obj.pose.bones[bone].parent_recursive))  # then parents before children
 
+    # Only the changed rig components get generated again
+    if dirty_rigs is not None:
+        bones_sorted = [bone for bone in bones_sorted if strip_org(bone) in dirty_rigs]
+
     t.tick("Make list of org bones: ")
     #----------------------------------
     # Create the root bone.
-    bpy.ops.object.mode_set(mode='EDIT')
-    root_bone = new_bone(obj, ROOT_NAME)
-    spread = get_xy_spread(metarig.data.bones) or metarig.data.bones[0].length
-    spread = float('%.3g' % spread)
-    scale = spread/0.589
-    obj.data.edit_bones[root_bone].head = (0, 0, 0)
-    obj.data.edit_bones[root_bone].tail = (0, scale, 0)
-    obj.data.edit_bones[root_bone].roll = 0
-    bpy.ops.object.mode_set(mode='OBJECT')
-    obj.data.bones[root_bone].layers = ROOT_LAYER
+    if dirty_rigs is None:
+        with EditSession(obj):
+            root_bone = new_bone(obj, ROOT_NAME)
+            spread = get_xy_spread(metarig.data.bones) or metarig.data.bones[0].length
+            spread = float('%.3g' % spread)
+            scale = spread/0.589
+            obj.data.edit_bones[root_bone].head = (0, 0, 0)
+            obj.data.edit_bones[root_bone].tail = (0, scale, 0)
+            obj.data.edit_bones[root_bone].roll = 0
+        obj.data.bones[root_bone].layers = ROOT_LAYER
 
-    # Put the rig_name in the armature custom properties
+    else:
+        root_bone = ROOT_NAME
+
+    # Put the rig_id in the armature custom properties
     rna_idprop_ui_prop_get(obj.data, "rig_id", create=True)
     obj.data["rig_id"] = rig_id
 
@@ -334,35 +276,100 @@ def generate_rig(context, metarig):
     try:
         # Collect/initialize all the rigs.
         rigs = []
+        rig_keys = []  # Metarig bone of each rig
+        rig_types = []
         for bone in bones_sorted:
-            bpy.ops.object.mode_set(mode='EDIT')
-            rigs += get_bone_rigs(obj, bone)
+            set_mode('EDIT')
+            bone_rigs = get_bone_rigs(obj, bone)
+            rigs += bone_rigs
+            rig_keys += [strip_org(bone)] * len(bone_rigs)
+            rig_types += [obj.pose.bones[bone].rigify_type.replace(" ", "")] * len(bone_rigs)
         t.tick("Initialize rigs: ")
 
-        # Generate all the rigs.
-        ui_scripts = []
-        for rig in rigs:
-            # Go into editmode in the rig armature
-            bpy.ops.object.mode_set(mode='OBJECT')
-            context.scene.objects.active = obj
-            obj.select = True
-            bpy.ops.object.mode_set(mode='EDIT')
-            scripts = rig.generate()
-            if scripts is not None:
-                ui_scripts += [scripts[0]]
-        t.tick("Generate rigs: ")
+        # Rigs run in root to leaf order, so a rig can use the bones of the
+        # rigs before it.  Rigs that support it describe their bones,
+        # constraints, drivers and widgets in a shared plan instead, and
+        # each run of consecutive planned rigs is built in one pass before
+        # the next rig that isn't planned.
+        rig_scripts = [None] * len(rigs)
+        rig_bones = [[] for rig in rigs]
+        for planned, run in groupby(range(len(rigs)), lambda i: hasattr(rigs[i], 'generate_plan')):
+            run = list(run)
+            if planned:
+                plan = GenerationPlan(obj)
+                with EditSession(obj):
+                    for i in run:
+                        start = len(plan.bones)
+                        counts = (len(plan.constraints), len(plan.drivers), len(plan.widgets))
+                        with profiler.rig(rig_keys[i], rig_types[i]), profiler.measure('generate'):
+                            rig_scripts[i] = rigs[i].generate_plan(plan)
+                        rig_bones[i] = [spec['name'] for spec in plan.bones[start:]]
+                        if profile is not None:
+                            with profile.rig(rig_keys[i], rig_types[i]):
+                                profile.count('bone', len(rig_bones[i]))
+                                profile.count('constraint', len(plan.constraints) - counts[0])
+                                profile.count('driver', len(plan.drivers) - counts[1])
+                                profile.count('widget', len(plan.widgets) - counts[2])
+                with profiler.rig(profiler.PLANNED_RIGS, profiler.PLANNED_RIGS), profiler.measure('generate'):
+                    plan.apply()
+                t.tick("Generate planned rigs: ")
+                continue
+
+            # Each rig runs inside an edit session, so bone copies only
+            # leave edit mode when the rig itself switches to pose work.
+            for i in run:
+                if context.scene.objects.active != obj:
+                    set_mode('OBJECT')
+                    context.scene.objects.active = obj
+                    obj.select = True
+                existing = set(obj.data.bones.keys())
+                if profile is not None:
+                    counts = count_constraints_drivers(obj)
+                with profiler.rig(rig_keys[i], rig_types[i]), profiler.measure('generate'):
+                    with EditSession(obj):
+                        rig_scripts[i] = rigs[i].generate()
+                rig_bones[i] = [bone.name for bone in obj.data.bones if bone.name not in existing]
+                if profile is not None:
+                    # Rigs add constraints and drivers through the RNA API
+                    # directly, so only how many they made can be recorded.
+                    after = count_constraints_drivers(obj)
+                    with profile.rig(rig_keys[i], rig_types[i]):
+                        profile.count('constraint', after[0] - counts[0])
+                        profile.count('driver', after[1] - counts[1])
+            t.tick("Generate rigs: ")
+
+        # Record the bones and UI script of each rig component, so an
+        # incremental update can replace them.  Untouched components keep
+        # what they made last time.
+        for key, info in manifest['rigs'].items():
+            if dirty_rigs is not None and key not in dirty_rigs:
+                info['bones'] = old_manifest['rigs'][key].get('bones', [])
+                info['script'] = old_manifest['rigs'][key].get('script')
+            else:
+                info['bones'] = []
+                info['script'] = None
+        for i, key in enumerate(rig_keys):
+            manifest['rigs'][key]['bones'] += rig_bones[i]
+            if rig_scripts[i] is not None:
+                manifest['rigs'][key]['script'] = rig_scripts[i][0]
+
+        # UI scripts in generation order (root-most -> leaf-most, alphabetical)
+        keys = sorted(manifest['rigs'])
+        keys.sort(key=lambda name: len(metarig.data.bones[name].parent_recursive))
+        ui_scripts = [manifest['rigs'][key]['script'] for key in keys if manifest['rigs'][key]['script'] is not None]
     except Exception as e:
         # Cleanup if something goes wrong
         print("Rigify: failed to generate rig.")
+        profiler.stop()
         metarig.data.pose_position = rest_backup
         obj.data.pose_position = 'POSE'
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
 
         # Continue the exception
         raise e
 
     #----------------------------------
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
 
     # Get a list of all the bones in the armature
     bones = [bone.name for bone in obj.data.bones]
@@ -387,15 +394,13 @@ def generate_rig(context, metarig):
             if bone in d:
                 noparent_bones += [bone]
 
-    bpy.ops.object.mode_set(mode='EDIT')
-    for bone in bones:
-        if bone in noparent_bones:
-            continue
-        elif obj.data.edit_bones[bone].parent is None:
-            obj.data.edit_bones[bone].use_connect = False
-            obj.data.edit_bones[bone].parent = obj.data.edit_bones[root_bone]
-
-    bpy.ops.object.mode_set(mode='OBJECT')
+    with EditSession(obj):
+        for bone in bones:
+            if bone in noparent_bones:
+                continue
+            elif obj.data.edit_bones[bone].parent is None:
+                obj.data.edit_bones[bone].use_connect = False
+                obj.data.edit_bones[bone].parent = obj.data.edit_bones[root_bone]
 
     # Lock transforms on all non-control bones
     r = re.compile("[A-Z][A-Z][A-Z]-")
@@ -428,6 +433,13 @@ def generate_rig(context, metarig):
                         else:
                             tar.data_path = 'pose.bones["%s"]["%s"]' % (make_original_name(bone), prop)
 
+    # Rewrite drivers into forms that don't need Python where possible
+    python_drivers = optimize_drivers(obj)
+    if python_drivers:
+        print("Rigify: %d drivers still need Python, e.g. '%s' on %s" % (
+            len(python_drivers), python_drivers[0].driver.expression, python_drivers[0].data_path))
+    t.tick("Optimize drivers: ")
+
     # Move all the original bones to their layer.
     for bone in original_bones:
         obj.data.bones[bone].layers = ORG_LAYER
@@ -445,18 +457,32 @@ def generate_rig(context, metarig):
     # Create root bone widget
     create_root_widget(obj, "root")
 
+    t.tick("Set bone layers: ")
+
     # Assign shapes to bones
     # Object's with name WGT-<bone_name> get used as that bone's shape.
+    # Widgets made by create_widget() are looked up in its registry, others
+    # (e.g. of rig components skipped by an incremental update) in the scene.
+    scene_widgets = None
     for bone in bones:
         wgt_name = (WGT_PREFIX + obj.name + '_' + obj.data.bones[bone].name)[:63]  # Object names are limited to 63 characters... arg
-        if wgt_name in context.scene.objects:
-            # Weird temp thing because it won't let me index by object name
-            for ob in context.scene.objects:
-                if ob.name == wgt_name:
-                    obj.pose.bones[bone].custom_shape = ob
-                    break
-            # This is what it should do:
-            # obj.pose.bones[bone].custom_shape = context.scene.objects[wgt_name]
+        wgt = get_widget_object(wgt_name)
+        if wgt is None:
+            if scene_widgets is None:
+                scene_widgets = {ob.name: ob for ob in context.scene.objects if ob.name.startswith(WGT_PREFIX)}
+            wgt = scene_widgets.get(wgt_name)
+        if wgt is not None:
+            obj.pose.bones[bone].custom_shape = wgt
+
+    # Widgets with the same geometry share one mesh
+    widgets = {}
+    for pbone in obj.pose.bones:
+        wgt = pbone.custom_shape
+        if wgt and wgt.type == 'MESH' and wgt.name.startswith(WGT_PREFIX):
+            widgets[wgt.name] = wgt
+    share_widget_meshes(obj, widgets.values())
+    t.tick("Assign %d widgets: " % len(widgets))
+
     # Reveal all the layers with control bones on them
     vis_layers = [False for n in range(0, 32)]
     for bone in bones:
@@ -497,17 +523,28 @@ def generate_rig(context, metarig):
 
     # script.write(UI_SLIDERS % rig_id)
 
-    id_store = context.armature
-    template_name = id_store.rigify_templates[id_store.rigify_active_template].name
+    # The metarig's own template, context.armature only exists in the
+    # Properties editor
+    arm = metarig.data
+    template_name = arm.rigify_templates[arm.rigify_active_template].name
     template = get_ui_template_module(template_name)
+    if hasattr(template, 'RUNTIME'):
+        update_rig_runtime(template.RUNTIME_NAME, template.RUNTIME)
     script.write(template.UI_SLIDERS % rig_id)
-    for s in ui_scripts:
-        script.write("\n        " + s.replace("\n", "\n        ") + "\n")
+    if hasattr(template, 'ui_sections'):
+        script.write(template.ui_sections(ui_scripts, bones))
+    else:
+        for s in ui_scripts:
+            script.write("\n        " + s.replace("\n", "\n        ") + "\n")
     script.write(template.layers_ui(vis_layers, layer_layout))
     script.write(template.UI_REGISTER)
     script.use_module = True
 
-    # Run UI script
+    # Run UI script, replacing the classes of the last generation
+    if old_rig_id and old_rig_id != rig_id \
+            and not any(arm.get("rig_id") == old_rig_id for arm in bpy.data.armatures):
+        unregister_rig_ui(old_rig_id)
+    unregister_rig_ui(rig_id)
     exec(script.as_string(), {})
 
     # Create Selection Sets
@@ -533,10 +570,12 @@ def generate_rig(context, metarig):
     t.tick("The rest: ")
     #----------------------------------
     # Deconfigure
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     metarig.data.pose_position = rest_backup
     obj.data.pose_position = 'POSE'
 
+    store_manifest(obj, manifest)
+
     # Restore parent to bones
     for child, sub_parent in childs.items():
         if sub_parent in obj.pose.bones:
@@ -544,6 +583,202 @@ def generate_rig(context, metarig):
             child.parent_bone = sub_parent
             child.matrix_world = mat
 
+    if profile is not None:
+        profiler.stop()
+        profile.write_texts()
+        print("Profile written to '%s' and '%s'" % (profiler.REPORT_JSON, profiler.REPORT_CSV))
+
+    return False
+
+
+def rig_runtimes():
+    """ Returns the loaded UI runtime modules, see update_rig_runtime().
+    """
+    modules = [sys.modules.get(text.name[:-3]) for text in bpy.data.texts if text.name.endswith(".py")]
+    return [module for module in modules if hasattr(module, 'register_rig')]
+
+
+def update_rig_runtime(name, source):
+    """ Writes the runtime module of a UI template to the named text block.
+        It holds the code shared by the UI scripts of all rigs, which import
+        it, so it is only compiled and registered once per session.  A
+        loaded runtime that changed gets replaced, keeping its rigs.
+    """
+    text = bpy.data.texts.get(name)
+    if text is not None and text.as_string() == source:
+        return
+    if text is None:
+        text = bpy.data.texts.new(name)
+    text.clear()
+    text.write(source)
+
+    old = sys.modules.pop(name[:-3], None)
+    if old is not None:
+        old.unregister()
+        runtime = importlib.import_module(name[:-3])
+        runtime.rig_draws.update(old.rig_draws)
+
+
+def unregister_rig_ui(rig_id):
+    """ Unregisters what a rig UI script registered for rig_id, so it
+        doesn't pile up over regenerations: the rig's entry in the shared
+        runtime, or the classes of scripts that carry their own.
+    """
+    for runtime in rig_runtimes():
+        runtime.unregister_rig(rig_id)
+    for base in (bpy.types.Operator, bpy.types.Panel, bpy.types.Menu, bpy.types.UIList):
+        for cls in base.__subclasses__():
+            if rig_id in getattr(cls, 'bl_idname', "") and getattr(cls, 'is_registered', False):
+                bpy.utils.unregister_class(cls)
+
+
+def ensure_rig_ui(script_name, rig_id):
+    """ Runs the UI script of a rig that was left as it was, in case it
+        isn't registered in this session.
+    """
+    script = bpy.data.texts.get(script_name)
+    if script is None or not rig_id:
+        return
+    if hasattr(bpy.types, rig_id + "_PT_rig_ui") or any(rig_id in runtime.rig_draws for runtime in rig_runtimes()):
+        return
+    exec(script.as_string(), {})
+
+
+def count_constraints_drivers(obj):
+    """ Returns how many bone constraints and drivers the armature has.
+    """
+    constraints = sum(len(pbone.constraints) for pbone in obj.pose.bones)
+    drivers = len(obj.animation_data.drivers) if obj.animation_data else 0
+    return constraints, drivers
+
+
+def duplicate_metarig(context, metarig, obj):
+    """ Replaces the bones of obj with a copy of the metarig bones,
+        including their pose settings, constraints and drivers.
+    """
+    scene = context.scene
+
+    # Remove all bones from the generated rig armature.
+    with EditSession(obj):
+        for bone in obj.data.edit_bones:
+            obj.data.edit_bones.remove(bone)
+
+    # Create temporary duplicates for merging
+    temp_rig_1 = metarig.copy()
+    temp_rig_1.data = metarig.data.copy()
+    scene.objects.link(temp_rig_1)
+
+    temp_rig_2 = metarig.copy()
+    temp_rig_2.data = obj.data
+    scene.objects.link(temp_rig_2)
+
+    # Select the temp rigs for merging
+    for objt in scene.objects:
+        objt.select = False  # deselect all objects
+    temp_rig_1.select = True
+    temp_rig_2.select = True
+    scene.objects.active = temp_rig_2
+
+    # Merge the temporary rigs
+    bpy.ops.object.join()
+
+    # Delete the second temp rig
+    bpy.ops.object.delete()
+
+    # Select the generated rig
+    for objt in scene.objects:
+        objt.select = False  # deselect all objects
+    obj.select = True
+    scene.objects.active = obj
+
+    # Copy over bone properties
+    for bone in metarig.data.bones:
+        bone_gen = obj.data.bones[bone.name]
+
+        # B-bone stuff
+        bone_gen.bbone_segments = bone.bbone_segments
+        bone_gen.bbone_in = bone.bbone_in
+        bone_gen.bbone_out = bone.bbone_out
+
+    # Copy over the pose_bone properties
+    for bone in metarig.pose.bones:
+        copy_pose_settings(metarig, obj, bone, obj.pose.bones[bone.name])
+
+    # Copy drivers
+    if metarig.animation_data:
+        for d1 in metarig.animation_data.drivers:
+            d2 = obj.driver_add(d1.data_path)
+            copy_attributes(d1, d2)
+            copy_attributes(d1.driver, d2.driver)
+
+            # Remove default modifiers, variables, etc.
+            for m in list(d2.modifiers):
+                d2.modifiers.remove(m)
+            for v in list(d2.driver.variables):
+                d2.driver.variables.remove(v)
+
+            # Copy modifiers
+            for m1 in d1.modifiers:
+                m2 = d2.modifiers.new(type=m1.type)
+                copy_attributes(m1, m2)
+
+            # Copy variables, switching metarig targets to rig targets
+            for v1 in d1.driver.variables:
+                v2 = d2.driver.variables.new()
+                copy_attributes(v1, v2)
+                for t1, tar in zip(v1.targets, v2.targets):
+                    copy_attributes(t1, tar)
+                    if tar.id == metarig:
+                        tar.id = obj
+
+                    # Mark targets that may need to be altered after rig generation
+                    # If a custom property
+                    if v2.type == 'SINGLE_PROP' \
+                    and re.match('^pose.bones\["[^"\]]*"\]\["[^"\]]*"\]$', tar.data_path):
+                        tar.data_path = "RIGIFY-" + tar.data_path
+
+            # Copy key frames
+            copy_keyframe_points(d1, d2)
+
+
+def copy_pose_settings(metarig, obj, bone, bone_gen):
+    """ Copies the pose settings, rig type, custom properties and
+        constraints of a metarig pose bone to a generated pose bone.
+    """
+    # Rotation mode and transform locks
+    bone_gen.rotation_mode = bone.rotation_mode
+    bone_gen.lock_rotation = tuple(bone.lock_rotation)
+    bone_gen.lock_rotation_w = bone.lock_rotation_w
+    bone_gen.lock_rotations_4d = bone.lock_rotations_4d
+    bone_gen.lock_location = tuple(bone.lock_location)
+    bone_gen.lock_scale = tuple(bone.lock_scale)
+
+    # rigify_type and rigify_parameters
+    bone_gen.rigify_type = bone.rigify_type
+    for prop in rna_writable_properties(bone_gen.rigify_parameters):
+        try:
+            setattr(bone_gen.rigify_parameters, prop, getattr(bone.rigify_parameters, prop))
+        except AttributeError:
+            print("FAILED TO COPY PARAMETER: " + str(prop))
+
+    # Custom properties
+    for prop in bone.keys():
+        try:
+            bone_gen[prop] = bone[prop]
+        except KeyError:
+            pass
+
+    # Constraints
+    for con1 in bone.constraints:
+        con2 = bone_gen.constraints.new(type=con1.type)
+        copy_attributes(con1, con2)
+
+        # Set metarig target to rig target
+        if hasattr(con2, "target"):
+            if con2.target == metarig:
+                con2.target = obj
+
+
 def create_selection_sets(obj, metarig):
 
     # Check if selection sets addon is installed
@@ -551,7 +786,7 @@ def create_selection_sets(obj, metarig):
             and 'bone_selection_sets' not in bpy.context.user_preferences.addons:
         return
 
-    bpy.ops.object.mode_set(mode='POSE')
+    set_mode('POSE')
 
     bpy.context.scene.objects.active = obj
     obj.select = True
@@ -582,7 +817,7 @@ def create_selection_sets(obj, metarig):
 
 def create_bone_groups(obj, metarig):
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pb = obj.pose.bones
     layers = metarig.data.rigify_layers
     groups = metarig.data.rigify_colors
@@ -628,7 +863,8 @@ def get_bone_rigs(obj, bone_name, halt_on_missing=False):
 
         # Get the rig
         try:
-            rig = get_rig_type(rig_type).Rig(obj, bone_name, params)
+            with profiler.rig(strip_org(bone_name), rig_type), profiler.measure('init'):
+                rig = get_rig_type(rig_type).Rig(obj, bone_name, params)
         except ImportError:
             message = "Rig Type Missing: python module for type '%s' not found (bone: %s)" % (rig_type, bone_name)
             if halt_on_missing:
@@ -0,0 +1,381 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+import hashlib
+import json
+import os
+import re
+
+import bpy
+
+from .utils import org, set_mode, EditSession
+
+MANIFEST_KEY = "_rigify_manifest"  # Armature property holding the last generation's manifest
+MANIFEST_VERSION = 2
+
+MODULE_DIR = os.path.dirname(__file__)
+
+
+#=============================================
+# Hashing metarig inputs
+#=============================================
+
+def _round(value):
+    """ Turns bone data into something with a stable repr().
+    """
+    if isinstance(value, float):
+        return round(value, 5)
+    if isinstance(value, (bool, int, str)) or value is None:
+        return value
+    if isinstance(value, bpy.types.ID):
+        return value.name
+    try:
+        return tuple(_round(v) for v in value)
+    except TypeError:
+        return str(value)
+
+
+def _digest(data):
+    return hashlib.sha1(repr(data).encode('utf-8')).hexdigest()
+
+
+# Content digests of source files, keyed by path, see source_digest()
+_source_digests = {}
+
+
+def source_digest(path):
+    """ Returns a hash of a file's content, or None if it can't be read.
+        The file is only read again when its size or modification time
+        changed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (stat.st_mtime, stat.st_size)
+    cached = _source_digests.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    _source_digests[path] = (key, digest)
+    return digest
+
+
+def package_digest():
+    """ Returns a hash of every python file of the add-on.  Rig types import
+        helpers from all over the package (limb_utils, widgets, pantin_utils,
+        ...), so any edit to its source has to count as a change.
+    """
+    digests = []
+    for root, dirs, files in os.walk(MODULE_DIR):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__" and not d.startswith("."))
+        for f in sorted(files):
+            if f.endswith(".py"):
+                path = os.path.join(root, f)
+                digests.append((os.path.relpath(path, MODULE_DIR), source_digest(path)))
+    return _digest(digests)
+
+
+def bone_inputs(bone, pbone):
+    """ Returns the metarig data of a single bone that affects generation.
+    """
+    params = []
+    for name in sorted(pbone.rigify_parameters.keys()):
+        params.append((name, _round(getattr(pbone.rigify_parameters, name, None))))
+
+    constraints = []
+    for con in pbone.constraints:
+        constraints.append((con.type, con.name, getattr(con, 'subtarget', None)))
+
+    custom = []
+    for key in sorted(pbone.keys()):
+        if key not in ("_RNA_UI", "rigify_type", "rigify_parameters"):
+            custom.append((key, _round(pbone[key])))
+
+    return (
+        bone.name,
+        _round(bone.matrix_local),
+        _round(bone.length),
+        bone.parent.name if bone.parent else None,
+        bone.use_connect,
+        bone.use_inherit_rotation,
+        bone.use_inherit_scale,
+        bone.use_local_location,
+        bone.use_deform,
+        bone.bbone_segments,
+        _round(bone.bbone_in),
+        _round(bone.bbone_out),
+        _round(bone.layers),
+        pbone.rigify_type,
+        params,
+        pbone.rotation_mode,
+        _round(pbone.lock_location),
+        _round(pbone.lock_rotation),
+        pbone.lock_rotation_w,
+        pbone.lock_rotations_4d,
+        _round(pbone.lock_scale),
+        constraints,
+        custom,
+        )
+
+
+def rig_scope(metarig, bone_name):
+    """ Returns the metarig bones a rig instance may read or modify:
+        the tagged bone, its untagged descendants and its siblings.
+    """
+    pbones = metarig.pose.bones
+    bone = metarig.data.bones[bone_name]
+    scope = [bone.name]
+
+    stack = list(bone.children)
+    while stack:
+        child = stack.pop()
+        if pbones[child.name].rigify_type.replace(" ", ""):
+            continue
+        scope.append(child.name)
+        stack.extend(child.children)
+
+    if bone.parent:
+        scope.extend(b.name for b in bone.parent.children if b.name != bone.name)
+
+    return sorted(scope)
+
+
+def metarig_manifest(metarig):
+    """ Hashes the inputs of every rig instance in the metarig.
+
+        Each tagged bone gets a hash of its rig type, its scope (see
+        rig_scope()) and its parent chain.  Everything that isn't owned by
+        a single rig instance (untagged bones outside every scope, drivers,
+        layer and color settings, the add-on's source) goes into a global
+        hash.
+    """
+    bones = metarig.data.bones
+    pbones = metarig.pose.bones
+    inputs = {b.name: bone_inputs(b, pbones[b.name]) for b in bones}
+
+    rigs = {}
+    scoped = set()
+    for pbone in pbones:
+        rig_type = pbone.rigify_type.replace(" ", "")
+        if not rig_type:
+            continue
+
+        scope = rig_scope(metarig, pbone.name)
+        scoped.update(scope)
+        chain = [inputs[b.name] for b in bones[pbone.name].parent_recursive]
+
+        data = (rig_type, [inputs[b] for b in scope], chain)
+        rigs[pbone.name] = {'hash': _digest(data), 'scope': scope, 'rig_type': rig_type}
+
+    driven = set()
+    drivers = []
+    if metarig.animation_data:
+        for fcu in metarig.animation_data.drivers:
+            drivers.append((fcu.data_path, fcu.array_index, fcu.driver.type, fcu.driver.expression,
+                            [(v.name, v.type, [(_round(t.id), t.data_path, t.bone_target) for t in v.targets])
+                             for v in fcu.driver.variables],
+                            [_round(k.co) for k in fcu.keyframe_points]))
+            bone = driver_bone_name(fcu.data_path)
+            if bone:
+                driven.add(bone)
+
+    arm = metarig.data
+    template = arm.rigify_templates[arm.rigify_active_template].name if len(arm.rigify_templates) else None
+    data = (
+        MANIFEST_VERSION,
+        sorted(b.name for b in bones),
+        [inputs[b.name] for b in bones if b.name not in scoped],
+        drivers,
+        _round(metarig.matrix_world),
+        [(l.name, l.row, l.set, l.group) for l in arm.rigify_layers],
+        [(c.name, _round(c.normal), _round(c.select), _round(c.active)) for c in arm.rigify_colors],
+        template,
+        package_digest(),
+        )
+
+    return {
+        'version': MANIFEST_VERSION,
+        'global': _digest(data),
+        'driven': sorted(driven),
+        'rigs': rigs,
+        }
+
+
+def manifest_id(manifest, length=16):
+    """ Returns an id for the metarig content described by a manifest.
+        The same metarig generated with the same code always gets the same
+        id, so it can stand in for the whole generation result.
+    """
+    rigs = sorted((name, info['hash']) for name, info in manifest['rigs'].items())
+    return _digest((manifest['global'], rigs))[:length]
+
+
+#=============================================
+# Manifest storage
+#=============================================
+
+def load_manifest(obj):
+    """ Returns the manifest stored on a generated rig, or None.
+    """
+    text = obj.data.get(MANIFEST_KEY)
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def store_manifest(obj, manifest):
+    obj.data[MANIFEST_KEY] = json.dumps(manifest, sort_keys=True)
+
+
+def damaged_rigs(manifest, obj):
+    """ Returns the metarig bone names of the rig instances in a stored
+        manifest whose generated bones are missing from obj, or None if
+        ORG bones are missing too, which only a full generation restores.
+    """
+    bones = obj.data.bones
+    damaged = set()
+    for key, info in manifest['rigs'].items():
+        if any(org(name) not in bones for name in info['scope']):
+            return None
+        if any(name not in bones for name in info.get('bones', [])):
+            damaged.add(key)
+    return damaged
+
+
+def find_dirty_rigs(old, new, damaged=()):
+    """ Compares a stored manifest with the current one.
+
+        Returns the set of metarig bone names whose rig instance must be
+        rebuilt, including the instances sharing bones with them and the
+        damaged ones (see damaged_rigs()), or None if the rig needs a full
+        regeneration.
+    """
+    if old is None or old.get('version') != MANIFEST_VERSION:
+        return None
+    if old['global'] != new['global'] or set(old['rigs']) != set(new['rigs']):
+        return None
+
+    dirty = set(k for k, v in new['rigs'].items() if v['hash'] != old['rigs'][k]['hash'])
+    dirty.update(damaged)
+
+    # Rig instances that share bones with a dirty one must be rebuilt too,
+    # since resetting those bones throws away their constraints.
+    scopes = {k: set(v['scope']) for k, v in new['rigs'].items()}
+    pending = list(dirty)
+    while pending:
+        scope = scopes[pending.pop()]
+        for key, other in scopes.items():
+            if key not in dirty and scope & other:
+                dirty.add(key)
+                pending.append(key)
+
+    # Metarig drivers are only copied on full generation
+    for key in dirty:
+        if scopes[key] & set(new['driven']):
+            return None
+
+    return dirty
+
+
+#=============================================
+# Partial rebuild
+#=============================================
+
+def driver_bone_name(data_path):
+    """ Returns the bone a driver data path belongs to, or None.
+    """
+    match = re.match(r'^(?:pose\.)?bones\["([^"]*)"\]', data_path)
+    return match.group(1) if match else None
+
+
+def reset_rig_components(metarig, obj, old, new, dirty, copy_pose_settings):
+    """ Removes what the dirty rig instances generated last time, and puts
+        the ORG bones in their scope back to the state of the metarig.
+
+        copy_pose_settings(metarig_pbone, rig_pbone) copies the pose data of
+        a metarig bone, as done on full generation.
+    """
+    remove = set()
+    for key in dirty:
+        remove.update(old['rigs'][key].get('bones', []))
+
+    reset = set()
+    for key in dirty:
+        reset.update(new['rigs'][key]['scope'])
+    reset_org = set(org(name) for name in reset)
+
+    # Drivers of removed or reset bones, on the object and on the armature
+    for id_data in (obj, obj.data):
+        if id_data.animation_data:
+            drivers = id_data.animation_data.drivers
+            for fcu in list(drivers):
+                bone = driver_bone_name(fcu.data_path)
+                if bone in remove or bone in reset_org:
+                    drivers.remove(fcu)
+
+    set_mode('OBJECT')
+    bpy.context.scene.objects.active = obj
+    obj.select = True
+
+    mat = obj.matrix_world.inverted() * metarig.matrix_world
+
+    with EditSession(obj):
+        ebones = obj.data.edit_bones
+
+        for name in remove:
+            if name in ebones:
+                ebones.remove(ebones[name])
+
+        # Geometry first, then parenting, so connecting doesn't move bones
+        for name in reset:
+            bone = metarig.data.bones[name]
+            eb = ebones[org(name)]
+            eb.use_connect = False
+            eb.head = mat * bone.head_local
+            eb.tail = mat * bone.tail_local
+            eb.align_roll(mat.to_3x3() * bone.z_axis)
+
+        for name in reset:
+            bone = metarig.data.bones[name]
+            eb = ebones[org(name)]
+            eb.parent = ebones[org(bone.parent.name)] if bone.parent else None
+            eb.use_connect = bone.use_connect
+            eb.use_inherit_rotation = bone.use_inherit_rotation
+            eb.use_inherit_scale = bone.use_inherit_scale
+            eb.use_local_location = bone.use_local_location
+            eb.use_deform = bone.use_deform
+            eb.bbone_segments = bone.bbone_segments
+            eb.bbone_in = bone.bbone_in
+            eb.bbone_out = bone.bbone_out
+            eb.layers = list(bone.layers)
+
+    pbones = obj.pose.bones
+    for name in reset:
+        pbone = pbones[org(name)]
+        for con in list(pbone.constraints):
+            pbone.constraints.remove(con)
+        copy_pose_settings(metarig.pose.bones[name], pbone)
+
+    return remove
@@ -0,0 +1,326 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+import json
+import os
+
+import bpy
+from mathutils import Color
+
+from .utils import MetarigError, set_mode, get_metarig_module, METARIG_DIR
+from . import template_list
+
+FORMAT_NAME = "rigify-metarig"
+FORMAT_VERSION = 1
+DATA_EXT = ".json"
+
+
+#=============================================
+# Packing helpers
+#=============================================
+
+def _pack_bits(values):
+    """ Packs a sequence of booleans into an int, first value lowest.
+    """
+    bits = 0
+    for i, value in enumerate(values):
+        if value:
+            bits |= 1 << i
+    return bits
+
+
+def _unpack_bits(bits, count):
+    return [bool(bits & (1 << i)) for i in range(count)]
+
+
+def _param_value(value):
+    if isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (set, frozenset)):
+        # ENUM_FLAG values, made a set again by _set_param()
+        return sorted(value)
+    return list(value)
+
+
+def _set_param(params, name, value):
+    if isinstance(getattr(params, name, None), (set, frozenset)):
+        value = set(value)
+    setattr(params, name, value)
+
+
+#=============================================
+# Writing
+#=============================================
+
+def metarig_to_data(obj, layers=False, groups=False, template=True):
+    """ Returns the metarig as plain data, with the same contents as the
+        script written by utils.write_metarig().
+
+        Bones are stored as flat arrays (heads, tails, rolls, parent
+        indices, ...), parents before children.
+    """
+    arm = obj.data
+    data = {'format': FORMAT_NAME, 'version': FORMAT_VERSION}
+
+    if groups and len(arm.rigify_colors) > 0:
+        data['colors'] = [[c.name, list(c.active), list(c.normal), list(c.select), c.standard_colors_lock]
+                          for c in arm.rigify_colors]
+
+    if layers and len(arm.rigify_layers) > 0:
+        data['layers'] = [[l.name, l.row, l.set, l.group] for l in arm.rigify_layers]
+
+    set_mode('EDIT')
+
+    # Parents first
+    names = [(len(bone.parent_recursive), bone.name) for bone in arm.edit_bones]
+    names.sort(key=lambda item: item[0])
+    names = [item[1] for item in names]
+    index = {name: i for i, name in enumerate(names)}
+
+    heads = []
+    tails = []
+    rolls = []
+    parents = []
+    connect = []
+    for name in names:
+        bone = arm.edit_bones[name]
+        heads.extend(round(v, 4) for v in bone.head)
+        tails.extend(round(v, 4) for v in bone.tail)
+        rolls.append(round(bone.roll, 4))
+        parents.append(index[bone.parent.name] if bone.parent else -1)
+        connect.append(int(bone.use_connect))
+
+    set_mode('OBJECT')
+
+    types = []
+    locks = []
+    rotation_modes = []
+    bone_layers = []
+    params = []
+    for i, name in enumerate(names):
+        pbone = obj.pose.bones[name]
+        types.append(pbone.rigify_type)
+        locks.append(_pack_bits(tuple(pbone.lock_location) + tuple(pbone.lock_rotation) +
+                                (pbone.lock_rotation_w,) + tuple(pbone.lock_scale)))
+        rotation_modes.append(pbone.rotation_mode)
+        if layers:
+            bone_layers.append(_pack_bits(pbone.bone.layers))
+
+        bone_params = {}
+        for param_name in pbone.rigify_parameters.keys():
+            value = getattr(pbone.rigify_parameters, param_name, None)
+            if value is not None:
+                bone_params[param_name] = _param_value(value)
+        if bone_params:
+            params.append([i, bone_params])
+
+    data['bones'] = {
+        'names': names,
+        'heads': heads,
+        'tails': tails,
+        'rolls': rolls,
+        'parents': parents,
+        'connect': connect,
+        'types': types,
+        'locks': locks,
+        'rotation_modes': rotation_modes,
+        'parameters': params,
+        }
+
+    if layers:
+        data['bones']['layers'] = bone_layers
+        used = 0
+        for bits in bone_layers:
+            used |= bits
+        data['visible_layers'] = used
+
+    if template and len(arm.rigify_templates):
+        data['template'] = arm.rigify_templates[arm.rigify_active_template].name
+
+    return data
+
+
+def write_metarig_data(obj, layers=False, groups=False, template=True):
+    """ Returns the metarig data as JSON text.
+    """
+    data = metarig_to_data(obj, layers=layers, groups=groups, template=template)
+    return json.dumps(data, separators=(',', ':'))
+
+
+#=============================================
+# Loading
+#=============================================
+
+def read_metarig_data(filepath):
+    with open(filepath) as f:
+        data = json.load(f)
+    if data.get('format') != FORMAT_NAME:
+        raise MetarigError("'%s' is not a Rigify metarig file" % filepath)
+    if data.get('version', 0) > FORMAT_VERSION:
+        raise MetarigError("'%s' needs a newer version of Rigify" % filepath)
+    return data
+
+
+def create_metarig(obj, data):
+    """ Builds a metarig from metarig_to_data() output into an armature,
+        creating all the bones in a single edit pass.
+    """
+    arm = obj.data
+
+    for name, active, normal, select, lock in data.get('colors', []):
+        color = arm.rigify_colors.add()
+        color.name = name
+        color.active = Color(active)
+        color.normal = Color(normal)
+        color.select = Color(select)
+        color.standard_colors_lock = lock
+
+    for name, row, layer_set, group in data.get('layers', []):
+        layer = arm.rigify_layers.add()
+        layer.name = name
+        layer.row = row
+        layer.set = layer_set
+        layer.group = group
+
+    bones = data['bones']
+    heads = bones['heads']
+    tails = bones['tails']
+
+    set_mode('EDIT')
+    ebones = arm.edit_bones
+    names = []
+    for i, name in enumerate(bones['names']):
+        bone = ebones.new(name)
+        bone.head = heads[3*i:3*i + 3]
+        bone.tail = tails[3*i:3*i + 3]
+        bone.roll = bones['rolls'][i]
+        names.append(bone.name)
+
+    for i, parent in enumerate(bones['parents']):
+        if parent >= 0:
+            bone = ebones[names[i]]
+            bone.parent = ebones[names[parent]]
+            bone.use_connect = bool(bones['connect'][i])
+
+    for bone in ebones:
+        bone.select = False
+        bone.select_head = False
+        bone.select_tail = False
+    for name in names:
+        bone = ebones[name]
+        bone.select = True
+        bone.select_head = True
+        bone.select_tail = True
+        ebones.active = bone
+
+    set_mode('OBJECT')
+    pbones = obj.pose.bones
+    bone_layers = bones.get('layers')
+    for i, name in enumerate(names):
+        pbone = pbones[name]
+        pbone.rigify_type = bones['types'][i]
+        locks = _unpack_bits(bones['locks'][i], 10)
+        pbone.lock_location = locks[0:3]
+        pbone.lock_rotation = locks[3:6]
+        pbone.lock_rotation_w = locks[6]
+        pbone.lock_scale = locks[7:10]
+        pbone.rotation_mode = bones['rotation_modes'][i]
+        if bone_layers:
+            pbone.bone.layers = _unpack_bits(bone_layers[i], 32)
+
+    for i, params in bones['parameters']:
+        pbone = pbones[names[i]]
+        for param_name, value in params.items():
+            try:
+                _set_param(pbone.rigify_parameters, param_name, value)
+            except AttributeError:
+                pass
+
+    if 'visible_layers' in data:
+        arm.layers = _unpack_bits(data['visible_layers'], len(arm.layers))
+
+    if 'template' in data:
+        # Select proper UI template
+        for i, template in enumerate(arm.rigify_templates.keys()):
+            if template == data['template']:
+                arm.rigify_active_template = i
+                break
+
+    set_mode('EDIT')
+    return names
+
+
+def create_metarig_from_file(obj, filepath):
+    return create_metarig(obj, read_metarig_data(filepath))
+
+
+#=============================================
+# Converting metarig modules
+#=============================================
+
+def convert_metarig_module(module, layers=True, groups=True):
+    """ Runs the create() function of a python metarig module on a
+        temporary armature, and returns its data.
+    """
+    scene = bpy.context.scene
+    active = scene.objects.active
+    set_mode('OBJECT')
+
+    arm = bpy.data.armatures.new("metarig_convert")
+    obj = bpy.data.objects.new("metarig_convert", arm)
+    scene.objects.link(obj)
+    scene.objects.active = obj
+    try:
+        template_list.fill_ui_template_list(obj)
+        module.create(obj)
+        data = metarig_to_data(obj, layers=layers, groups=groups)
+    finally:
+        set_mode('OBJECT')
+        scene.objects.unlink(obj)
+        bpy.data.objects.remove(obj)
+        bpy.data.armatures.remove(arm)
+        scene.objects.active = active
+
+    return data
+
+
+def convert_metarig_modules(path=METARIG_DIR):
+    """ Writes a metarig data file next to each python metarig module in
+        the given metarig directory (and its sub-directories).  Returns
+        the written file paths.
+
+        Run from Blender, e.g. with 'blender --background --python-expr'.
+    """
+    base = os.path.join(os.path.dirname(__file__), *path.split('.'))
+    written = []
+    for dirpath, dirnames, filenames in os.walk(base):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(('_', '.')))
+        rel = os.path.relpath(dirpath, base)
+        package = path if rel == '.' else path + '.' + rel.replace(os.sep, '.')
+        for f in sorted(filenames):
+            if not f.endswith(".py") or f == "__init__.py":
+                continue
+            module = get_metarig_module(f[:-3], package)
+            data = convert_metarig_module(module)
+            filepath = os.path.join(dirpath, f[:-3] + DATA_EXT)
+            with open(filepath, 'w') as out:
+                json.dump(data, out, separators=(',', ':'))
+            written.append(filepath)
+    return written
@@ -25,6 +25,7 @@ import bpy
 
 from . import utils
 from . import template_list
+from . import metarig_data
 
 
 class ArmatureSubMenu(bpy.types.Menu):
@@ -39,8 +40,10 @@ class ArmatureSubMenu(bpy.types.Menu):
 
 
 def get_metarig_list(path, depth=0):
-    """ Searches for metarig modules, and returns a list of the
-        imported modules.
+    """ Searches for metarig modules and data files, and returns a list
+        of (name, package path, data file) tuples.  The data file is None
+        for python metarigs, and is preferred when a metarig has both.
+        Nothing is loaded until a metarig gets added.
     """
     metarigs = []
     metarigs_dict = dict()
@@ -58,19 +61,19 @@ def get_metarig_list(path, depth=0):
                 metarigs_dict[f] = get_metarig_list(f, depth=1)
             else:
                 continue
-        elif not f.endswith(".py"):
+        elif not (f.endswith(".py") or f.endswith(metarig_data.DATA_EXT)):
             continue
         elif f == "__init__.py":
             continue
         else:
-            module_name = f[:-3]
-            try:
-                if depth == 1:
-                    metarigs += [utils.get_metarig_module(module_name, utils.METARIG_DIR + '.' + path)]
-                else:
-                    metarigs += [utils.get_metarig_module(module_name, utils.METARIG_DIR)]
-            except (ImportError):
-                pass
+            name, ext = os.path.splitext(f)
+            package = utils.METARIG_DIR + '.' + path if depth == 1 else utils.METARIG_DIR
+            data_file = complete_path if ext == metarig_data.DATA_EXT else None
+            known = [i for i, m in enumerate(metarigs) if m[0] == name]
+            if not known:
+                metarigs += [(name, package, data_file)]
+            elif data_file:
+                metarigs[known[0]] = (name, package, data_file)
 
     if depth == 1:
         return metarigs
@@ -79,10 +82,19 @@ def get_metarig_list(path, depth=0):
     return metarigs_dict
 
 
-def make_metarig_add_execute(m):
+def make_metarig_add_execute(module_name, path, data_file=None):
     """ Create an execute method for a metarig creation operator.
     """
     def execute(self, context):
+        try:
+            if data_file:
+                data = metarig_data.read_metarig_data(data_file)
+            else:
+                m = utils.get_metarig_module(module_name, path)
+        except (ImportError, OSError, ValueError, utils.MetarigError) as e:
+            self.report({'ERROR'}, "Couldn't load metarig '%s': %s" % (module_name, e))
+            return {'CANCELLED'}
+
         # Add armature object
         bpy.ops.object.armature_add()
         obj = context.active_object
@@ -97,7 +109,10 @@ def make_metarig_add_execute(m):
         template_list.fill_ui_template_list(obj)
 
         # Create metarig
-        m.create(obj)
+        if data_file:
+            metarig_data.create_metarig(obj, data)
+        else:
+            m.create(obj)
 
         bpy.ops.object.mode_set(mode='OBJECT')
         return {'FINISHED'}
@@ -127,15 +142,13 @@ armature_submenus = []
 metarig_ops = {}
 for metarig_class in metarigs_dict:
     metarig_ops[metarig_class] = []
-    for m in metarigs_dict[metarig_class]:
-        name = m.__name__.rsplit('.', 1)[1]
-
+    for name, path, data_file in metarigs_dict[metarig_class]:
         # Dynamically construct an Operator
         T = type("Add_" + name + "_Metarig", (bpy.types.Operator,), {})
         T.bl_idname = "object.armature_" + name + "_metarig_add"
         T.bl_label = "Add " + name.replace("_", " ").capitalize() + " (metarig)"
         T.bl_options = {'REGISTER', 'UNDO'}
-        T.execute = make_metarig_add_execute(m)
+        T.execute = make_metarig_add_execute(name, path, data_file)
 
         metarig_ops[metarig_class].append((T, name))
 
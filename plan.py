@@ -0,0 +1,339 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+import re
+
+import bpy
+from mathutils import Vector
+from rna_prop_ui import rna_idprop_ui_prop_get
+
+from .utils import MetarigError, EditSession, copy_pose_bone
+from .profiler import measure
+from .constraints import get_recipe
+from .drivers import make_driver
+
+
+#=============================================
+# Generation plan
+#=============================================
+
+def pose_path(bone_name, prop=None):
+    """ Returns the object-relative data path of a pose bone, or of one of
+        its properties.  Custom properties are given as '["name"]'.
+    """
+    path = 'pose.bones["%s"]' % bone_name
+    if prop is None:
+        return path
+    elif prop.startswith('['):
+        return path + prop
+    else:
+        return path + '.' + prop
+
+
+def _unique_bone_name(taken, name):
+    """ Mimics Blender's renaming of colliding bone names, so the
+        plan knows final names before any bone exists.
+    """
+    if name not in taken:
+        return name
+    base = re.sub(r'\.\d{3}$', '', name)
+    count = 1
+    while "%s.%03d" % (base, count) in taken:
+        count += 1
+    return "%s.%03d" % (base, count)
+
+
+def _plain(value):
+    """ Converts RNA/mathutils values into plain python for as_dict().
+    """
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    if isinstance(value, bpy.types.ID):
+        return value.name
+    try:
+        return [_plain(v) for v in value]
+    except TypeError:
+        return str(value)
+
+
+class GenerationPlan:
+    """ Collects bone, parenting, constraint, driver and widget specs from
+        the rig types, and materializes them with a single edit pass and a
+        single pose pass.
+
+        Bone names are resolved when a bone is planned, so specs can refer
+        to bones that don't exist yet.  Rigs still read the existing
+        armature (ORG bones) while planning, from inside an edit session.
+    """
+    def __init__(self, obj):
+        self.obj = obj
+        self.bones = []         # Ordered bone specs
+        self.constraints = []   # (bone, type, props)
+        self.drivers = []       # Driver specs
+        self.widgets = []       # (bone, function, kwargs)
+        self.pose_props = []    # (bone, attribute, value)
+        self.bone_props = []    # (bone, attribute, value)
+        self.custom_props = []  # (bone, name, value, ui settings)
+        self._bone_index = {}
+        self._taken = set(b.name for b in obj.data.bones)
+        if obj.mode == 'EDIT':
+            self._taken.update(b.name for b in obj.data.edit_bones)
+
+    #------------------------------------
+    # Bones
+
+    def _add_bone(self, name, spec):
+        name = _unique_bone_name(self._taken, name)
+        self._taken.add(name)
+        spec['name'] = name
+        self._bone_index[name] = spec
+        self.bones.append(spec)
+        return name
+
+    def new_bone(self, name, head=(0, 0, 0), tail=(0, 1, 0), roll=0.0):
+        """ Plans a new bone and returns its final name.
+        """
+        spec = {
+            'source': None,
+            'edit': [('head', Vector(head)), ('tail', Vector(tail)), ('roll', roll)],
+            'parent': None,
+            'use_connect': False,
+            }
+        return self._add_bone(name, spec)
+
+    def copy_bone(self, source, name=''):
+        """ Plans a copy of an existing or planned bone, with the same
+            semantics as utils.copy_bone().  Returns the final name.
+        """
+        if source not in self._bone_index and source not in self.obj.data.edit_bones:
+            raise MetarigError("copy_bone(): bone '%s' not found, cannot copy it" % source)
+
+        spec = {
+            'source': source,
+            'edit': [],
+            'parent': Ellipsis,  # Inherit the source's parent
+            'use_connect': None,
+            }
+        return self._add_bone(name or source, spec)
+
+    def set_edit(self, bone, attr, value):
+        """ Sets an edit bone attribute (head, tail, roll, length, ...) at
+            apply time.  Attributes are applied in the order given.
+        """
+        self._bone_index[bone]['edit'].append((attr, value))
+
+    def set_parent(self, bone, parent, use_connect=False):
+        """ Parents a planned bone.  parent may be a planned or existing bone,
+            or None to clear.
+        """
+        spec = self._bone_index[bone]
+        spec['parent'] = parent
+        spec['use_connect'] = use_connect
+
+    #------------------------------------
+    # Pose data
+
+    def set_pose(self, bone, attr, value):
+        self.pose_props.append((bone, attr, value))
+
+    def set_bone(self, bone, attr, value):
+        """ Sets a bpy.types.Bone attribute (layers, bbone_segments, ...).
+        """
+        self.bone_props.append((bone, attr, value))
+
+    def add_property(self, bone, name, value, **ui):
+        """ Adds a custom property to a pose bone, with optional min/max/
+            soft_min/soft_max/description UI settings.
+        """
+        self.custom_props.append((bone, name, value, ui))
+
+    def add_constraint(self, bone, con_type, **props):
+        """ Plans a constraint.  Unless given, the target is the rig itself.
+        """
+        if 'subtarget' in props and 'target' not in props:
+            props['target'] = self.obj
+        self.constraints.append((bone, con_type, props))
+
+    def add_recipe(self, name, bone, subtarget, influence=None, **props):
+        """ Plans the constraints of a named recipe (see constraints.py),
+            all targeting subtarget.
+        """
+        for constraint in get_recipe(name):
+            constraint = dict(constraint, subtarget=subtarget, **props)
+            if influence is not None:
+                constraint['influence'] = influence
+            self.add_constraint(bone, constraint.pop('constraint'), **constraint)
+
+    def add_driver(self, data_path, index=-1, type='SCRIPTED', expression='', variables=()):
+        """ Plans a driver on an object-relative data path.
+
+            variables is a list of dicts with 'name', 'type' (default
+            'SINGLE_PROP') and 'targets', a list of target attribute dicts.
+            Targets without an 'id' point to the rig.
+        """
+        self.drivers.append({
+            'data_path': data_path,
+            'index': index,
+            'type': type,
+            'expression': expression,
+            'variables': [dict(v) for v in variables],
+            })
+
+    def add_widget(self, bone, function, **kwargs):
+        """ Plans a widget, created as function(rig, bone, **kwargs).
+        """
+        self.widgets.append((bone, function, kwargs))
+
+    #------------------------------------
+    # Materialization
+
+    def apply(self):
+        """ Builds everything in the plan onto the armature.
+        """
+        obj = self.obj
+        created = []
+
+        with EditSession(obj):
+            ebones = obj.data.edit_bones
+
+            for spec in self.bones:
+                eb = ebones.new(spec['name'])
+                if eb.name != spec['name']:
+                    raise MetarigError("plan: bone '%s' was renamed to '%s'" % (spec['name'], eb.name))
+                created.append(spec['name'])
+
+                source = spec['source']
+                if source is not None:
+                    src = ebones[source]
+                    eb.layers = list(src.layers)
+                    eb.head = Vector(src.head)
+                    eb.tail = Vector(src.tail)
+                    eb.roll = src.roll
+                    eb.use_inherit_rotation = src.use_inherit_rotation
+                    eb.use_inherit_scale = src.use_inherit_scale
+                    eb.use_local_location = src.use_local_location
+                    eb.use_deform = src.use_deform
+                    eb.bbone_segments = src.bbone_segments
+                    eb.bbone_in = src.bbone_in
+                    eb.bbone_out = src.bbone_out
+
+                for attr, value in spec['edit']:
+                    setattr(eb, attr, value)
+
+            # Parent in a second loop, parents may be planned later
+            for spec in self.bones:
+                eb = ebones[spec['name']]
+                parent = spec['parent']
+                if parent is Ellipsis:
+                    src = ebones[spec['source']]
+                    eb.parent = src.parent
+                    eb.use_connect = src.use_connect
+                else:
+                    eb.parent = ebones[parent] if parent else None
+                    eb.use_connect = spec['use_connect']
+
+        pbones = obj.pose.bones
+        bones = obj.data.bones
+
+        for spec in self.bones:
+            if spec['source'] is not None:
+                copy_pose_bone(obj, spec['source'], spec['name'])
+
+        for name, attr, value in self.bone_props:
+            setattr(bones[name], attr, value)
+
+        for name, attr, value in self.pose_props:
+            setattr(pbones[name], attr, value)
+
+        for name, prop_name, value, ui in self.custom_props:
+            pbones[name][prop_name] = value
+            if ui:
+                prop = rna_idprop_ui_prop_get(pbones[name], prop_name, create=True)
+                for key, val in ui.items():
+                    prop[key] = val
+
+        for name, con_type, props in self.constraints:
+            with measure('constraint'):
+                con = pbones[name].constraints.new(con_type)
+                if 'target' in props:
+                    con.target = props['target']
+                for attr, value in props.items():
+                    if attr != 'target':
+                        setattr(con, attr, value)
+
+        for spec in self.drivers:
+            with measure('driver'):
+                self._add_driver(obj, spec)
+
+        for name, function, kwargs in self.widgets:
+            function(obj, name, **kwargs)
+
+        return created
+
+    def _add_driver(self, obj, spec):
+        """ Adds one planned driver to the armature.
+        """
+        make_driver(obj, spec['data_path'], spec['index'], spec['type'], spec['expression'], spec['variables'])
+
+    #------------------------------------
+    # Inspection
+
+    def as_dict(self):
+        """ Returns the plan as plain python data, e.g. to save as JSON and
+            diff between runs.
+        """
+        bones = {}
+        for spec in self.bones:
+            parent = spec['parent']
+            bones[spec['name']] = {
+                'source': spec['source'],
+                'edit': [[attr, _plain(value)] for attr, value in spec['edit']],
+                'parent': '<source>' if parent is Ellipsis else parent,
+                'use_connect': spec['use_connect'],
+                }
+
+        return {
+            'bones': bones,
+            'constraints': [[b, t, {k: _plain(v) for k, v in p.items()}] for b, t, p in self.constraints],
+            'drivers': [{k: _plain(v) if k != 'variables' else
+                         [{vk: _plain(vv) for vk, vv in var.items()} for var in v]
+                         for k, v in d.items()} for d in self.drivers],
+            'widgets': [[b, f.__name__, {k: _plain(v) for k, v in kw.items()}] for b, f, kw in self.widgets],
+            'pose_props': [[b, a, _plain(v)] for b, a, v in self.pose_props],
+            'bone_props': [[b, a, _plain(v)] for b, a, v in self.bone_props],
+            'custom_props': [[b, n, _plain(v), ui] for b, n, v, ui in self.custom_props],
+            }
+
+
+def diff_plans(old, new):
+    """ Compares two GenerationPlan.as_dict() results.
+        Returns a dict of added, removed and changed bone names, plus the
+        sections other than bones that differ.
+    """
+    old_bones = old.get('bones', {})
+    new_bones = new.get('bones', {})
+
+    result = {
+        'added': sorted(set(new_bones) - set(old_bones)),
+        'removed': sorted(set(old_bones) - set(new_bones)),
+        'changed': sorted(b for b in set(old_bones) & set(new_bones) if old_bones[b] != new_bones[b]),
+        'sections': sorted(k for k in set(old) | set(new) if k != 'bones' and old.get(k) != new.get(k)),
+        }
+    return result
@@ -0,0 +1,271 @@
+#====================== BEGIN GPL LICENSE BLOCK ======================
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#======================= END GPL LICENSE BLOCK ========================
+
+# <pep8 compliant>
+
+import csv
+import functools
+import io
+import json
+import time
+from contextlib import contextmanager
+
+import bpy
+
+REPORT_JSON = "rigify_profile.json"
+REPORT_CSV = "rigify_profile.csv"
+
+# What a rig spends its time on.  'init' and 'generate' are the rig's own
+# methods, the rest are the helpers it calls from within them.
+CATEGORIES = ('init', 'generate', 'mode', 'bone', 'constraint', 'driver', 'widget')
+
+# Pseudo rig that GenerationPlan.apply() work is attributed to, since the
+# plan builds the bones of all planned rigs in one pass.
+PLANNED_RIGS = "(planned rigs)"
+
+_active = None      # The profile being recorded, if any
+_last = None        # The most recently finished profile
+
+
+#=============================================
+# Profile
+#=============================================
+
+class GenerationProfile:
+    """ Time and call counts of one rig generation, per rig instance
+        (metarig bone + rig type) and per generation phase.
+
+        Helpers time themselves through measure(), which only counts
+        nested calls of the same category once, e.g. a widget function
+        that calls create_widget().
+    """
+    def __init__(self, rig_name=""):
+        self.rig_name = rig_name
+        self.started = time.time()
+        self.total = 0.0
+        self.phases = []
+        self.rigs = {}
+        self.totals = {'times': dict.fromkeys(CATEGORIES, 0.0), 'calls': dict.fromkeys(CATEGORIES, 0)}
+        self.current = None
+        self._depth = dict.fromkeys(CATEGORIES, 0)
+
+    def _entry(self, key):
+        if key not in self.rigs:
+            self.rigs[key] = {
+                'bone': key[0],
+                'rig_type': key[1],
+                'times': dict.fromkeys(CATEGORIES, 0.0),
+                'calls': dict.fromkeys(CATEGORIES, 0),
+            }
+        return self.rigs[key]
+
+    @contextmanager
+    def rig(self, bone, rig_type):
+        """ Attributes everything measured in the block to the given rig.
+        """
+        outer = self.current
+        self.current = (bone, rig_type)
+        self._entry(self.current)
+        try:
+            yield
+        finally:
+            self.current = outer
+
+    @contextmanager
+    def measure(self, category):
+        """ Times the block and counts it as one call of the category,
+            for the current rig and in the totals of the whole generation.
+            Blocks of a category nested in another of the same category,
+            like create_widget() in a widget helper, are part of that call.
+        """
+        self._depth[category] += 1
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[category] -= 1
+            if self._depth[category] == 0:
+                self._add(category, 1, time.perf_counter() - t)
+
+    def count(self, category, n=1):
+        """ Counts calls that can't be timed individually, e.g. constraints
+            created directly through the RNA API.
+        """
+        if n:
+            self._add(category, n, 0.0)
+
+    def _add(self, category, calls, seconds):
+        entries = [self.totals]
+        if self.current is not None:
+            entries.append(self.rigs[self.current])
+        for entry in entries:
+            entry['calls'][category] += calls
+            entry['times'][category] += seconds
+
+    def add_phase(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def finish(self):
+        self.total = time.time() - self.started
+
+    #------------------------------------
+    # Reports
+
+    def by_rig_type(self):
+        """ Sums the rig instances per rig type.  Returns a list of
+            (rig_type, instances, times, calls), slowest type first.
+        """
+        types = {}
+        for entry in self.rigs.values():
+            rig_type = entry['rig_type']
+            if rig_type not in types:
+                types[rig_type] = [0, dict.fromkeys(CATEGORIES, 0.0), dict.fromkeys(CATEGORIES, 0)]
+            info = types[rig_type]
+            info[0] += 1
+            for cat in CATEGORIES:
+                info[1][cat] += entry['times'][cat]
+                info[2][cat] += entry['calls'][cat]
+
+        result = [(rig_type, n, times, calls) for rig_type, (n, times, calls) in types.items()]
+        result.sort(key=lambda item: -rig_total(item[2]))
+        return result
+
+    def as_dict(self):
+        """ Returns the profile as plain python data.
+        """
+        rigs = sorted(self.rigs.values(), key=lambda entry: -rig_total(entry['times']))
+        return {
+            'rig': self.rig_name,
+            'date': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            'blender': bpy.app.version_string,
+            'total': self.total,
+            'totals': self.totals,
+            'phases': [{'name': name, 'time': seconds} for name, seconds in self.phases],
+            'rig_types': [
+                {'rig_type': rig_type, 'instances': n, 'times': times, 'calls': calls}
+                for rig_type, n, times, calls in self.by_rig_type()
+            ],
+            'rigs': rigs,
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+    def to_csv(self):
+        """ One row per rig instance, with a time and a calls column for
+            each category.
+        """
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(['bone', 'rig_type', 'total'] +
+                        ['%s_time' % cat for cat in CATEGORIES] +
+                        ['%s_calls' % cat for cat in CATEGORIES])
+        for entry in self.as_dict()['rigs']:
+            times, calls = entry['times'], entry['calls']
+            writer.writerow([entry['bone'], entry['rig_type'], "%.6f" % rig_total(times)] +
+                            ["%.6f" % times[cat] for cat in CATEGORIES] +
+                            [calls[cat] for cat in CATEGORIES])
+        return out.getvalue()
+
+    def write_texts(self):
+        """ Stores the JSON and CSV reports in text blocks, replacing the
+            reports of the previous run.
+        """
+        for name, text in ((REPORT_JSON, self.to_json()), (REPORT_CSV, self.to_csv())):
+            block = bpy.data.texts.get(name) or bpy.data.texts.new(name)
+            block.clear()
+            block.write(text)
+
+
+def rig_total(times):
+    """ The time a rig spent in its own methods.  Helper categories are
+        spent inside those, so they aren't added on top.
+    """
+    return times['init'] + times['generate']
+
+
+#=============================================
+# Recording
+#=============================================
+
+def start(rig_name=""):
+    """ Starts recording a new profile, and returns it.
+    """
+    global _active
+    _active = GenerationProfile(rig_name)
+    return _active
+
+
+def stop():
+    """ Stops recording.  Returns the finished profile, or None.
+    """
+    global _active, _last
+    profile, _active = _active, None
+    if profile is not None:
+        profile.finish()
+        _last = profile
+    return profile
+
+
+def active():
+    """ Returns the profile being recorded, or None.
+    """
+    return _active
+
+
+def last_profile():
+    """ Returns the most recently finished profile, or None.
+    """
+    return _last
+
+
+@contextmanager
+def rig(bone, rig_type):
+    """ Profile.rig() of the active profile, or nothing.
+    """
+    if _active is None:
+        yield
+    else:
+        with _active.rig(bone, rig_type):
+            yield
+
+
+@contextmanager
+def measure(category):
+    """ Profile.measure() of the active profile, or nothing.
+    """
+    if _active is None:
+        yield
+    else:
+        with _active.measure(category):
+            yield
+
+
+def profiled(category):
+    """ Decorator that measures every call of a helper function while a
+        profile is recorded.  It costs a single check otherwise.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.measure(category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -16,19 +16,165 @@
 #
 #======================= END GPL LICENSE BLOCK ========================
 
+import json
 import os
 
+import bpy
+
 from . import utils
+from .incremental import package_digest
+
+MANIFEST_VERSION = 2
+MANIFEST_NAME = "rig_manifest.json"
+
+MODULE_DIR = os.path.dirname(__file__)
+RIG_DIR_ABS = os.path.join(MODULE_DIR, utils.RIG_DIR)
+
+
+#=============================================
+# Rig manifest
+#=============================================
+
+class ParameterRecorder:
+    """ Stands in for RigifyParameters when calling a rig type's
+        add_parameters(), to record the properties it defines.
+    """
+    def __init__(self):
+        object.__setattr__(self, 'properties', [])
+
+    def __setattr__(self, name, value):
+        self.properties.append((name, value))
+
+
+def _encode(value):
+    if isinstance(value, (set, frozenset)):
+        return {'__set__': sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (bool, int, float, str)) or value is None:
+        return value
+    raise TypeError("can't store %r in the rig manifest" % (value,))
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if '__set__' in value:
+            return set(value['__set__'])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return tuple(_decode(v) for v in value)
+    return value
+
+
+def parameter_schema(rig):
+    """ Returns the properties a rig module's add_parameters() defines, as
+        [name, bpy.props function name, keyword arguments] lists.  Returns
+        None if they can't be stored, e.g. when they use callbacks.
+    """
+    if not hasattr(rig, 'add_parameters'):
+        return []
+
+    # A failing add_parameters() must not leave a partial schema, the
+    # rig type then gets imported and registers its own parameters
+    recorder = ParameterRecorder()
+    try:
+        rig.add_parameters(recorder)
+    except Exception:
+        return None
+
+    schema = []
+    for name, value in recorder.properties:
+        # bpy.props functions return (function, keywords) until registered
+        try:
+            function, keywords = value
+            if getattr(bpy.props, function.__name__, None) is not function:
+                return None
+            schema.append([name, function.__name__, _encode(keywords)])
+        except (AttributeError, TypeError, ValueError):
+            return None
+    return schema
+
+
+def manifest_path():
+    """ Returns the file the rig manifest is kept in, or None.
+    """
+    try:
+        config_dir = bpy.utils.user_resource('CONFIG', path=utils.MODULE_NAME, create=True)
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not config_dir:
+        return None
+    return os.path.join(config_dir, MANIFEST_NAME)
 
 
-def get_rig_list(path):
+def load_manifest(source):
+    """ Returns the stored rig entries, if they were made from the same
+        add-on source.  Rig modules import each other's parameters (e.g.
+        rear_paw from paw), so any source change invalidates all of them.
+    """
+    path = manifest_path()
+    if path is None or utils.developer_reload_enabled():
+        return {}
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('rig_dir') != RIG_DIR_ABS \
+            or manifest.get('source') != source:
+        return {}
+    return manifest.get('rigs', {})
+
+
+def save_manifest(rigs, source):
+    path = manifest_path()
+    if path is None:
+        return
+    manifest = {'version': MANIFEST_VERSION, 'rig_dir': RIG_DIR_ABS, 'source': source, 'rigs': rigs}
+    try:
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    except OSError:
+        print("Rigify: couldn't write the rig manifest to %r" % path)
+
+
+def describe_rig(module_name, cached, manifest):
+    """ Returns the manifest entry of a rig module, importing it only if
+        it has no stored entry.
+    """
+    entry = cached.get(module_name)
+    if entry is None:
+        rig = utils.get_rig_type(module_name)
+        is_rig = hasattr(rig, "Rig")
+        entry = {
+            'is_rig': is_rig,
+            'implementation': bool(getattr(rig, 'IMPLEMENTATION', False)),
+            'parameters': parameter_schema(rig) if is_rig else [],
+            }
+    manifest[module_name] = entry
+    return entry
+
+
+#=============================================
+# Rig lists
+#=============================================
+
+def get_rig_list(path, cached=None, manifest=None):
     """ Recursively searches for rig types, and returns a list.
+
+        Rig modules are described in the manifest dict, reusing the cached
+        entries of unchanged files instead of importing them.
     """
+    if cached is None:
+        cached = {}
+    if manifest is None:
+        manifest = {}
+
     rigs_dict = dict()
     rigs = []
     implementation_rigs = []
-    MODULE_DIR = os.path.dirname(__file__)
-    RIG_DIR_ABS = os.path.join(MODULE_DIR, utils.RIG_DIR)
     SEARCH_DIR_ABS = os.path.join(RIG_DIR_ABS, path)
     files = os.listdir(SEARCH_DIR_ABS)
     files.sort()
@@ -46,23 +192,23 @@ def get_rig_list(path):
         if is_dir:
             # Check directories
             module_name = os.path.join(path, f).replace(os.sep, ".")
-            rig = utils.get_rig_type(module_name)
+            entry = describe_rig(module_name, cached, manifest)
             # Check if it's a rig itself
-            if hasattr(rig, "Rig"):
+            if entry['is_rig']:
                 rigs += [f]
             else:
                 # Check for sub-rigs
-                sub_dict = get_rig_list(os.path.join(path, f, ""))  # "" adds a final slash
+                sub_dict = get_rig_list(os.path.join(path, f, ""), cached, manifest)  # "" adds a final slash
                 rigs.extend(["%s.%s" % (f, l) for l in sub_dict['rig_list']])
                 implementation_rigs.extend(["%s.%s" % (f, l) for l in sub_dict['implementation_rigs']])
         elif f.endswith(".py"):
             # Check straight-up python files
             t = f[:-3]
             module_name = os.path.join(path, t).replace(os.sep, ".")
-            rig = utils.get_rig_type(module_name)
-            if hasattr(rig, "Rig"):
+            entry = describe_rig(module_name, cached, manifest)
+            if entry['is_rig']:
                 rigs += [t]
-            if hasattr(rig, 'IMPLEMENTATION') and rig.IMPLEMENTATION:
+            if entry['implementation']:
                 implementation_rigs += [t]
     rigs.sort()
 
@@ -81,8 +227,40 @@ def get_collection_list(rig_list):
     return collection_list
 
 
+def register_parameters(params):
+    """ Adds the parameters of every rig type to the RigifyParameters
+        PropertyGroup, from the manifest when possible.
+    """
+    for rig in rig_list:
+        schema = rig_manifest[rig]['parameters']
+        if schema is None:
+            # Not storable, let the rig type do it
+            r = utils.get_rig_type(rig)
+            try:
+                r.add_parameters(params)
+            except AttributeError:
+                pass
+            continue
+
+        for name, function, keywords in schema:
+            setattr(params, name, getattr(bpy.props, function)(**_decode(keywords)))
+
+
+def load_rig_list():
+    """ Finds the rig types, and updates the stored manifest if the add-on
+        source changed.
+    """
+    source = package_digest()
+    cached = load_manifest(source)
+    manifest = {}
+    rigs_dict = get_rig_list("", cached, manifest)
+    if manifest != cached:
+        save_manifest(manifest, source)
+    return rigs_dict, manifest
+
+
 # Public variables
-rigs_dict = get_rig_list("")
+rigs_dict, rig_manifest = load_rig_list()
 rig_list = rigs_dict['rig_list']
 implementation_rigs = rigs_dict['implementation_rigs']
 collection_list = get_collection_list(rig_list)
@@ -25,6 +25,7 @@ from ...utils import copy_bone
 from ...utils import connected_children_names
 from ...utils import strip_org, make_deformer_name
 from ...utils import create_bone_widget
+from ...utils import set_mode
 
 
 class Rig:
@@ -51,7 +52,7 @@ class Rig:
             The main armature should be selected and active before this is called.
 
         """
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
 
         # Create the deformation and control bone chains.
         # Just copies of the original chain.
@@ -100,7 +101,7 @@ class Rig:
             else:
                 def_chain += [None]
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # Constraints for org and def
@@ -144,7 +145,7 @@ def create_sample(obj):
     """ Create a sample metarig for this rig type.
     """
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -170,7 +171,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['bone.02']]
     bones['bone.03'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['bone.01']]
     pbone.rigify_type = 'basic.copy_chain'
     pbone.lock_location = (False, False, False)
@@ -193,7 +194,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'QUATERNION'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
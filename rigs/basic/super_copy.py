@@ -20,9 +20,10 @@
 
 import bpy
 
-from ...utils import copy_bone
 from ...utils import strip_org, make_deformer_name
 from ...utils import create_bone_widget, create_circle_widget
+from ...utils import set_mode, EditSession
+from ...plan import GenerationPlan
 
 
 class Rig:
@@ -42,50 +43,39 @@ class Rig:
         self.make_widget  = params.make_widget
         self.make_deform  = params.make_deform
 
-    def generate(self):
-        """ Generate the rig.
+    def generate_plan(self, plan):
+        """ Plan the rig.
             Do NOT modify any of the original bones, except for adding constraints.
-            The main armature should be selected and active before this is called.
 
         """
-        bpy.ops.object.mode_set(mode='EDIT')
-
         # Make a control bone (copy of original).
         if self.make_control:
-            bone = copy_bone(self.obj, self.org_bone, self.org_name)
+            bone = plan.copy_bone(self.org_bone, self.org_name)
 
         # Make a deformation bone (copy of original, child of original).
         if self.make_deform:
-            def_bone = copy_bone(self.obj, self.org_bone, make_deformer_name(self.org_name))
-
-        # Get edit bones
-        eb = self.obj.data.edit_bones
-        # UNUSED
-        # if self.make_control:
-        #     bone_e = eb[bone]
-        if self.make_deform:
-            def_bone_e = eb[def_bone]
-
-        # Parent
-        if self.make_deform:
-            def_bone_e.use_connect = False
-            def_bone_e.parent = eb[self.org_bone]
-
-        bpy.ops.object.mode_set(mode='OBJECT')
-        pb = self.obj.pose.bones
+            def_bone = plan.copy_bone(self.org_bone, make_deformer_name(self.org_name))
+            plan.set_parent(def_bone, self.org_bone)
 
         if self.make_control:
             # Constrain the original bone.
-            con = pb[self.org_bone].constraints.new('COPY_TRANSFORMS')
-            con.name = "copy_transforms"
-            con.target = self.obj
-            con.subtarget = bone
+            plan.add_constraint(self.org_bone, 'COPY_TRANSFORMS', name="copy_transforms", subtarget=bone)
 
             # Create control widget
             if self.make_widget:
-                create_circle_widget(self.obj, bone, radius=0.5)
+                plan.add_widget(bone, create_circle_widget, radius=0.5)
             else:
-                create_bone_widget(self.obj, bone)
+                plan.add_widget(bone, create_bone_widget)
+
+    def generate(self):
+        """ Generate the rig on its own, by building its plan right away.
+            The main armature should be selected and active before this is called.
+
+        """
+        plan = GenerationPlan(self.obj)
+        with EditSession(self.obj):
+            self.generate_plan(plan)
+        plan.apply()
 
 
 def add_parameters(params):
@@ -127,7 +117,7 @@ def create_sample(obj):
     """ Create a sample metarig for this rig type.
     """
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -139,7 +129,7 @@ def create_sample(obj):
     bone.use_connect = False
     bones['Bone'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Bone']]
     pbone.rigify_type = 'basic.super_copy'
     pbone.lock_location = (False, False, False)
@@ -148,7 +138,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'QUATERNION'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
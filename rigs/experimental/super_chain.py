@@ -5,6 +5,8 @@ from ...utils import copy_bone, flip_bone, put_bone, org, align_bone_y_axis, ali
 from ...utils import strip_org, make_deformer_name, connected_children_names
 from ...utils import create_circle_widget, create_sphere_widget, create_widget, create_chain_widget
 from ...utils import MetarigError, make_mechanism_name, create_cube_widget
+from ...utils import set_mode
+from ...constraints import ConstraintBatch
 from rna_prop_ui import rna_idprop_ui_prop_get
 from ..limbs.limb_utils import get_bone_name
 
@@ -127,7 +129,7 @@ class Rig:
 
         org_bones  = self.org_bones
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         if not pivot:
@@ -180,7 +182,7 @@ class Rig:
         org_bones  = self.org_bones
         pivot_name = org_bones[pivot-1]
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Create torso control bone
@@ -213,7 +215,7 @@ class Rig:
     def create_deform(self):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         def_bones = []
@@ -222,7 +224,7 @@ class Rig:
             def_name = copy_bone(self.obj, o, def_name)
             def_bones.append(def_name)
 
-        bpy.ops.object.mode_set(mode='POSE')
+        set_mode('POSE')
         # Create bbone segments
         for bone in def_bones:
             self.obj.data.bones[bone].bbone_segments = self.bbones
@@ -233,14 +235,14 @@ class Rig:
         else:
             self.obj.data.bones[def_bones[0]].bbone_in = 1.0
             self.obj.data.bones[def_bones[-1]].bbone_out = 1.0
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
 
         return def_bones
 
     def create_neck( self, neck_bones ):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Create neck control
@@ -302,7 +304,7 @@ class Rig:
     def create_chest( self, chest_bones ):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # get total spine length
@@ -341,7 +343,7 @@ class Rig:
     def create_hips( self, hip_bones ):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Create hips control bone
@@ -388,7 +390,7 @@ class Rig:
     def create_chain(self):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         twk, mch, mch_ctrl, ctrl = [], [], [], []
@@ -569,7 +571,7 @@ class Rig:
     def parent_bones(self, bones):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Parent deform bones
@@ -704,19 +706,12 @@ class Rig:
             eb[ org ].parent = eb[ twk ]
 
     def make_constraint(self, bone, constraint):
-        bpy.ops.object.mode_set(mode='OBJECT')
-        pb = self.obj.pose.bones
-
-        owner_pb = pb[bone]
-        const = owner_pb.constraints.new(constraint['constraint'])
-        const.target = self.obj
-
-        # filter contraint props to those that actually exist in the current
-        # type of constraint, then assign values to each
-        for p in [k for k in constraint.keys() if k in dir(const)]:
-            setattr(const, p, constraint[p])
+        # Queued, constrain_bones() adds them all in one pass
+        self.constraint_batch.add(bone, constraint)
 
     def constrain_bones(self, bones):
+        self.constraint_batch = ConstraintBatch(self.obj)
+
         # DEF bones
 
         deform = bones['def']
@@ -901,8 +896,10 @@ class Rig:
                     'subtarget'   : tweaks[ tidx + 1 ],
                 })
 
+        self.constraint_batch.apply()
+
     def stick_to_bendy_bones(self, bones):
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         deform = bones['def']
         pb = self.obj.pose.bones
 
@@ -925,7 +922,7 @@ class Rig:
             def_pb.use_bbone_custom_handles = True
 
     def create_drivers(self, bones):
-        bpy.ops.object.mode_set(mode ='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # Setting the torso's props
@@ -968,7 +965,7 @@ class Rig:
             drv_modifier.coefficients[1] = -1.0
 
     def locks_and_widgets(self, bones):
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         #Locks
@@ -1124,7 +1121,7 @@ class Rig:
 
         self.SINGLE_BONE = (len(self.org_bones) == 1)
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         bones = {}
@@ -1174,7 +1171,7 @@ class Rig:
         #Todo create pivot-like controls
 
             # # TEST
-            # bpy.ops.object.mode_set(mode ='EDIT')
+            # set_mode('EDIT')
             # eb = self.obj.data.edit_bones
             #
             # self.parent_bones(      bones )
@@ -1346,7 +1343,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -1379,7 +1376,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['spine.002']]
     bones['spine.003'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['spine']]
     pbone.rigify_type = 'experimental.super_chain'
     pbone.lock_location = (False, False, False)
@@ -1413,7 +1410,7 @@ def create_sample(obj):
     pbone.rotation_mode = 'QUATERNION'
     pbone.bone.layers = [True, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False]
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
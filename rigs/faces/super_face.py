@@ -4,6 +4,8 @@ from   ...utils       import copy_bone, flip_bone
 from   ...utils       import org, strip_org, make_deformer_name, connected_children_names, make_mechanism_name
 from   ...utils       import create_circle_widget, create_sphere_widget, create_widget, create_cube_widget
 from   ...utils       import MetarigError
+from   ...utils       import set_mode
+from   ...constraints import ConstraintBatch, register_recipe
 from   rna_prop_ui    import rna_idprop_ui_prop_get
 from   ..widgets import create_face_widget, create_eye_widget, create_eyes_widget, create_ear_widget, create_jaw_widget, create_teeth_widget
 
@@ -19,6 +21,59 @@ if is_selected(all_controls):
 """
 
 
+# Constraint recipes of the face bones, applied through a ConstraintBatch
+register_recipe( 'def_tweak',
+    { 'constraint' : 'DAMPED_TRACK' },
+    { 'constraint' : 'STRETCH_TO'   } )
+
+register_recipe( 'def_lids',
+    { 'constraint' : 'DAMPED_TRACK', 'head_tail' : 1.0 },
+    { 'constraint' : 'STRETCH_TO',   'head_tail' : 1.0 } )
+
+register_recipe( 'mch_eyes',
+    { 'constraint' : 'DAMPED_TRACK' } )
+
+register_recipe( 'mch_eyes_lids_follow',
+    { 'constraint' : 'COPY_LOCATION', 'head_tail' : 1.0 } )
+
+register_recipe( 'mch_eyes_parent',
+    { 'constraint' : 'COPY_TRANSFORMS' } )
+
+register_recipe( 'mch_jaw_master',
+    { 'constraint' : 'COPY_TRANSFORMS' } )
+
+register_recipe( 'teeth',
+    { 'constraint' : 'COPY_TRANSFORMS' } )
+
+register_recipe( 'tweak_copyloc',
+    { 'constraint'   : 'COPY_LOCATION',
+      'use_offset'   : True,
+      'target_space' : 'LOCAL',
+      'owner_space'  : 'LOCAL' } )
+
+register_recipe( 'tweak_copy_rot_scl',
+    { 'constraint'   : 'COPY_ROTATION',
+      'use_offset'   : True,
+      'target_space' : 'LOCAL',
+      'owner_space'  : 'LOCAL' },
+    { 'constraint'   : 'COPY_SCALE',
+      'use_offset'   : True,
+      'target_space' : 'LOCAL',
+      'owner_space'  : 'LOCAL' } )
+
+register_recipe( 'tweak_copyloc_inv',
+    { 'constraint'   : 'COPY_LOCATION',
+      'target_space' : 'LOCAL',
+      'owner_space'  : 'LOCAL',
+      'use_offset'   : True,
+      'invert_x'     : True,
+      'invert_y'     : True,
+      'invert_z'     : True } )
+
+register_recipe( 'mch_tongue_copy_trans',
+    { 'constraint' : 'COPY_TRANSFORMS' } )
+
+
 class Rig:
 
     def __init__(self, obj, bone_name, params):
@@ -59,7 +114,7 @@ class Rig:
 
     def orient_org_bones(self):
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Adjust eye bones roll
@@ -82,7 +137,7 @@ class Rig:
     def create_deformation(self):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         def_bones = []
@@ -120,7 +175,7 @@ class Rig:
         org_bones = self.org_bones
 
         ## create control bones
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         eyeL_ctrl_name = strip_org(bones['eyes'][0])
@@ -199,7 +254,7 @@ class Rig:
         flip_bone( self.obj, tongue_ctrl_name )
 
         ## Assign widgets
-        bpy.ops.object.mode_set(mode ='OBJECT')
+        set_mode('OBJECT')
 
         # Assign each eye widgets
         create_eye_widget( self.obj, eyeL_ctrl_name )
@@ -246,7 +301,7 @@ class Rig:
         org_bones = self.org_bones
 
         ## create tweak bones
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         tweaks = []
@@ -296,7 +351,7 @@ class Rig:
 
                 tweaks.append( tweak_name )
 
-        bpy.ops.object.mode_set(mode ='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         primary_tweaks = [
@@ -367,7 +422,7 @@ class Rig:
 
     def create_mch(self, jaw_ctrl, tongue_ctrl):
         org_bones = self.org_bones
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Create eyes mch bones
@@ -462,7 +517,7 @@ class Rig:
 
     def parent_bones(self, all_bones, tweak_unique):
         org_bones = self.org_bones
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         face_name = [ bone for bone in org_bones if 'face' in bone ].pop()
@@ -639,115 +694,11 @@ class Rig:
             eb[ bone                       ].parent = eb[ 'ear.L' ]
             eb[ bone.replace( '.L', '.R' ) ].parent = eb[ 'ear.R' ]
 
-    def make_constraits(self, constraint_type, bone, subtarget, influence = 1):
-        org_bones = self.org_bones
-        bpy.ops.object.mode_set(mode ='OBJECT')
-        pb = self.obj.pose.bones
-
-        owner_pb = pb[bone]
-
-        if   constraint_type == 'def_tweak':
-
-            const = owner_pb.constraints.new( 'DAMPED_TRACK' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-
-            const = owner_pb.constraints.new( 'STRETCH_TO' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-
-        elif constraint_type == 'def_lids':
-
-            const = owner_pb.constraints.new( 'DAMPED_TRACK' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-            const.head_tail = 1.0
-
-            const = owner_pb.constraints.new( 'STRETCH_TO' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-            const.head_tail = 1.0
-
-        elif constraint_type == 'mch_eyes':
-
-            const = owner_pb.constraints.new( 'DAMPED_TRACK' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-
-        elif constraint_type == 'mch_eyes_lids_follow':
-
-            const = owner_pb.constraints.new( 'COPY_LOCATION' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-            const.head_tail = 1.0
-
-        elif constraint_type == 'mch_eyes_parent':
-
-            const = owner_pb.constraints.new( 'COPY_TRANSFORMS' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-
-        elif constraint_type == 'mch_jaw_master':
-
-            const = owner_pb.constraints.new( 'COPY_TRANSFORMS' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-            const.influence = influence
-
-        elif constraint_type == 'teeth':
-
-            const = owner_pb.constraints.new( 'COPY_TRANSFORMS' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-            const.influence = influence
-
-        elif constraint_type == 'tweak_copyloc':
-
-            const = owner_pb.constraints.new( 'COPY_LOCATION' )
-            const.target       = self.obj
-            const.subtarget    = subtarget
-            const.influence    = influence
-            const.use_offset   = True
-            const.target_space = 'LOCAL'
-            const.owner_space  = 'LOCAL'
-
-        elif constraint_type == 'tweak_copy_rot_scl':
-
-            const = owner_pb.constraints.new( 'COPY_ROTATION' )
-            const.target       = self.obj
-            const.subtarget    = subtarget
-            const.use_offset   = True
-            const.target_space = 'LOCAL'
-            const.owner_space  = 'LOCAL'
-
-            const = owner_pb.constraints.new( 'COPY_SCALE' )
-            const.target       = self.obj
-            const.subtarget    = subtarget
-            const.use_offset   = True
-            const.target_space = 'LOCAL'
-            const.owner_space  = 'LOCAL'
-
-        elif constraint_type == 'tweak_copyloc_inv':
-
-            const = owner_pb.constraints.new( 'COPY_LOCATION' )
-            const.target       = self.obj
-            const.subtarget    = subtarget
-            const.influence    = influence
-            const.target_space = 'LOCAL'
-            const.owner_space  = 'LOCAL'
-            const.use_offset   = True
-            const.invert_x     = True
-            const.invert_y     = True
-            const.invert_z     = True
-
-        elif constraint_type == 'mch_tongue_copy_trans':
-
-            const = owner_pb.constraints.new( 'COPY_TRANSFORMS' )
-            const.target    = self.obj
-            const.subtarget = subtarget
-            const.influence = influence
-
     def constraints( self, all_bones ):
+        # Constraints are queued and added in one pass at the end,
+        # see the recipes at the top of this file
+        batch = ConstraintBatch( self.obj )
+
         ## Def bone constraints
 
         def_specials = {
@@ -787,7 +738,7 @@ class Rig:
 
         for bone in [ bone for bone in all_bones['deform']['all'] if 'lid' not in bone ]:
             if bone in list( def_specials.keys() ):
-                self.make_constraits('def_tweak', bone, def_specials[bone] )
+                batch.add_recipe('def_tweak', bone, def_specials[bone] )
             else:
                 matches = re.match( pattern, bone ).groups()
                 if len( matches ) > 1 and matches[-1]:
@@ -796,7 +747,7 @@ class Rig:
                     tweak = "".join( str_list )
                 else:
                     tweak = "".join( matches ) + ".001"
-                self.make_constraits('def_tweak', bone, tweak )
+                batch.add_recipe('def_tweak', bone, tweak )
 
         def_lids = sorted( [ bone for bone in all_bones['deform']['all'] if 'lid' in bone ] )
         mch_lids = sorted( [ bone for bone in all_bones['mch']['lids'] ] )
@@ -809,43 +760,43 @@ class Rig:
         mch_lidsR = mch_lidsR[1:] + [ mch_lidsR[0] ]
 
         for boneL, boneR, mchL, mchR in zip( def_lidsL, def_lidsR, mch_lidsL, mch_lidsR ):
-            self.make_constraits('def_lids', boneL, mchL )
-            self.make_constraits('def_lids', boneR, mchR )
+            batch.add_recipe('def_lids', boneL, mchL )
+            batch.add_recipe('def_lids', boneR, mchR )
 
         ## MCH constraints
 
         # mch lids constraints
         for bone in all_bones['mch']['lids']:
             tweak = bone[4:]  # remove "MCH-" from bone name
-            self.make_constraits('mch_eyes', bone, tweak )
+            batch.add_recipe('mch_eyes', bone, tweak )
 
         # mch eyes constraints
         for bone in [ 'MCH-eye.L', 'MCH-eye.R' ]:
             ctrl = bone[4:]  # remove "MCH-" from bone name
-            self.make_constraits('mch_eyes', bone, ctrl )
+            batch.add_recipe('mch_eyes', bone, ctrl )
 
         for bone in [ 'MCH-eye.L.001', 'MCH-eye.R.001' ]:
             target = bone[:-4] # remove number from the end of the name
-            self.make_constraits('mch_eyes_lids_follow', bone, target )
+            batch.add_recipe('mch_eyes_lids_follow', bone, target )
 
         # mch eyes parent constraints
-        self.make_constraits('mch_eyes_parent', 'MCH-eyes_parent', 'ORG-face' )
+        batch.add_recipe('mch_eyes_parent', 'MCH-eyes_parent', 'ORG-face' )
 
         ## Jaw constraints
 
         # jaw master mch bones
-        self.make_constraits( 'mch_jaw_master', 'MCH-mouth_lock',     'jaw_master', 0.20  )
-        self.make_constraits( 'mch_jaw_master', 'MCH-jaw_master',     'jaw_master', 1.00  )
-        self.make_constraits( 'mch_jaw_master', 'MCH-jaw_master.001', 'jaw_master', 0.75  )
-        self.make_constraits( 'mch_jaw_master', 'MCH-jaw_master.002', 'jaw_master', 0.35  )
-        self.make_constraits( 'mch_jaw_master', 'MCH-jaw_master.003', 'jaw_master', 0.10  )
-        self.make_constraits( 'mch_jaw_master', 'MCH-jaw_master.004', 'jaw_master', 0.025 )
+        batch.add_recipe( 'mch_jaw_master', 'MCH-mouth_lock',     'jaw_master', 0.20  )
+        batch.add_recipe( 'mch_jaw_master', 'MCH-jaw_master',     'jaw_master', 1.00  )
+        batch.add_recipe( 'mch_jaw_master', 'MCH-jaw_master.001', 'jaw_master', 0.75  )
+        batch.add_recipe( 'mch_jaw_master', 'MCH-jaw_master.002', 'jaw_master', 0.35  )
+        batch.add_recipe( 'mch_jaw_master', 'MCH-jaw_master.003', 'jaw_master', 0.10  )
+        batch.add_recipe( 'mch_jaw_master', 'MCH-jaw_master.004', 'jaw_master', 0.025 )
 
-        self.make_constraits( 'teeth', 'ORG-teeth.T', 'teeth.T', 1.00 )
-        self.make_constraits( 'teeth', 'ORG-teeth.B', 'teeth.B', 1.00 )
+        batch.add_recipe( 'teeth', 'ORG-teeth.T', 'teeth.T', 1.00 )
+        batch.add_recipe( 'teeth', 'ORG-teeth.B', 'teeth.B', 1.00 )
 
         for bone in all_bones['mch']['jaw'][1:-1]:
-            self.make_constraits( 'mch_jaw_master', bone, 'MCH-mouth_lock' )
+            batch.add_recipe( 'mch_jaw_master', bone, 'MCH-mouth_lock' )
 
         ## Tweak bones constraints
 
@@ -877,12 +828,12 @@ class Rig:
             for target, influence in zip( targets, influences ):
 
                 # Left side constraints
-                self.make_constraits( 'tweak_copyloc', owner, target, influence )
+                batch.add_recipe( 'tweak_copyloc', owner, target, influence )
 
                 # create constraints for the right side too
                 ownerR  = owner.replace(  '.L', '.R' )
                 targetR = target.replace( '.L', '.R' )
-                self.make_constraits( 'tweak_copyloc', ownerR, targetR, influence )
+                batch.add_recipe( 'tweak_copyloc', ownerR, targetR, influence )
 
         # copy rotation & scale constraints for tweak bones of both sides
         tweak_copy_rot_scl_L = {
@@ -893,11 +844,11 @@ class Rig:
         for owner in list( tweak_copy_rot_scl_L.keys() ):
             target    = tweak_copy_rot_scl_L[owner]
             influence = tweak_copy_rot_scl_L[owner]
-            self.make_constraits( 'tweak_copy_rot_scl', owner, target )
+            batch.add_recipe( 'tweak_copy_rot_scl', owner, target )
 
             # create constraints for the right side too
             owner = owner.replace( '.L', '.R' )
-            self.make_constraits( 'tweak_copy_rot_scl', owner, target )
+            batch.add_recipe( 'tweak_copy_rot_scl', owner, target )
 
         # inverted tweak bones constraints
         tweak_nose = {
@@ -910,19 +861,21 @@ class Rig:
         for owner in list( tweak_nose.keys() ):
             target    = tweak_nose[owner][0]
             influence = tweak_nose[owner][1]
-            self.make_constraits( 'tweak_copyloc_inv', owner, target, influence )
+            batch.add_recipe( 'tweak_copyloc_inv', owner, target, influence )
 
         # MCH tongue constraints
         divider = len( all_bones['mch']['tongue'] ) + 1
         factor  = len( all_bones['mch']['tongue'] )
 
         for owner in all_bones['mch']['tongue']:
-            self.make_constraits( 'mch_tongue_copy_trans', owner, 'tongue_master', ( 1 / divider ) * factor )
+            batch.add_recipe( 'mch_tongue_copy_trans', owner, 'tongue_master', ( 1 / divider ) * factor )
             factor -= 1
 
+        batch.apply()
+
     def drivers_and_props( self, all_bones ):
 
-        bpy.ops.object.mode_set(mode ='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         jaw_ctrl  = all_bones['ctrls']['jaw'][0]
@@ -974,7 +927,7 @@ class Rig:
 
     def create_bones(self):
         org_bones = self.org_bones
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Clear parents for org bones
@@ -1099,7 +1052,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -1748,7 +1701,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['brow.T.R.002']]
     bones['brow.T.R.003'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['face']]
     pbone.rigify_type = 'faces.super_face'
     pbone.lock_location = (False, False, False)
@@ -2394,7 +2347,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'QUATERNION'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
@@ -2408,7 +2361,7 @@ def create_sample(obj):
 
 
 def create_square_widget(rig, bone_name, size=1.0, bone_transform_name=None):
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('square', size))
     if obj is not None:
         verts = [
             (  0.5 * size, -2.9802322387695312e-08 * size,  0.5 * size ),
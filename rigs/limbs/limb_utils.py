@@ -1,7 +1,7 @@
-import bpy, re
+import re
 from mathutils import Vector
 from ...utils import org, strip_org, make_mechanism_name, make_deformer_name
-from ...utils import MetarigError
+from ...constraints import make_constraint as _make_constraint
 
 bilateral_suffixes = ['.L','.R']
 
@@ -21,24 +21,7 @@ def orient_bone( cls, eb, axis, scale = 1.0, reverse = False ):
     eb.roll = 0.0
 
 def make_constraint( cls, bone, constraint ):
-    bpy.ops.object.mode_set(mode = 'OBJECT')
-    pb = cls.obj.pose.bones
-
-    owner_pb = pb[bone]
-    const    = owner_pb.constraints.new( constraint['constraint'] )
-
-    constraint['target'] = cls.obj
-
-    # filter constraint props to those that actually exist in the current
-    # type of constraint, then assign values to each
-    for p in [ k for k in constraint.keys() if k in dir(const) ]:
-        if p in dir( const ):
-            setattr( const, p, constraint[p] )
-        else:
-            raise MetarigError(
-                "RIGIFY ERROR: property %s does not exist in %s constraint" % (
-                    p, constraint['constraint']
-            ))
+    _make_constraint( cls.obj, bone, constraint )
 
 def get_bone_name( name, btype, suffix = '' ):
     # RE pattern match right or left parts
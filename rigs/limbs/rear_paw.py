@@ -1,4 +1,5 @@
 import bpy
+from ...utils import set_mode
 
 from .paw import Rig as pawRig
 from .paw import parameters_ui
@@ -16,7 +17,7 @@ class Rig(pawRig):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -133,7 +134,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['r_pinky.001.L']]
     bones['r_pinky.002.L'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['thigh.L']]
     pbone.rigify_type = 'limbs.super_limb'
     pbone.lock_location = (False, False, False)
@@ -279,7 +280,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'QUATERNION'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
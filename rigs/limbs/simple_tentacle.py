@@ -4,6 +4,7 @@ from ...utils import strip_org, make_deformer_name, connected_children_names
 from ...utils import make_mechanism_name, put_bone, create_sphere_widget
 from ...utils import create_widget, create_circle_widget
 from ...utils import MetarigError
+from ...utils import set_mode
 from rna_prop_ui import rna_idprop_ui_prop_get
 
 
@@ -28,7 +29,7 @@ class Rig:
 
     def make_controls(self):
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         org_bones = self.org_bones
 
         ctrl_chain = []
@@ -44,7 +45,7 @@ class Rig:
             ctrl_chain.append( ctrl_bone )
 
         # Make widgets
-        bpy.ops.object.mode_set(mode ='OBJECT')
+        set_mode('OBJECT')
 
         for ctrl in ctrl_chain:
             create_circle_widget(self.obj, ctrl, radius=0.3, head_tail=0.5)
@@ -53,7 +54,7 @@ class Rig:
 
     def make_tweaks(self):
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
         org_bones = self.org_bones
 
@@ -82,7 +83,7 @@ class Rig:
             tweak_chain.append( tweak_bone )
 
         # Make widgets
-        bpy.ops.object.mode_set(mode = 'OBJECT')
+        set_mode('OBJECT')
 
         for tweak in tweak_chain:
             create_sphere_widget( self.obj, tweak )
@@ -106,7 +107,7 @@ class Rig:
 
     def make_deform(self):
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         org_bones = self.org_bones
 
         def_chain = []
@@ -125,7 +126,7 @@ class Rig:
 
     def parent_bones(self, all_bones):
 
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         org_bones = self.org_bones
         eb        = self.obj.data.edit_bones
 
@@ -158,7 +159,7 @@ class Rig:
 
     def make_constraints(self, all_bones):
 
-        bpy.ops.object.mode_set(mode ='OBJECT')
+        set_mode('OBJECT')
         org_bones = self.org_bones
         pb        = self.obj.pose.bones
 
@@ -195,7 +196,7 @@ class Rig:
                 con.owner_space = 'LOCAL'
 
     def generate(self):
-        bpy.ops.object.mode_set(mode ='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Clear all initial parenting
@@ -295,7 +296,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -323,7 +324,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['Bone.002']]
     bones['Bone.001'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Bone']]
     pbone.rigify_type = 'limbs.simple_tentacle'
     pbone.lock_location = (False, False, False)
@@ -346,7 +347,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'QUATERNION'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
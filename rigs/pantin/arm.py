@@ -24,6 +24,7 @@ from ...utils import make_deformer_name, strip_org
 from ...utils import create_bone_widget, create_widget, create_cube_widget
 from ...utils import connected_children_names, has_connected_children
 from ...utils import get_layers
+from ...utils import set_mode
 
 from . import pantin_utils
 from . import limb_common
@@ -96,7 +97,7 @@ class Rig:
                 elimb_ik, elimb_str) = (ik_limb.generate())
             (ulimb_fk, flimb_fk, elimb_fk) = (fk_limb.generate())
 
-            bpy.ops.object.mode_set(mode='EDIT')
+            set_mode('EDIT')
 
             # Def bones
             eb = self.obj.data.edit_bones
@@ -129,7 +130,7 @@ class Rig:
                     eb[b].layers = get_layers(active_layer
                                               + self.params.fk_offset)
 
-            bpy.ops.object.mode_set(mode='OBJECT')
+            set_mode('OBJECT')
             pb = self.obj.pose.bones
 
             # Widgets
@@ -258,7 +259,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -284,7 +285,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['Forearm']]
     bones['Hand'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Arm']]
     pbone.rigify_type = 'pantin.arm'
     pbone.lock_location = (False, False, True)
@@ -330,7 +331,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'XZY'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
@@ -22,6 +22,7 @@ from rna_prop_ui import rna_idprop_ui_prop_get
 from ...utils import make_mechanism_name, make_deformer_name, strip_org
 from ...utils import create_bone_widget, create_widget, create_cube_widget
 from ...utils import connected_children_names, has_connected_children
+from ...utils import set_mode
 
 from . import pantin_utils
 
@@ -46,7 +47,7 @@ class Rig:
         self.org_bones = [self.neck, self.head]
 
     def generate(self):
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         ui_script = ""
 
         ctrl_chain = []
@@ -78,7 +79,7 @@ class Rig:
         if self.params.detach:
             eb[self.head].use_connect = False
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # Widgets
@@ -143,7 +144,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -176,7 +177,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['Head']]
     bones['Eyelid'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Neck']]
     pbone.rigify_type = 'pantin.head'
     pbone.lock_location = (True, True, True)
@@ -214,7 +215,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'XZY'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
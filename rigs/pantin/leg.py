@@ -28,6 +28,7 @@ from ...utils import create_bone_widget, create_widget, create_cube_widget
 from ...utils import connected_children_names, has_connected_children
 from ...utils import align_bone_x_axis
 from ...utils import get_layers
+from ...utils import set_mode
 
 from . import pantin_utils
 from . import limb_common
@@ -119,7 +120,7 @@ class Rig:
 
             ulimb_fk, flimb_fk, elimb_fk = fk_limb.generate()
 
-            bpy.ops.object.mode_set(mode='EDIT')
+            set_mode('EDIT')
             eb = self.obj.data.edit_bones
 
             # Foot rig
@@ -248,7 +249,7 @@ class Rig:
                     eb[b].layers = get_layers(active_layer
                                               + self.params.fk_offset)
 
-            bpy.ops.object.mode_set(mode='OBJECT')
+            set_mode('OBJECT')
             pb = self.obj.pose.bones
 
             # Bone settings
@@ -555,7 +556,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -595,7 +596,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['Foot']]
     bones['Toe'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Thigh']]
     pbone.rigify_type = 'pantin.leg'
     pbone.lock_location = (False, False, True)
@@ -644,7 +645,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'XZY'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
@@ -16,7 +16,6 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
-import bpy
 from rna_prop_ui import rna_idprop_ui_prop_get
 from mathutils import Vector
 from math import radians, degrees
@@ -26,6 +25,7 @@ from ...utils import copy_bone, new_bone, put_bone
 from ...utils import make_mechanism_name, make_deformer_name, strip_org
 from ...utils import connected_children_names, has_connected_children
 from ...utils import align_bone_x_axis
+from ...utils import set_mode
 
 from . import pantin_utils
 
@@ -34,7 +34,7 @@ importlib.reload(pantin_utils)
 
 def create_side_org_bones(obj, org_bones, duplicate, side_suffix):
     """Copy originals with side suffix"""
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     eb = obj.data.edit_bones
 
     side_org_bones = []
@@ -82,7 +82,7 @@ class IKLimb:
         self.pelvis_name = pelvis_name
 
     def generate(self):
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
 
         eb = self.obj.data.edit_bones
 
@@ -220,7 +220,7 @@ class IKLimb:
         # Layers
         joint_str_e.layers = elimb_str_e.layers
         # Object mode, get pose bones
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         ulimb_ik_p = pb[ulimb_ik]
@@ -374,7 +374,7 @@ class FKLimb:
         self.pelvis_name = pelvis_name
 
     def generate(self):
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
 
         eb = self.obj.data.edit_bones
 
@@ -425,7 +425,7 @@ class FKLimb:
         elimb_fk_e.parent = flimb_fk_e
 
         # Object mode, get pose bones
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         ulimb_fk_p = pb[ulimb_fk]
@@ -24,6 +24,7 @@ from ...utils import make_mechanism_name, make_deformer_name, strip_org
 from ...utils import create_bone_widget, create_widget, create_cube_widget
 from ...utils import connected_children_names, has_connected_children
 from ...utils import align_bone_x_axis
+from ...utils import set_mode
 
 from . import pantin_utils
 
@@ -53,7 +54,7 @@ class Rig:
             self.org_parent = self.obj.data.bones[bone_name].parent.name
 
     def generate(self):
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
 
         ctrl_chain = []
 
@@ -98,7 +99,7 @@ class Rig:
             eb[b].parent = eb[self.mouth]
             ctrl_chain.append(b)
             
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
         for b in [ctrl_r, ctrl_uc, ctrl_lc, ctrl_l]:
             pb[b].lock_location = (False, False, True)
@@ -106,7 +107,7 @@ class Rig:
             pb[b].lock_rotation_w = False
             pb[b].lock_scale = (False, False, False)
             pb[b].rotation_mode = 'XZY'
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Stretch
@@ -169,7 +170,7 @@ class Rig:
                     member_index=Z_index,
                     bone_index=i+1, new_name=strip_org(self.org_bones[0])+'_int')
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # Widgets
@@ -231,7 +232,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -285,7 +286,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['Mouth_lower']]
     bones['Mouth_lower.L'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Mouth']]
     pbone.rigify_type = 'pantin.mouth'
     pbone.lock_location = (False, False, True)
@@ -336,7 +337,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'XZY'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
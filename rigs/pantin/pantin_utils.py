@@ -16,7 +16,6 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 
-import bpy
 from mathutils import Vector, Matrix
 from rna_prop_ui import rna_idprop_ui_prop_get
 from math import pi, cos, sin
@@ -27,6 +26,12 @@ from ...utils import strip_org, copy_bone
 from ...utils import create_widget
 from ...utils import create_circle_polygon
 from ...utils import align_bone_z_axis
+from ...utils import set_mode, get_edit_session
+from ...drivers import register_inline
+
+# Depth steps between members and between the bones of a member
+MEMBER_OFFSET = 0.01
+BONE_OFFSET = 0.001
 
 
 def strip_numbers(name):
@@ -62,6 +67,33 @@ def layers_to_index(layers):
         if l:
             return i
 
+def z_index_expression(flip_switch):
+    """ Returns the driver expression giving a deformation bone its depth
+        from its member_index, bone_index and extra_offset and the rig's
+        flip.  Bones with flip_switch change sides when the rig is flipped
+        (eg. limbs), the others don't (eg. head).
+
+        It is the z_index()/z_index_same() of older Pantin UI scripts as
+        plain arithmetic on the driver variables, so the drivers work
+        without the UI script and qualify for Blender's simple expression
+        evaluation instead of running Python.
+    """
+    member = "member_index * %g" % MEMBER_OFFSET
+    offset = "bone_index * %g + extra_offset * %g" % (BONE_OFFSET, MEMBER_OFFSET)
+    if flip_switch:
+        flipped = "%s - (%s)" % (member, offset)
+    else:
+        flipped = "-(%s + %s)" % (member, offset)
+    return "%s if flip else %s + %s" % (flipped, member, offset)
+
+
+# Drivers of rigs generated before z_index_expression() call the functions
+# of the Pantin UI script, optimize_drivers() can replace them
+for _name, _flip_switch in (('z_index', True), ('z_index_same', False)):
+    register_inline(_name, ('member_index', 'flip', 'bone_index', 'extra_offset'),
+                    z_index_expression(_flip_switch), {'extra_offset': 0.0})
+
+
 def create_deformation(obj,
                        bone_name,
                        flip_switch,
@@ -69,7 +101,7 @@ def create_deformation(obj,
                        bone_index=0,
                        extra_offset=0.0,
                        new_name=''):
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     eb = obj.data.edit_bones
 
     org_bone_e = eb[bone_name]
@@ -92,8 +124,21 @@ def create_deformation(obj,
     align_bone_z_axis(obj, def_name, Vector((0, -1, 0)))
     # def_bone_e.tail.z += org_bone_e.length * 0.5
 
-    bpy.ops.object.mode_set(mode='POSE')
+    # The properties and driver need the pose bone, queue them in the
+    # edit session rather than leaving edit mode for every bone
+    session = get_edit_session()
+    if session is not None:
+        session.defer(_deformation_driver, obj, def_name, flip_switch,
+                      member_index, bone_index, extra_offset)
+    else:
+        set_mode('OBJECT')
+        _deformation_driver(obj, def_name, flip_switch,
+                            member_index, bone_index, extra_offset)
+        set_mode('EDIT')
+    return def_name
+
 
+def _deformation_driver(obj, def_name, flip_switch, member_index, bone_index, extra_offset):
     def_bone_p = obj.pose.bones[def_name]
     def_bone_p['member_index'] = member_index
     def_bone_p['bone_index'] = bone_index
@@ -101,14 +146,7 @@ def create_deformation(obj,
 
     # Driver
     driver = obj.driver_add('pose.bones["{}"].location'.format(def_name), 2)
-    if flip_switch:
-        driver.driver.expression = (
-            'z_index(member_index, flip, bone_index, extra_offset)'
-        )
-    else:
-        driver.driver.expression = (
-            'z_index_same(member_index, flip, bone_index, extra_offset)'
-        )
+    driver.driver.expression = z_index_expression(flip_switch)
     var_mi = driver.driver.variables.new()
     var_bi = driver.driver.variables.new()
     var_flip = driver.driver.variables.new()
@@ -144,9 +182,6 @@ def create_deformation(obj,
     var_flip.targets[0].id = obj
     var_flip.targets[0].data_path = 'pose.bones["root"]["flip"]'
 
-    bpy.ops.object.mode_set(mode='EDIT')
-    return def_name
-
 
 # def create_ik_child_of(obj, bone, pelvis_name):
 #     # TODO get real bone name. From UI?
@@ -214,7 +249,7 @@ def make_follow(obj, b, target, ctrl_name=None, follow_name=None):
     eb[ctrl_bone].use_connect = False
     eb[ctrl_bone].parent = eb[follow_bone]
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pb = obj.pose.bones
 
     # Set up custom properties
@@ -252,7 +287,7 @@ def make_follow(obj, b, target, ctrl_name=None, follow_name=None):
         var_pf.targets[0].id_type = 'OBJECT'
         var_pf.targets[0].id = obj
         var_pf.targets[0].data_path = pb[ctrl_bone].path_from_id() + '["follow"]'
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
 
     return ctrl_bone, follow_bone
 
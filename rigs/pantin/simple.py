@@ -25,6 +25,7 @@ from ...utils import make_deformer_name, make_mechanism_name, strip_org
 from ...utils import create_bone_widget, create_widget, create_cube_widget
 from ...utils import connected_children_names, has_connected_children
 from ...utils import align_bone_z_axis
+from ...utils import set_mode
 
 from . import pantin_utils
 
@@ -81,7 +82,7 @@ class Rig:
 
         if self.params.use_parent_Z_index and self.org_parent is not None:
             # Get parent's Z indices
-            bpy.ops.object.mode_set(mode='OBJECT')
+            set_mode('OBJECT')
             pb = self.obj.pose.bones
             def_parent_name = make_deformer_name(strip_org(self.org_parent))
             if (self.params.object_side != ".C" and
@@ -105,7 +106,7 @@ class Rig:
                         bone_Z_index = b['bone_index']
             bone_Z_index += 1
 
-            bpy.ops.object.mode_set(mode='EDIT')
+            set_mode('EDIT')
         else:
             member_Z_index = self.params.member_Z_index
             bone_Z_index = self.params.first_bone_Z_index
@@ -246,7 +247,7 @@ class Rig:
             # ctrl_bone_e.layers = layers
 
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # Pose bone settings
@@ -415,7 +416,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -427,7 +428,7 @@ def create_sample(obj):
     bone.use_connect = False
     bones['Prop'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Prop']]
     pbone.rigify_type = 'pantin.simple'
     pbone.lock_location = (False, False, True)
@@ -456,7 +457,7 @@ def create_sample(obj):
     except AttributeError:
         pass
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
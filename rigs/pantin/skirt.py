@@ -23,6 +23,8 @@ from ...utils import copy_bone
 from ...utils import make_mechanism_name, make_deformer_name, strip_org
 from ...utils import create_bone_widget, create_widget, create_cube_widget
 from ...utils import connected_children_names, has_connected_children
+from ...utils import set_mode
+from ...drivers import make_driver
 
 from . import pantin_utils
 
@@ -36,7 +38,7 @@ class Rig:
         self.org_bone = bone_name
 
     def generate(self):
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
 
         eb = self.obj.data.edit_bones
 
@@ -85,7 +87,7 @@ class Rig:
             eb[flap_b].parent = eb[flap_mch_b]
             eb[flap_b].use_connect = False
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # Constraints
@@ -135,8 +137,6 @@ class Rig:
                 con.subtarget = "ORG-" + shin
 
                 # Drivers
-                driver = self.obj.driver_add(con.path_from_id("influence"))
-
                 # Relative component: which leg to track
                 if f_i != s_i:
                     relative = 'L > R'
@@ -154,31 +154,23 @@ class Rig:
                 else:  # Rear
                     absolute += ' > 0'
 
-                driver.driver.expression = '1 if {} and {} else 0'.format(relative, absolute)
-
-                var = driver.driver.variables.new()
-                var.type = 'TRANSFORMS'
-                var.name = 'L'
-                var.targets[0].id = self.obj
-                var.targets[0].bone_target = trackers[0]
-                var.targets[0].transform_type = 'ROT_Z'
-                var.targets[0].transform_space = 'LOCAL_SPACE'
-
-                var = driver.driver.variables.new()
-                var.type = 'TRANSFORMS'
-                var.name = 'R'
-                var.targets[0].id = self.obj
-                var.targets[0].bone_target = trackers[1]
-                var.targets[0].transform_type = 'ROT_Z'
-                var.targets[0].transform_space = 'LOCAL_SPACE'
-
-                var = driver.driver.variables.new()
-                var.type = 'TRANSFORMS'
-                var.name = 'P'
-                var.targets[0].id = self.obj
-                var.targets[0].bone_target = pb[self.org_bone].parent.name
-                var.targets[0].transform_type = 'ROT_Z'
-                var.targets[0].transform_space = 'LOCAL_SPACE'
+                rotations = [
+                    ('L', trackers[0]),
+                    ('R', trackers[1]),
+                    ('P', pb[self.org_bone].parent.name),
+                ]
+                make_driver(
+                    self.obj, con.path_from_id("influence"),
+                    expression='1 if {} and {} else 0'.format(relative, absolute),
+                    variables=[{
+                        'name': name,
+                        'type': 'TRANSFORMS',
+                        'targets': [{
+                            'bone_target': bone,
+                            'transform_type': 'ROT_Z',
+                            'transform_space': 'LOCAL_SPACE',
+                        }],
+                    } for name, bone in rotations])
 
 
         # return []
@@ -213,7 +205,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -225,7 +217,7 @@ def create_sample(obj):
     bone.use_connect = False
     bones['Skirt'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Skirt']]
     pbone.rigify_type = 'pantin.skirt'
     pbone.lock_location = (False, False, True)
@@ -238,7 +230,7 @@ def create_sample(obj):
     except AttributeError:
         pass
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
@@ -26,6 +26,7 @@ from ...utils import make_deformer_name, make_mechanism_name,  strip_org
 from ...utils import create_bone_widget, create_widget, create_cube_widget
 from ...utils import connected_children_names, has_connected_children
 from ...utils import align_bone_x_axis, align_bone_z_axis
+from ...utils import set_mode
 
 from . import pantin_utils
 
@@ -39,7 +40,7 @@ class Rig:
         self.params = params
 
     def generate(self):
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
 
         eb = self.obj.data.edit_bones
 
@@ -119,7 +120,7 @@ class Rig:
         pelvis_e.use_connect = False
         # pelvis_e.parent = flip_e
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # # Pose bone settings
@@ -228,7 +229,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -261,7 +262,7 @@ def create_sample(obj):
     bone.parent = arm.edit_bones[bones['Thorax']]
     bones['Chest'] = bone.name
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['Pelvis']]
     pbone.rigify_type = 'pantin.torso'
     pbone.lock_location = (False, False, True)
@@ -303,7 +304,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'XZY'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
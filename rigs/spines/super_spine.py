@@ -5,6 +5,8 @@ from ...utils import strip_org, make_deformer_name, connected_children_names
 from ...utils import create_circle_widget, create_sphere_widget, create_neck_bend_widget, create_neck_tweak_widget
 from ..widgets import create_ballsocket_widget
 from ...utils import MetarigError, make_mechanism_name, create_cube_widget
+from ...utils import set_mode
+from ...constraints import ConstraintBatch
 from rna_prop_ui import rna_idprop_ui_prop_get
 
 script = """
@@ -135,7 +137,7 @@ class Rig:
         org_bones = self.org_bones
         pivot_name = org_bones[pivot-1]
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Create torso control bone
@@ -171,7 +173,7 @@ class Rig:
     def create_deform(self):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         def_bones = []
@@ -185,7 +187,7 @@ class Rig:
     def create_neck(self, neck_bones):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         if not self.use_head:
@@ -284,7 +286,7 @@ class Rig:
     def create_chest(self, chest_bones):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # get total spine length
@@ -323,7 +325,7 @@ class Rig:
     def create_hips(self, hip_bones):
         org_bones = self.org_bones
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Create hips control bone
@@ -365,7 +367,7 @@ class Rig:
         }
 
     def create_tail(self, tail_bones):
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
         org_bones = self.org_bones
 
@@ -432,7 +434,7 @@ class Rig:
 
     def parent_bones(self, bones):
         org_bones = self.org_bones
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Parent deform bones
@@ -564,19 +566,12 @@ class Rig:
             eb[org_bones[-1]].parent = eb[bones['neck']['ctrl']]
 
     def make_constraint(self, bone, constraint):
-        bpy.ops.object.mode_set(mode='OBJECT')
-        pb = self.obj.pose.bones
-
-        owner_pb = pb[bone]
-        const = owner_pb.constraints.new(constraint['constraint'])
-        const.target = self.obj
-
-        # filter contraint props to those that actually exist in the currnet
-        # type of constraint, then assign values to each
-        for p in [k for k in constraint.keys() if k in dir(const)]:
-            setattr(const, p, constraint[p])
+        # Queued, constrain_bones() adds them all in one pass
+        self.constraint_batch.add(bone, constraint)
 
     def constrain_bones(self, bones):
+        self.constraint_batch = ConstraintBatch(self.obj)
+
         # MCH bones
 
         # head and neck MCH bones
@@ -725,6 +720,7 @@ class Rig:
                     'subtarget': tweaks[tidx + 1],
                 })
 
+        self.constraint_batch.apply()
         pb = self.obj.pose.bones
 
         if bones['neck']['neck_bend']:
@@ -749,8 +745,10 @@ class Rig:
             for b in original_neck_bones[:-1]:
                 pb[b].ik_stretch = 0.1
 
+        self.constraint_batch.apply()
+
     def create_drivers(self, bones):
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # Setting the torso's props
@@ -803,7 +801,7 @@ class Rig:
             drv_modifier.coefficients[1] = -1.0
 
     def locks_and_widgets(self, bones):
-        bpy.ops.object.mode_set(mode='OBJECT')
+        set_mode('OBJECT')
         pb = self.obj.pose.bones
 
         # deform bones bbone segements
@@ -953,7 +951,7 @@ class Rig:
 
         bone_chains = self.build_bone_structure()
 
-        bpy.ops.object.mode_set(mode='EDIT')
+        set_mode('EDIT')
         eb = self.obj.data.edit_bones
 
         # Clear parents for org bones
@@ -982,7 +980,7 @@ class Rig:
                 bones['tail'] = self.create_tail(tail_bones)
 
             # TEST
-            bpy.ops.object.mode_set(mode='EDIT')
+            set_mode('EDIT')
             eb = self.obj.data.edit_bones
 
             self.parent_bones(bones)
@@ -1139,7 +1137,7 @@ def parameters_ui(layout, params):
 
 def create_sample(obj):
     # generated by rigify.utils.write_metarig
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     arm = obj.data
 
     bones = {}
@@ -1200,7 +1198,7 @@ def create_sample(obj):
     bones['spine.006'] = bone.name
 
 
-    bpy.ops.object.mode_set(mode='OBJECT')
+    set_mode('OBJECT')
     pbone = obj.pose.bones[bones['spine']]
     pbone.rigify_type = 'spines.super_spine'
     pbone.lock_location = (False, False, False)
@@ -1260,7 +1258,7 @@ def create_sample(obj):
     pbone.lock_scale = (False, False, False)
     pbone.rotation_mode = 'QUATERNION'
 
-    bpy.ops.object.mode_set(mode='EDIT')
+    set_mode('EDIT')
     for bone in arm.edit_bones:
         bone.select = False
         bone.select_head = False
@@ -38,79 +38,69 @@ blender.stackexchange.com/questions/40711/how-to-convert-quaternions-keyframes-t
 #     "category": "Animation"}
 
 import bpy
+import numpy as np
+from mathutils import Euler
+
+from .bake import quaternion_to_euler, make_compatible_quaternions, write_fcurve
 
 order_list = ['QUATERNION', 'XYZ', 'XZY', 'YXZ', 'YZX', 'ZXY', 'ZYX']
 
 
 class convert():
-    def get_or_create_fcurve(self, action, data_path, array_index=-1, group=None):
-        for fc in action.fcurves:
-            if fc.data_path == data_path and (array_index < 0 or fc.array_index == array_index):
-                return fc
-
-        fc = action.fcurves.new(data_path, array_index)
-        fc.group = group
-        return fc
-
-    def add_keyframe_quat(self, action, quat, frame, bone_prefix, group):
-        for i in range(len(quat)):
-            fc = self.get_or_create_fcurve(action, bone_prefix + "rotation_quaternion", i, group)
-            pos = len(fc.keyframe_points)
-            fc.keyframe_points.add(1)
-            fc.keyframe_points[pos].co = [frame, quat[i]]
-            fc.update()
-
-    def add_keyframe_euler(self, action, euler, frame, bone_prefix, group):
-        for i in range(len(euler)):
-            fc = self.get_or_create_fcurve(action, bone_prefix + "rotation_euler", i, group)
-            pos = len(fc.keyframe_points)
-            fc.keyframe_points.add(1)
-            fc.keyframe_points[pos].co = [frame, euler[i]]
-            fc.update()
-
-    def frames_matching(self, action, data_path):
-        frames = set()
+    def read_channels(self, action, data_path, default):
+        """ Reads all keys of a rotation property at once.  Returns the
+            sorted keyed frames and a (frames, channels) array of values;
+            channels without an fcurve keep their default value.
+        """
+        keys = []
         for fc in action.fcurves:
             if fc.data_path == data_path:
-                fri = [kp.co[0] for kp in fc.keyframe_points]
-                frames.update(fri)
-        return frames
+                co = np.empty(len(fc.keyframe_points) * 2)
+                fc.keyframe_points.foreach_get('co', co)
+                keys.append((fc, co))
+
+        if not keys:
+            return np.empty(0), np.empty((0, len(default)))
+
+        frames = np.unique(np.concatenate([co[0::2] for fc, co in keys]))
+        values = np.tile(np.array(default, dtype=float), (len(frames), 1))
+        for fc, co in keys:
+            if np.array_equal(co[0::2], frames):
+                values[:, fc.array_index] = co[1::2]
+            else:
+                # Channels keyed on other frames than the rest get evaluated
+                values[:, fc.array_index] = [fc.evaluate(fr) for fr in frames]
 
-    # Converts only one group/bone in one action - Quat to euler
-    def group_qe(self, obj, action, bone, bone_prefix, order):
+        return frames, values
 
-        pose_bone = bone
-        data_path = bone_prefix + "rotation_quaternion"
-        frames = self.frames_matching(action, data_path)
-        group = action.groups[bone.name]
+    def write_channels(self, action, data_path, group, frames, values):
+        """ Keys all channels of a rotation property at once.  Converting
+            into fcurves that already exist keeps the interpolation and
+            handle types of their keys, see write_fcurve().
+        """
+        for i in range(values.shape[1]):
+            write_fcurve(action, data_path, i, group, frames, values[:, i])
 
-        for fr in frames:
-            quat = bone.rotation_quaternion.copy()
-            for fc in action.fcurves:
-                if fc.data_path == data_path:
-                    quat[fc.array_index] = fc.evaluate(fr)
-            euler = quat.to_euler(order)
+    # Converts only one group/bone in one action - Quat to euler
+    def group_qe(self, obj, action, bone, bone_prefix, order):
 
-            self.add_keyframe_euler(action, euler, fr, bone_prefix, group)
-            bone.rotation_mode = order
+        frames, quats = self.read_channels(action, bone_prefix + "rotation_quaternion", bone.rotation_quaternion)
+        if len(frames):
+            # Consecutive eulers are kept compatible, so no 360 degree flips
+            eulers = quaternion_to_euler(quats, order)
+            self.write_channels(action, bone_prefix + "rotation_euler", bone.name, frames, eulers)
+        bone.rotation_mode = order
 
     # Converts only one group/bone in one action - Euler to Quat
     def group_eq(self, obj, action, bone, bone_prefix, order):
 
-        pose_bone = bone
-        data_path = bone_prefix + "rotation_euler"
-        frames = self.frames_matching(action, data_path)
-        group = action.groups[bone.name]
-
-        for fr in frames:
-            euler = bone.rotation_euler.copy()
-            for fc in action.fcurves:
-                if fc.data_path == data_path:
-                    euler[fc.array_index] = fc.evaluate(fr)
-            quat = euler.to_quaternion()
-
-            self.add_keyframe_quat(action, quat, fr, bone_prefix, group)
-            bone.rotation_mode = order
+        euler_order = bone.rotation_euler.order
+        frames, eulers = self.read_channels(action, bone_prefix + "rotation_euler", bone.rotation_euler)
+        if len(frames):
+            quats = np.array([Euler(e, euler_order).to_quaternion() for e in eulers])
+            quats = make_compatible_quaternions(quats)
+            self.write_channels(action, bone_prefix + "rotation_quaternion", bone.name, frames, quats)
+        bone.rotation_mode = order
 
     # One Action - One Bone
     def one_act_one_bon(self, obj, action, bone, order):
@@ -151,7 +141,7 @@ class convert():
             self.group_qe(obj, action, bone, bone_prefix, order)
 
             # Removes quaternion fcurves
-            for key in action.fcurves:
+            for key in list(action.fcurves):
                 if key.data_path == 'pose.bones["' + bone.name + '"].rotation_quaternion':
                     action.fcurves.remove(key)
 
@@ -161,7 +151,7 @@ class convert():
             self.group_eq(obj, action, bone, bone_prefix, order)
 
             # Removes euler fcurves
-            for key in action.fcurves:
+            for key in list(action.fcurves):
                 if key.data_path == 'pose.bones["' + bone.name + '"].rotation_euler':
                     action.fcurves.remove(key)
 
@@ -24,15 +24,20 @@ from mathutils import Color
 
 from .utils import get_rig_type, MetarigError
 from .utils import write_metarig, write_widget
+from .metarig_data import write_metarig_data, convert_metarig_modules
 from .utils import unique_name
 from .utils import upgradeMetarigTypes, outdated_types
-from .utils import get_keyed_frames, bones_in_frame
+from .utils import ActionIndex, get_action_index
 from .utils import overwrite_prop_animation
 from .rigs.utils import get_limb_generated_names
 from . import rig_lists
 from . import template_list
 from . import generate
 from . import rot_mode
+from . import bake
+from . import profiler
+from . import analyzer
+from . import drivers
 
 
 class DATA_UL_rigify_template_list(bpy.types.UIList):
@@ -189,6 +194,19 @@ class DATA_PT_rigify_buttons(bpy.types.Panel):
                 if id_store.rigify_generate_mode == 'new':
                     row.enabled = False
 
+                row = col.row()
+                row.prop(id_store, "rigify_incremental_generation")
+                if id_store.rigify_generate_mode == 'new' or id_store.rigify_force_widget_update:
+                    row.enabled = False
+
+                row = col.row()
+                row.prop(id_store, "rigify_use_generation_cache")
+                if id_store.rigify_generate_mode == 'new' or id_store.rigify_force_widget_update:
+                    row.enabled = False
+
+                row = col.row()
+                row.prop(id_store, "rigify_profile_generation")
+
         elif obj.mode == 'EDIT':
             # Build types list
             collection_name = str(id_store.rigify_collection).replace(" ", "")
@@ -674,12 +692,106 @@ class VIEW3D_PT_tools_rigify_dev(bpy.types.Panel):
                 r.operator("armature.rigify_encode_metarig", text="Encode Metarig to Python")
                 r = self.layout.row()
                 r.operator("armature.rigify_encode_metarig_sample", text="Encode Sample to Python")
+                r = self.layout.row()
+                r.operator("armature.rigify_encode_metarig_data", text="Encode Metarig to Data")
+                r = self.layout.row()
+                r.operator("armature.rigify_convert_metarigs", text="Convert Bundled Metarigs to Data")
 
             if context.mode == 'EDIT_MESH':
                 r = self.layout.row()
                 r.operator("mesh.rigify_encode_mesh_widget", text="Encode Mesh Widget to Python")
 
 
+class DATA_PT_rigify_profile(bpy.types.Panel):
+    bl_label = "Rigify Generation Profile"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "data"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    # Rows shown per list, the text block reports have everything
+    MAX_ROWS = 8
+
+    @classmethod
+    def poll(cls, context):
+        return context.object is not None and context.object.type == 'ARMATURE' \
+            and profiler.last_profile() is not None
+
+    def draw(self, context):
+        layout = self.layout
+        profile = profiler.last_profile()
+
+        layout.label(text="%s: %.3f s" % (profile.rig_name, profile.total))
+        layout.label(text="Reports: %s, %s" % (profiler.REPORT_JSON, profiler.REPORT_CSV))
+
+        col = layout.column(align=True)
+        col.label(text="Phases:")
+        for name, seconds in profile.phases:
+            row = col.row()
+            row.label(text=name)
+            row.label(text="%.3f s" % seconds)
+
+        col = layout.column(align=True)
+        col.label(text="Rig types:")
+        for rig_type, n, times, calls in profile.by_rig_type()[:self.MAX_ROWS]:
+            row = col.row()
+            row.label(text="%s (%d)" % (rig_type, n))
+            row.label(text="%.3f s" % profiler.rig_total(times))
+            row.label(text="%d bones, %d constraints" % (calls['bone'], calls['constraint']))
+
+        col = layout.column(align=True)
+        col.label(text="Slowest rigs:")
+        for entry in profile.as_dict()['rigs'][:self.MAX_ROWS]:
+            times = entry['times']
+            row = col.row()
+            row.label(text=entry['bone'])
+            row.label(text="%.3f s" % profiler.rig_total(times))
+            row.label(text="mode %.3f, widgets %.3f" % (times['mode'], times['widget']))
+
+
+class DATA_PT_rigify_cost(bpy.types.Panel):
+    bl_label = "Rigify Rig Cost"
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "data"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    # Rows shown, the text block reports have everything
+    MAX_ROWS = 8
+
+    @classmethod
+    def poll(cls, context):
+        return context.object is not None and context.object.type == 'ARMATURE' \
+            and context.object.data.get("rig_id") is not None
+
+    def draw(self, context):
+        layout = self.layout
+        row = layout.row(align=True)
+        row.operator("pose.rigify_analyze_rig")
+        row.operator("pose.rigify_optimize_drivers")
+
+        report = analyzer.last_report()
+        if report is None or report['rig'] != context.object.name:
+            return
+
+        totals = report['totals']
+        layout.label(text="Reports: %s, %s" % (analyzer.REPORT_JSON, analyzer.REPORT_CSV))
+        col = layout.column(align=True)
+        col.label(text="%d bones, %d constraints, %d drivers (%d Python)" % (
+            totals['bones'], totals['constraints'], totals['drivers'], len(totals['python_drivers'])))
+        col.label(text="%d B-Bone segments, chain depth %d" % (totals['bbone_segments'], totals['chain_depth']))
+        if report['playback']:
+            col.label(text="Playback: %.1f fps" % report['playback']['fps'])
+
+        col = layout.column(align=True)
+        col.label(text="Costliest components:")
+        for entry in report['components'][:self.MAX_ROWS]:
+            row = col.row()
+            row.label(text="%s (%s)" % (entry['component'], entry['rig_type'] or "-"))
+            row.label(text="%d constraints, %d drivers" % (entry['constraints'], entry['drivers']))
+            row.label(text="%d Python, depth %d" % (len(entry['python_drivers']), entry['chain_depth']))
+
+
 class VIEW3D_PT_rigify_animation_tools(bpy.types.Panel):
     bl_label = "Rigify Animation Tools"
     bl_category = 'Tools'
@@ -798,7 +910,8 @@ class Generate(bpy.types.Operator):
         use_global_undo = context.user_preferences.edit.use_global_undo
         context.user_preferences.edit.use_global_undo = False
         try:
-            generate.generate_rig(context, context.object)
+            if generate.generate_rig(context, context.object):
+                self.report({'INFO'}, "Rig is up to date, nothing to generate")
         except MetarigError as rig_exception:
             rigify_report_exception(self, rig_exception)
         finally:
@@ -807,6 +920,58 @@ class Generate(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class AnalyzeRig(bpy.types.Operator):
+    """Reports the evaluation cost of the active generated rig"""
+
+    bl_idname = "pose.rigify_analyze_rig"
+    bl_label = "Analyze Rig Cost"
+    bl_description = 'Counts what the rig evaluates per rig component and times playback'
+
+    playback = bpy.props.BoolProperty(name="Time Playback", default=True,
+                                      description="Play the scene's frame range back and measure the fps")
+
+    def execute(self, context):
+        try:
+            report = analyzer.analyze_rig(context.object)
+            if self.playback:
+                report['playback'] = analyzer.measure_playback(context, context.object)
+        except MetarigError as rig_exception:
+            rigify_report_exception(self, rig_exception)
+            return {'CANCELLED'}
+
+        analyzer.write_texts(report)
+        return {'FINISHED'}
+
+
+class OptimizeDrivers(bpy.types.Operator):
+    """Rewrites the drivers of the active rig into forms that don't need Python"""
+
+    bl_idname = "pose.rigify_optimize_drivers"
+    bl_label = "Optimize Drivers"
+    bl_options = {'UNDO'}
+    bl_description = 'Rewrites driver expressions into equivalent ones Blender evaluates without Python'
+
+    def execute(self, context):
+        obj = context.object
+
+        # Rig types register the driver functions they can inline
+        for rig_type in set(analyzer.component_types(obj).values()):
+            if rig_type:
+                try:
+                    get_rig_type(rig_type)
+                except ImportError:
+                    pass
+
+        python_drivers = drivers.optimize_drivers(obj)
+        for fcu in python_drivers:
+            print("Rigify: driver on %s needs Python: %s" % (fcu.data_path, fcu.driver.expression))
+        if python_drivers:
+            self.report({'WARNING'}, "%d drivers still need Python, see the console" % len(python_drivers))
+        else:
+            self.report({'INFO'}, "No driver needs Python")
+        return {'FINISHED'}
+
+
 class UpgradeMetarigTypes(bpy.types.Operator):
     """Upgrades metarig bones rigify_types"""
 
@@ -925,6 +1090,62 @@ class EncodeMetarigSample(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class EncodeMetarigData(bpy.types.Operator):
+    """ Creates a compact data file (JSON) that will generate the
+        selected metarig.
+    """
+    bl_idname = "armature.rigify_encode_metarig_data"
+    bl_label = "Rigify Encode Metarig Data"
+    bl_options = {'UNDO'}
+
+    @classmethod
+    def poll(self, context):
+        return context.mode == 'EDIT_ARMATURE'
+
+    def execute(self, context):
+        name = "metarig.json"
+
+        if name in bpy.data.texts:
+            text_block = bpy.data.texts[name]
+            text_block.clear()
+        else:
+            text_block = bpy.data.texts.new(name)
+
+        text = write_metarig_data(context.active_object, layers=True, groups=True)
+        text_block.write(text)
+        bpy.ops.object.mode_set(mode='EDIT')
+
+        return {'FINISHED'}
+
+
+class ConvertMetarigs(bpy.types.Operator):
+    """ Writes a data file next to every python metarig shipped with
+        Rigify, which the Add menu then uses instead of the python module.
+    """
+    bl_idname = "armature.rigify_convert_metarigs"
+    bl_label = "Rigify Convert Metarigs"
+
+    @classmethod
+    def poll(self, context):
+        return context.mode == 'EDIT_ARMATURE'
+
+    def execute(self, context):
+        obj = context.active_object
+        mode = obj.mode
+        try:
+            written = convert_metarig_modules()
+        except (OSError, MetarigError) as e:
+            self.report({'ERROR'}, "Couldn't convert metarigs: %s" % e)
+            return {'CANCELLED'}
+        finally:
+            context.scene.objects.active = obj
+            if obj.mode != mode:
+                bpy.ops.object.mode_set(mode=mode)
+
+        self.report({'INFO'}, "Wrote %d metarig data files" % len(written))
+        return {'FINISHED'}
+
+
 class EncodeWidget(bpy.types.Operator):
     """ Creates Python code that will generate the selected metarig.
     """
@@ -967,18 +1188,64 @@ class OBJECT_OT_GetFrameRange(bpy.types.Operator):
         return {'FINISHED'}
 
 
+def bake_limb_snap(rig, names, frames, to_fk):
+    """ Snaps a limb on all frames in one go, evaluating the rig once per
+        frame and keying the results directly.  Returns the frames left to
+        the rig UI operators: rotation mode IK snapping (which depends on
+        the IK solver) and legacy limbs.
+    """
+    if not frames:
+        return frames
+    if to_fk and not bake.can_snap_to_fk(rig, names):
+        return frames
+    if not to_fk and not names['pole']:
+        return frames
+
+    pole_prop = (names['parent'], 'pole_vector')
+    poses, props = bake.sample_pose(rig, frames, bake.snap_bones(rig, names, to_fk),
+                                    props=() if to_fk else (pole_prop,))
+
+    if to_fk:
+        steps = bake.fk_from_ik_steps(rig, names, poses)
+        remaining = []
+    else:
+        use_pole = props[pole_prop] != 0.0
+        if not use_pole.any():
+            return frames
+        remaining = [f for f, pole in zip(frames, use_pole) if not pole]
+        frames = [f for f, pole in zip(frames, use_pole) if pole]
+        poses = {name: matrices[use_pole] for name, matrices in poses.items()}
+        steps = bake.ik_from_fk_steps(rig, names, poses)
+        if steps is None:
+            return remaining + frames
+
+    bake.write_snap(rig, frames, bake.solve_snap(rig, steps, poses))
+    return sorted(remaining)
+
+
+def get_snap_operator(rig, name):
+    """ Returns the IK/FK snapping operator of a rig, e.g. 'arm_fk2ik'.
+        Rigs generated before the UI runtime was shared have their own copy
+        of it, with the rig_id in its name.
+    """
+    own = "rigify_%s_%s" % (name, rig.data['rig_id'])
+    if own in dir(bpy.ops.pose):
+        return getattr(bpy.ops.pose, own)
+    return getattr(bpy.ops.pose, "rigify_" + name)
+
+
 def FktoIk(rig, window='ALL'):
 
     scn = bpy.context.scene
     id_store = bpy.context.window_manager
 
-    rig_id = rig.data['rig_id']
-    leg_ik2fk = eval('bpy.ops.pose.rigify_leg_ik2fk_' + rig_id)
-    arm_ik2fk = eval('bpy.ops.pose.rigify_arm_ik2fk_' + rig_id)
+    leg_ik2fk = get_snap_operator(rig, 'leg_ik2fk')
+    arm_ik2fk = get_snap_operator(rig, 'arm_ik2fk')
     limb_generated_names = get_limb_generated_names(rig)
 
+    index = get_action_index(rig)
     if window == 'ALL':
-        frames = get_keyed_frames(rig)
+        frames = index.all_frames
         frames = [f for f in frames if f in range(id_store.rigify_transfer_start_frame, id_store.rigify_transfer_end_frame+1)]
     elif window == 'CURRENT':
         frames = [scn.frame_current]
@@ -1032,9 +1299,12 @@ def FktoIk(rig, window='ALL'):
                     args = (controls[0], controls[1], controls[2], controls[3],
                             controls[6], controls[5], pole, parent)
 
-                for f in frames:
-                    if not bones_in_frame(f, rig, *args):
-                        continue
+                keyed = set(index.bone_frames(*args))
+                limb_frames = [f for f in frames if f in keyed]
+                if window == 'ALL':
+                    limb_frames = bake_limb_snap(rig, names, limb_frames, to_fk=False)
+
+                for f in limb_frames:
                     scn.frame_set(f)
                     func(**kwargs)
                     bpy.ops.anim.keyframe_insert_menu(type='BUILTIN_KSI_VisualLocRot')
@@ -1050,13 +1320,13 @@ def IktoFk(rig, window='ALL'):
     scn = bpy.context.scene
     id_store = bpy.context.window_manager
 
-    rig_id = rig.data['rig_id']
-    leg_fk2ik = eval('bpy.ops.pose.rigify_leg_fk2ik_' + rig_id)
-    arm_fk2ik = eval('bpy.ops.pose.rigify_arm_fk2ik_' + rig_id)
+    leg_fk2ik = get_snap_operator(rig, 'leg_fk2ik')
+    arm_fk2ik = get_snap_operator(rig, 'arm_fk2ik')
     limb_generated_names = get_limb_generated_names(rig)
 
+    index = get_action_index(rig)
     if window == 'ALL':
-        frames = get_keyed_frames(rig)
+        frames = index.all_frames
         frames = [f for f in frames if f in range(id_store.rigify_transfer_start_frame, id_store.rigify_transfer_end_frame+1)]
     elif window == 'CURRENT':
         frames = [scn.frame_current]
@@ -1106,9 +1376,12 @@ def IktoFk(rig, window='ALL'):
                     args = (controls[0], controls[1], controls[2], controls[3],
                             controls[6], controls[5], pole, parent)
 
-                for f in frames:
-                    if not bones_in_frame(f, rig, *args):
-                        continue
+                keyed = set(index.bone_frames(*args))
+                limb_frames = [f for f in frames if f in keyed]
+                if window == 'ALL':
+                    limb_frames = bake_limb_snap(rig, names, limb_frames, to_fk=True)
+
+                for f in limb_frames:
                     scn.frame_set(f)
                     func(**kwargs)
                     bpy.ops.anim.keyframe_insert_menu(type='BUILTIN_KSI_VisualLocRot')
@@ -1135,12 +1408,10 @@ def clearAnimation(act, type, names):
             elif type == 'FK':
                 bones.extend([names[group]['controls'][1], names[group]['controls'][2], names[group]['controls'][3],
                               names[group]['controls'][4]])
+    index = ActionIndex(act)
     FCurves = []
-    for fcu in act.fcurves:
-        words = fcu.data_path.split('"')
-        if (words[0] == "pose.bones[" and
-                    words[1] in bones):
-            FCurves.append(fcu)
+    for bone in set(bones):
+        FCurves.extend(index.fcurves.get(bone, []))
 
     if FCurves == []:
         return
@@ -1161,15 +1432,15 @@ def rotPoleToggle(rig, window='ALL', value=False, toggle=False, bake=False):
     scn = bpy.context.scene
     id_store = bpy.context.window_manager
 
-    rig_id = rig.data['rig_id']
-    leg_fk2ik = eval('bpy.ops.pose.rigify_leg_fk2ik_' + rig_id)
-    arm_fk2ik = eval('bpy.ops.pose.rigify_arm_fk2ik_' + rig_id)
-    leg_ik2fk = eval('bpy.ops.pose.rigify_leg_ik2fk_' + rig_id)
-    arm_ik2fk = eval('bpy.ops.pose.rigify_arm_ik2fk_' + rig_id)
+    leg_fk2ik = get_snap_operator(rig, 'leg_fk2ik')
+    arm_fk2ik = get_snap_operator(rig, 'arm_fk2ik')
+    leg_ik2fk = get_snap_operator(rig, 'leg_ik2fk')
+    arm_ik2fk = get_snap_operator(rig, 'arm_ik2fk')
     limb_generated_names = get_limb_generated_names(rig)
 
+    index = get_action_index(rig)
     if window == 'ALL':
-        frames = get_keyed_frames(rig)
+        frames = index.all_frames
         frames = [f for f in frames if f in range(id_store.rigify_transfer_start_frame, id_store.rigify_transfer_end_frame+1)]
     elif window == 'CURRENT':
         frames = [scn.frame_current]
@@ -1236,8 +1507,9 @@ def rotPoleToggle(rig, window='ALL', value=False, toggle=False, bake=False):
                               'main_parent': parent}
                     args = (controls[0], controls[6], controls[5], pole, parent)
 
+                keyed = set(index.bone_frames(*args))
                 for f in frames:
-                    if not bones_in_frame(f, rig, *args):
+                    if f not in keyed:
                         continue
                     scn.frame_set(f)
                     func1(**kwargs1)
@@ -1246,7 +1518,8 @@ def rotPoleToggle(rig, window='ALL', value=False, toggle=False, bake=False):
                     if bake:
                         bpy.ops.anim.keyframe_insert_menu(type='BUILTIN_KSI_VisualLocRot')
                         bpy.ops.anim.keyframe_insert_menu(type='Scaling')
-                        overwrite_prop_animation(rig, rig.pose.bones[parent], 'pole_vector', new_pole_vector_value, [f])
+                        overwrite_prop_animation(rig, rig.pose.bones[parent], 'pole_vector', new_pole_vector_value, [f],
+                                                 index=index)
 
                 bpy.ops.pose.select_all(action='DESELECT')
                 limb_generated_names.pop(group)
@@ -1373,17 +1646,23 @@ def register():
     bpy.utils.register_class(DATA_PT_rigify_bone_groups)
     bpy.utils.register_class(DATA_PT_rigify_layer_names)
     bpy.utils.register_class(DATA_PT_rigify_buttons)
+    bpy.utils.register_class(DATA_PT_rigify_profile)
+    bpy.utils.register_class(DATA_PT_rigify_cost)
     bpy.utils.register_class(BONE_PT_rigify_buttons)
     bpy.utils.register_class(VIEW3D_PT_rigify_animation_tools)
     bpy.utils.register_class(VIEW3D_PT_tools_rigify_dev)
     bpy.utils.register_class(LayerInit)
     bpy.utils.register_class(TemplateInit)
     bpy.utils.register_class(Generate)
+    bpy.utils.register_class(AnalyzeRig)
+    bpy.utils.register_class(OptimizeDrivers)
     bpy.utils.register_class(UpgradeMetarigTypes)
     bpy.utils.register_class(SwitchToLegacy)
     bpy.utils.register_class(Sample)
     bpy.utils.register_class(EncodeMetarig)
     bpy.utils.register_class(EncodeMetarigSample)
+    bpy.utils.register_class(EncodeMetarigData)
+    bpy.utils.register_class(ConvertMetarigs)
     bpy.utils.register_class(EncodeWidget)
     bpy.utils.register_class(OBJECT_OT_GetFrameRange)
     bpy.utils.register_class(OBJECT_OT_FK2IK)
@@ -1411,17 +1690,23 @@ def unregister():
     bpy.utils.unregister_class(DATA_PT_rigify_bone_groups)
     bpy.utils.unregister_class(DATA_PT_rigify_layer_names)
     bpy.utils.unregister_class(DATA_PT_rigify_buttons)
+    bpy.utils.unregister_class(DATA_PT_rigify_profile)
+    bpy.utils.unregister_class(DATA_PT_rigify_cost)
     bpy.utils.unregister_class(BONE_PT_rigify_buttons)
     bpy.utils.unregister_class(VIEW3D_PT_rigify_animation_tools)
     bpy.utils.unregister_class(VIEW3D_PT_tools_rigify_dev)
     bpy.utils.unregister_class(LayerInit)
     bpy.utils.unregister_class(TemplateInit)
     bpy.utils.unregister_class(Generate)
+    bpy.utils.unregister_class(AnalyzeRig)
+    bpy.utils.unregister_class(OptimizeDrivers)
     bpy.utils.unregister_class(UpgradeMetarigTypes)
     bpy.utils.unregister_class(SwitchToLegacy)
     bpy.utils.unregister_class(Sample)
     bpy.utils.unregister_class(EncodeMetarig)
     bpy.utils.unregister_class(EncodeMetarigSample)
+    bpy.utils.unregister_class(EncodeMetarigData)
+    bpy.utils.unregister_class(ConvertMetarigs)
     bpy.utils.unregister_class(EncodeWidget)
     bpy.utils.unregister_class(OBJECT_OT_GetFrameRange)
     bpy.utils.unregister_class(OBJECT_OT_FK2IK)
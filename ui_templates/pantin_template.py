@@ -28,6 +28,8 @@ rig_id = "%s"
 #######################
 ## Driver namespace  ##
 #######################
+# Used by the depth drivers of rigs generated before they became plain
+# expressions (see pantin_utils.z_index_expression())
 MEMBER_OFFSET = 0.01
 BONE_OFFSET = 0.001
 
@@ -326,6 +328,8 @@ class Rigify_Fill_Members(bpy.types.Operator):
     def execute(self, context):
         obj = context.object
 
+        # pantin_members is the member -> bones index the other operators
+        # work from, so they never have to scan the whole armature
         obj.pantin_members.clear()
         members = {}
         for pbone in obj.pose.bones:
@@ -402,6 +406,12 @@ class Rigify_Sort_Doubles(bpy.types.Operator):
         getattr(bpy.ops.pose, 'rigify_fill_members' + rig_id)()
         return {'FINISHED'}
 
+def refresh_depth(context, obj):
+    # The depth drivers read the bones' index properties, which don't tag
+    # anything for update when they change
+    obj.update_tag({"DATA"})
+    context.scene.update()
+
 class Rigify_Reorder_Members(bpy.types.Operator):
     """ Change members' order"""
     bl_idname = "pose.rigify_reorder_members" + rig_id
@@ -417,59 +427,75 @@ class Rigify_Reorder_Members(bpy.types.Operator):
 
     def execute(self, context):
         obj = context.object
-        # print(self.direction)
-        # print(self.list_member_index)
-        active_member = obj.pantin_members[self.list_member_index]
+        members = obj.pantin_members
+        i = self.list_member_index
+
+        if self.direction == 'UP':
+            j = i - 1
+        elif self.direction == 'DOWN':
+            j = i + 1
+        else:
+            return {'CANCELLED'}
+        if not 0 <= j < len(members):
+            return {'CANCELLED'}
+
+        # Setting a member's index moves its bones (see member_index_update())
+        active_member, other_member = members[i], members[j]
         active_member_index = active_member.index
+        active_member.index = other_member.index
+        other_member.index = active_member_index
+        members.move(i, j)
 
-        print('MEMBER:', active_member_index)
-        num_members = len(obj.pantin_members)
+        refresh_depth(context, obj)
+        return {'FINISHED'}
 
-        tmp = active_member_index
-        other_member = None
-        if self.direction == 'UP':
-            if self.list_member_index > 0:
-                other_member = obj.pantin_members[self.list_member_index-1]
-                other_member_index = other_member.index
+class Rigify_Order_Members(bpy.types.Operator):
+    """ Give all members a new order at once"""
+    bl_idname = "pose.rigify_order_members" + rig_id
+    bl_label = "Order members"
+    bl_options = {'UNDO'}
 
-        elif self.direction == 'DOWN':
-            if self.list_member_index < num_members-1:
-                other_member = obj.pantin_members[self.list_member_index+1]
-                other_member_index = other_member.index
+    order = bpy.props.StringProperty(
+        name="Order",
+        description="Current indices of all the members, front to back, separated by commas")
 
-        if other_member is not None:
-            for b in obj.pose.bones:
-                if not b.bone.use_deform:
-                    continue
-                if b['member_index'] == active_member_index:
-                    b['member_index'] = other_member_index
-                elif b['member_index'] == other_member_index :
-                    b['member_index'] = active_member_index
-
-            # move in UI
-            active_member.index = other_member_index
-            other_member.index = active_member_index
-            if self.direction == 'UP':
-                obj.pantin_members.move(self.list_member_index, self.list_member_index-1)
-            elif self.direction == 'DOWN':
-                obj.pantin_members.move(self.list_member_index, self.list_member_index+1)
-
-                # # move for real
-                # active_bone['bone_index'] = next_bone['bone_index']
-                # next_bone['bone_index'] = tmp
-
-                # # # move in UI
-                # # bone0 = active_member.bones[list_bone_index]
-                # # bone1 = active_member.bones[list_bone_index+1]
-                # # active_member.bones.move(list_bone_index, list_bone_index + 1)
-                # # active_member.active_bone += 1
-                # # bone0.index += 1
-                # # bone1.index -= 1
-
-        mode = bpy.context.mode
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.object.mode_set(mode=mode)
+    @classmethod
+    def poll(cls, context):
+        return (context.active_object != None and context.active_object.type == 'ARMATURE')
+
+    def invoke(self, context, event):
+        self.order = ', '.join('{:g}'.format(m.index) for m in context.object.pantin_members)
+        return context.window_manager.invoke_props_dialog(self, width=400)
 
+    def execute(self, context):
+        obj = context.object
+        members = obj.pantin_members
+
+        try:
+            order = [round(float(i), 3) for i in self.order.split(',') if i.strip()]
+        except ValueError:
+            self.report({'ERROR'}, 'Member indices must be numbers: {}'.format(self.order))
+            return {'CANCELLED'}
+
+        by_index = {round(m.index, 3): m for m in members}
+        if len(order) != len(members) or set(order) != set(by_index):
+            self.report({'ERROR'}, 'The order must list each of the {} members once'.format(len(members)))
+            return {'CANCELLED'}
+
+        # The members keep the same set of indices, handed out in the new order
+        slots = sorted((m.index for m in members), reverse=True)
+        new_indices = dict(zip(order, slots))
+        for m in members:
+            m.index = new_indices[round(m.index, 3)]
+
+        # Then the list is sorted to match, highest index first
+        for i, index in enumerate(slots):
+            for j in range(i, len(members)):
+                if members[j].index == index:
+                    members.move(j, i)
+                    break
+
+        refresh_depth(context, obj)
         return {'FINISHED'}
 
 class Rigify_Reorder_Bones(bpy.types.Operator):
@@ -487,60 +513,39 @@ class Rigify_Reorder_Bones(bpy.types.Operator):
 
     def execute(self, context):
         obj = context.object
-        # print(self.direction)
-        # print(self.list_member_index)
         active_member = obj.pantin_members[self.list_member_index]
-        active_member_index = active_member.index
-        list_bone_index = active_member.active_bone
-        rig_bone_index = active_member.bones[active_member.active_bone].index
-        print('BONE:', rig_bone_index)
-        num_bones = len(active_member.bones)
-        # get related bones in rig
-        for b in obj.pose.bones:
-            if not b.bone.use_deform:
-                continue
-            if b['member_index'] == active_member_index and b['bone_index'] == rig_bone_index:
-                active_bone = b
-            if rig_bone_index < num_bones-1 and b['member_index'] == active_member_index and b['bone_index'] == rig_bone_index + 1 :
-                previous_bone = b
-            if rig_bone_index > 0 and b['member_index'] == active_member_index and b['bone_index'] == rig_bone_index - 1 :
-                next_bone = b
-        # for b in(previous_bone, active_bone, next_bone):
-        #     try:
-        #         print(b)
-        #     except:
-        #         pass
-        tmp = active_bone['bone_index']
+        bones = active_member.bones
+        i = active_member.active_bone
+
+        # The list shows the highest bone index first
         if self.direction == 'UP':
-            if rig_bone_index < num_bones-1:
-                # move for real
-                active_bone['bone_index'] = previous_bone['bone_index']
-                previous_bone['bone_index'] = tmp
-                # move in UI
-                bone0 = active_member.bones[list_bone_index]
-                bone1 = active_member.bones[list_bone_index-1]
-                active_member.bones.move(list_bone_index, list_bone_index - 1)
-                active_member.active_bone -= 1
-                bone0.index -= 1
-                bone1.index += 1
-
-        if self.direction == 'DOWN':
-            if rig_bone_index > 0:
-                # move for real
-                active_bone['bone_index'] = next_bone['bone_index']
-                next_bone['bone_index'] = tmp
-                # move in UI
-                bone0 = active_member.bones[list_bone_index]
-                bone1 = active_member.bones[list_bone_index+1]
-                active_member.bones.move(list_bone_index, list_bone_index + 1)
-                active_member.active_bone += 1
-                bone0.index += 1
-                bone1.index -= 1
-
-        mode = bpy.context.mode
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.object.mode_set(mode=mode)
+            j = i - 1
+        elif self.direction == 'DOWN':
+            j = i + 1
+        else:
+            return {'CANCELLED'}
+        if not 0 <= i < len(bones) or not 0 <= j < len(bones):
+            return {'CANCELLED'}
 
+        active_bone, other_bone = bones[i], bones[j]
+        try:
+            active_pbone = obj.pose.bones[active_bone.name]
+            other_pbone = obj.pose.bones[other_bone.name]
+        except KeyError:
+            self.report({'WARNING'}, 'Bones not found, reconstruct the member structure')
+            return {'CANCELLED'}
+
+        # move for real
+        active_bone_index = active_bone.index
+        active_bone.index = other_bone.index
+        other_bone.index = active_bone_index
+        active_pbone['bone_index'] = active_bone.index
+        other_pbone['bone_index'] = other_bone.index
+        # move in UI
+        bones.move(i, j)
+        active_member.active_bone = j
+
+        refresh_depth(context, obj)
         return {'FINISHED'}
 
 class PantinBones(bpy.types.PropertyGroup):
@@ -550,14 +555,12 @@ class PantinBones(bpy.types.PropertyGroup):
 bpy.utils.register_class(PantinBones)
 
 def member_index_update(self, context):
-    for m in self.id_data.pantin_members:
-        for bone in m.bones:
-            self.id_data.pose.bones[bone.name]['member_index'] = m.index
-
-    for b in self.id_data.pose.bones:
-        if not b.bone.use_deform:
-            continue
-
+    # Only this member's bones move
+    pose_bones = self.id_data.pose.bones
+    for bone in self.bones:
+        pbone = pose_bones.get(bone.name)
+        if pbone is not None:
+            pbone['member_index'] = self.index
 
 
 class PantinMembers(bpy.types.PropertyGroup):
@@ -653,6 +656,7 @@ class DATA_PT_members_panel(bpy.types.Panel):
                     col.separator()
             col = layout.column(align=True)
             col.operator("pose.rigify_fill_members" + rig_id)
+            col.operator("pose.rigify_order_members" + rig_id)
             col.operator("pose.rigify_sort_doubles" + rig_id)
             col.operator("pose.rigify_reapply_order_members" + rig_id)
 
@@ -807,6 +811,7 @@ def register():
     bpy.utils.register_class(Rigify_Fill_Members)
     bpy.utils.register_class(Rigify_Reapply_Members)
     bpy.utils.register_class(Rigify_Reorder_Members)
+    bpy.utils.register_class(Rigify_Order_Members)
     bpy.utils.register_class(Rigify_Sort_Doubles)
     bpy.utils.register_class(Rigify_Reorder_Bones)
     bpy.utils.register_class(PantinMembers)
@@ -829,6 +834,7 @@ def unregister():
     bpy.utils.unregister_class(Rigify_Reapply_Members)
     bpy.utils.unregister_class(Rigify_Sort_Doubles)
     bpy.utils.unregister_class(Rigify_Reorder_Members)
+    bpy.utils.unregister_class(Rigify_Order_Members)
     bpy.utils.unregister_class(Rigify_Reorder_Bones)
     bpy.utils.unregister_class(PANTIN_UL_bones_list)
     bpy.utils.unregister_class(DATA_PT_members_panel)
@@ -18,12 +18,14 @@
 
 # <pep8 compliant>
 
-UI_SLIDERS = '''
+import ast
+
+RUNTIME_NAME = "rigify_rig_runtime.py"
+
+RUNTIME = '''
 import bpy
 from mathutils import Matrix, Vector
-from math import acos, pi, radians
-
-rig_id = "%s"
+from math import acos, atan2, pi, radians
 
 
 ############################
@@ -59,6 +61,17 @@ def rotation_difference(mat1, mat2):
         angle = -angle + (2*pi)
     return angle
 
+def signed_angle(u, v, axis):
+    """ Returns the angle that rotates u onto v around axis, measured on
+        their components perpendicular to axis.  Returns None if either of
+        them is parallel to axis.
+    """
+    u = u - u.project(axis)
+    v = v - v.project(axis)
+    if u.length < 1e-6 * axis.length or v.length < 1e-6 * axis.length:
+        return None
+    return atan2(axis.normalized().dot(u.cross(v)), u.dot(v))
+
 def tail_distance(angle,bone_ik,bone_fk):
     """ Returns the distance between the tails of two bones
         after rotating bone_ik in AXIS_ANGLE mode.
@@ -226,9 +239,38 @@ def match_pose_scale(pose_bone, target_bone):
     bpy.ops.object.mode_set(mode='OBJECT')
     bpy.ops.object.mode_set(mode='POSE')
 
-def correct_rotation(bone_ik, bone_fk):
+SNAP_ITERATIONS = 3
+SNAP_PRECISION = 1e-3
+
+def rotate_pose_around(pose_bone, center, axis, angle):
+    """ Rotates pose_bone's own (pre-constraint) transform around an
+        armature space axis going through center.
+    """
+    rest = pose_bone.bone.matrix_local
+    if pose_bone.parent:
+        mat = pose_bone.parent.matrix * pose_bone.parent.bone.matrix_local.inverted() * rest * pose_bone.matrix_basis
+    else:
+        mat = rest * pose_bone.matrix_basis
+    mat = Matrix.Translation(center) * Matrix.Rotation(angle, 4, axis) * Matrix.Translation(-center) * mat
+    set_pose_rotation(pose_bone, get_pose_matrix_in_other_space(mat, pose_bone))
+
+def correct_rotation(bone_ik, bone_fk, end=None):
     """ Corrects the ik rotation in ik2fk snapping functions
+        end is the armature space point the ik chain reaches.  When given,
+        bone_ik is rotated straight around the chain's root-to-end line,
+        which the ik solution follows, and searched for only if that fails.
     """
+    if end is not None:
+        head = bone_ik.head.copy()
+        axis = end - head
+        for i in range(SNAP_ITERATIONS):
+            angle = signed_angle(bone_ik.tail - head, bone_fk.tail - head, axis)
+            if angle is None:
+                break
+            if abs(angle) < SNAP_PRECISION:
+                return
+            rotate_pose_around(bone_ik, head, axis, angle)
+            bpy.context.scene.update()
 
     alfarange = find_min_range(bone_ik,bone_fk)
     alfamin = ternarySearch(tail_distance,alfarange[0],alfarange[1],bone_ik,bone_fk,0.1)
@@ -260,9 +302,6 @@ def match_pole_target(ik_first, ik_last, pole, match_bone, length):
     # tip of ik_last
     ikv = b - a
 
-    # Get a vector perpendicular to ikv
-    pv = perpendicular_vector(ikv).normalized() * length
-
     def set_pole(pvi):
         """ Set pole target's position based on a vector
             from the arm center line.
@@ -274,8 +313,27 @@ def match_pole_target(ik_first, ik_last, pole, match_bone, length):
         mat = get_pose_matrix_in_other_space(Matrix.Translation(ploc), pole)
         set_pose_translation(pole, mat)
 
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.mode_set(mode='POSE')
+        bpy.context.scene.update()
+
+    # Put the pole in the bending plane of match_bone, then turn it by
+    # whatever the ik chain still misses (e.g. the ik constraint's pole angle)
+    pv = match_bone.tail - a
+    pv = pv - pv.project(ikv)
+    if pv.length > 1e-6 * ikv.length:
+        pv = pv.normalized() * length
+        for i in range(SNAP_ITERATIONS):
+            set_pole(pv)
+            angle = signed_angle(ik_first.tail - a, match_bone.tail - a, ikv)
+            if angle is None:
+                break
+            if abs(angle) < SNAP_PRECISION:
+                bpy.ops.object.mode_set(mode='OBJECT')
+                bpy.ops.object.mode_set(mode='POSE')
+                return
+            pv = Matrix.Rotation(angle, 4, ikv) * pv
+
+    # Get a vector perpendicular to ikv
+    pv = perpendicular_vector(ikv).normalized() * length
 
     set_pole(pv)
 
@@ -295,6 +353,9 @@ def match_pole_target(ik_first, ik_last, pole, match_bone, length):
     if ang1 < ang2:
         set_pole(pv1)
 
+    bpy.ops.object.mode_set(mode='OBJECT')
+    bpy.ops.object.mode_set(mode='POSE')
+
 
 def fk2ik_arm(obj, fk, ik):
     """ Matches the fk bones in an arm rig to the ik bones.
@@ -389,7 +450,7 @@ def ik2fk_arm(obj, fk, ik):
         match_pose_rotation(uarmi, uarm)
         match_pose_scale(uarmi, uarm)
         # Rotation Correction
-        correct_rotation(uarmi, uarm)
+        correct_rotation(uarmi, uarm, farm.tail)
 
 def fk2ik_leg(obj, fk, ik):
     """ Matches the fk bones in a leg rig to the ik bones.
@@ -496,7 +557,7 @@ def ik2fk_leg(obj, fk, ik):
         match_pose_scale(thighi, thigh)
 
         # Rotation Correction
-        correct_rotation(thighi,thigh)
+        correct_rotation(thighi, thigh, shin.tail)
 
     else:
         # Stretch
@@ -527,7 +588,7 @@ def ik2fk_leg(obj, fk, ik):
 class Rigify_Arm_FK2IK(bpy.types.Operator):
     """ Snaps an FK arm to an IK arm.
     """
-    bl_idname = "pose.rigify_arm_fk2ik_" + rig_id
+    bl_idname = "pose.rigify_arm_fk2ik"
     bl_label = "Rigify Snap FK arm to IK"
     bl_options = {'UNDO'}
 
@@ -556,7 +617,7 @@ class Rigify_Arm_FK2IK(bpy.types.Operator):
 class Rigify_Arm_IK2FK(bpy.types.Operator):
     """ Snaps an IK arm to an FK arm.
     """
-    bl_idname = "pose.rigify_arm_ik2fk_" + rig_id
+    bl_idname = "pose.rigify_arm_ik2fk"
     bl_label = "Rigify Snap IK arm to FK"
     bl_options = {'UNDO'}
 
@@ -588,7 +649,7 @@ class Rigify_Arm_IK2FK(bpy.types.Operator):
 class Rigify_Leg_FK2IK(bpy.types.Operator):
     """ Snaps an FK leg to an IK leg.
     """
-    bl_idname = "pose.rigify_leg_fk2ik_" + rig_id
+    bl_idname = "pose.rigify_leg_fk2ik"
     bl_label = "Rigify Snap FK leg to IK"
     bl_options = {'UNDO'}
 
@@ -619,7 +680,7 @@ class Rigify_Leg_FK2IK(bpy.types.Operator):
 class Rigify_Leg_IK2FK(bpy.types.Operator):
     """ Snaps an IK leg to an FK leg.
     """
-    bl_idname = "pose.rigify_leg_ik2fk_" + rig_id
+    bl_idname = "pose.rigify_leg_ik2fk"
     bl_label = "Rigify Snap IK leg to FK"
     bl_options = {'UNDO'}
 
@@ -654,62 +715,227 @@ class Rigify_Leg_IK2FK(bpy.types.Operator):
 ## Rig UI Panels ##
 ###################
 
+# rig_id: (draw function of the main properties, draw function of the layers)
+rig_draws = {}
+
+
+def register_rig(rig_id, draw_ui, draw_layers):
+    """ Called by the UI script of a rig, so the panels draw its UI when it
+        is the active object.
+    """
+    rig_draws[rig_id] = (draw_ui, draw_layers)
+
+
+def unregister_rig(rig_id):
+    rig_draws.pop(rig_id, None)
+
+
+def active_rig_draws(context):
+    try:
+        return rig_draws.get(context.active_object.data.get("rig_id"))
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+
 class RigUI(bpy.types.Panel):
     bl_space_type = 'VIEW_3D'
     bl_region_type = 'UI'
     bl_label = "Rig Main Properties"
-    bl_idname = rig_id + "_PT_rig_ui"
+    bl_idname = "VIEW3D_PT_rigify_rig_ui"
 
     @classmethod
     def poll(self, context):
-        if context.mode != 'POSE':
-            return False
-        try:
-            return (context.active_object.data.get("rig_id") == rig_id)
-        except (AttributeError, KeyError, TypeError):
-            return False
+        return context.mode == 'POSE' and active_rig_draws(context) is not None
+
+    def draw(self, context):
+        active_rig_draws(context)[0](self, context)
+
+
+class RigLayers(bpy.types.Panel):
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_label = "Rig Layers"
+    bl_idname = "VIEW3D_PT_rigify_rig_layers"
+
+    @classmethod
+    def poll(self, context):
+        return active_rig_draws(context) is not None
+
+    def draw(self, context):
+        active_rig_draws(context)[1](self, context)
+
+
+classes = (
+    Rigify_Arm_FK2IK,
+    Rigify_Arm_IK2FK,
+    Rigify_Leg_FK2IK,
+    Rigify_Leg_IK2FK,
+    RigUI,
+    RigLayers,
+)
 
+
+def register():
+    for cls in classes:
+        bpy.utils.register_class(cls)
+
+
+def unregister():
+    for cls in classes:
+        bpy.utils.unregister_class(cls)
+
+
+register()
+'''
+
+
+UI_SLIDERS = '''
+import bpy
+import rigify_rig_runtime as runtime
+
+rig_id = "%s"
+
+
+class RigUI:
+    """ Drawn by the shared RigUI panel when this rig is active.
+    """
     def draw(self, context):
         layout = self.layout
         pose_bones = context.active_object.pose.bones
         try:
-            selected_bones = [bone.name for bone in context.selected_pose_bones]
-            selected_bones += [context.active_pose_bone.name]
+            selected_bones = {bone.name for bone in context.selected_pose_bones}
+            selected_bones.add(context.active_pose_bone.name)
         except (AttributeError, TypeError):
             return
 
         def is_selected(names):
             # Returns whether any of the named bones are selected.
             if type(names) == list:
-                for name in names:
-                    if name in selected_bones:
-                        return True
-            elif names in selected_bones:
-                return True
-            return False
+                return not selected_bones.isdisjoint(names)
+            return names in selected_bones
 
+        # Only the sections of the selected controls need to be drawn
+        sections = set(UI_ALWAYS)
+        for name in selected_bones:
+            sections.update(UI_INDEX.get(name, ()))
+        for i in sorted(sections):
+            UI_SECTIONS[i](self, context, layout, pose_bones, selected_bones, is_selected)
 
 '''
 
 
+#=============================================
+# UI sections
+#=============================================
+
+def _strings(node):
+    for n in ast.walk(node):
+        if type(n).__name__ == 'Str':
+            yield n.s
+        elif type(n).__name__ == 'Constant' and isinstance(n.value, str):
+            yield n.value
+
+
+def _is_literal(node, names):
+    """ Returns whether an expression only combines literals and the
+        given variable names, e.g. "ik_arm + fk_arm" or "controls[1]".
+    """
+    if isinstance(node, ast.Name):
+        return node.id in names
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return all(_is_literal(n, names) for n in node.elts)
+    if isinstance(node, ast.BinOp):
+        return _is_literal(node.left, names) and _is_literal(node.right, names)
+    if isinstance(node, ast.Subscript):
+        return _is_literal(node.value, names)
+    try:
+        ast.literal_eval(node)
+    except ValueError:
+        return False
+    return True
+
+
+def _is_gated(stmts, names):
+    """ Returns whether statements only draw something when one of the
+        bones they name is selected: they assign literals to variables, and
+        draw inside "if is_selected(...)" blocks (or loops over literals)
+        only.  names collects the variables holding literals.
+    """
+    for stmt in stmts:
+        if isinstance(stmt, ast.Pass):
+            continue
+        elif isinstance(stmt, ast.Assign):
+            if not _is_literal(stmt.value, names) or not all(isinstance(n, ast.Name) for n in stmt.targets):
+                return False
+            names.update(n.id for n in stmt.targets)
+        elif isinstance(stmt, ast.For):
+            if not isinstance(stmt.target, ast.Name) or not _is_literal(stmt.iter, names):
+                return False
+            names.add(stmt.target.id)
+            if not _is_gated(stmt.body, names) or not _is_gated(stmt.orelse, names):
+                return False
+        elif isinstance(stmt, ast.If):
+            calls = [n for n in ast.walk(stmt.test)
+                     if isinstance(n, ast.Call) and isinstance(n.func, ast.Name) and n.func.id == 'is_selected']
+            if not calls or not all(_is_literal(arg, names) for call in calls for arg in call.args):
+                return False
+            if not _is_gated(stmt.orelse, names):
+                return False
+        else:
+            return False
+    return True
+
+
+def section_bones(code, bones):
+    """ Returns the bones whose selection shows a rig's UI code, or None
+        if it can't tell and the code has to run on every redraw.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    if not _is_gated(tree.body, set()):
+        return None
+    return set(_strings(tree)) & bones
+
+
+def ui_sections(scripts, bones):
+    """ Turns the UI code returned by the rigs into one function each, plus
+        an index from bone name to the sections that bone's selection may
+        show, so RigUI only runs the code of the selected controls.
+    """
+    bones = set(bones)
+    code = ""
+    always = []
+    index = {}
+    for i, s in enumerate(scripts):
+        code += "\n\ndef ui_section_%d(self, context, layout, pose_bones, selected_bones, is_selected):\n" % i
+        code += "    pass\n    " + s.replace("\n", "\n    ") + "\n"
+
+        names = section_bones(s, bones)
+        if names is None:
+            always.append(i)
+        else:
+            for name in names:
+                index.setdefault(name, []).append(i)
+
+    code += "\n\nUI_SECTIONS = [%s]\n" % ", ".join("ui_section_%d" % i for i in range(len(scripts)))
+    code += "UI_ALWAYS = %r\n" % (tuple(always),)
+    code += "UI_INDEX = {\n"
+    for name in sorted(index):
+        code += "    %r: %r,\n" % (name, tuple(index[name]))
+    code += "}\n"
+    return code
+
+
 def layers_ui(layers, layout):
     """ Turn a list of booleans + a list of names into a layer UI.
     """
 
     code = '''
-class RigLayers(bpy.types.Panel):
-    bl_space_type = 'VIEW_3D'
-    bl_region_type = 'UI'
-    bl_label = "Rig Layers"
-    bl_idname = rig_id + "_PT_rig_layers"
-
-    @classmethod
-    def poll(self, context):
-        try:
-            return (context.active_object.data.get("rig_id") == rig_id)
-        except (AttributeError, KeyError, TypeError):
-            return False
-
+class RigLayers:
+    """ Drawn by the shared RigLayers panel when this rig is active.
+    """
     def draw(self, context):
         layout = self.layout
         col = layout.column()
@@ -747,21 +973,5 @@ class RigLayers(bpy.types.Panel):
 
 UI_REGISTER = '''
 
-def register():
-    bpy.utils.register_class(Rigify_Arm_FK2IK)
-    bpy.utils.register_class(Rigify_Arm_IK2FK)
-    bpy.utils.register_class(Rigify_Leg_FK2IK)
-    bpy.utils.register_class(Rigify_Leg_IK2FK)
-    bpy.utils.register_class(RigUI)
-    bpy.utils.register_class(RigLayers)
-
-def unregister():
-    bpy.utils.unregister_class(Rigify_Arm_FK2IK)
-    bpy.utils.unregister_class(Rigify_Arm_IK2FK)
-    bpy.utils.unregister_class(Rigify_Leg_FK2IK)
-    bpy.utils.unregister_class(Rigify_Leg_IK2FK)
-    bpy.utils.unregister_class(RigUI)
-    bpy.utils.unregister_class(RigLayers)
-
-register()
+runtime.register_rig(rig_id, RigUI.draw, RigLayers.draw)
 '''
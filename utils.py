@@ -19,6 +19,7 @@
 # <pep8 compliant>
 
 import bpy
+import hashlib
 import importlib
 import importlib
 import math
@@ -26,9 +27,12 @@ import random
 import time
 import re
 import os
+import sys
 from mathutils import Vector, Matrix, Color
 from rna_prop_ui import rna_idprop_ui_prop_get
 
+from .profiler import profiled, measure
+
 RIG_DIR = "rigs"  # Name of the directory where rig types are kept
 METARIG_DIR = "metarigs"  # Name of the directory where metarigs are kept
 TEMPLATE_DIR = "ui_templates"  # Name of the directory where ui templates are kept
@@ -40,6 +44,7 @@ WGT_PREFIX = "WGT-"  # Prefix for widget objects
 ROOT_NAME = "root"   # Name of the root bone.
 
 WGT_LAYERS = [x == 19 for x in range(0, 20)]  # Widgets go on the last scene layer.
+WGT_SHAPE_PROP = "rigify_widget_shape"  # Mesh property holding the key of a shared widget shape
 
 MODULE_NAME = "rigify"  # Windows/Mac blender is weird, so __package__ doesn't work
 
@@ -192,10 +197,89 @@ def upgradeMetarigTypes(metarig, revert=False):
 
 
 
+#=======================
+# Mode switching
+#=======================
+
+_edit_session = None  # The EditSession currently batching bone creation, if any
+
+
+def set_mode(mode):
+    """ Switches the active object to the given mode, skipping the
+        operator entirely when the object is already in it.  Only actual
+        switches are profiled as 'mode'.
+        Leaving edit mode inside an EditSession runs the pose-bone work
+        that was deferred while the edit bones were being created.
+    """
+    obj = bpy.context.active_object
+    if obj is None or obj.mode != mode:
+        with measure('mode'):
+            bpy.ops.object.mode_set(mode=mode)
+
+    if mode != 'EDIT' and _edit_session is not None:
+        _edit_session.flush()
+
+
+class EditSession:
+    """ Keeps an armature in edit mode for a whole block of bone creation.
+
+        Helpers like copy_bone() and make_nonscaling_child() normally have
+        to leave edit mode to reach the pose bones they just created.
+        Inside a session that work is queued instead, and runs once the
+        next time edit mode is left through set_mode() or when the
+        session ends, so a rig pays for one edit pass instead of one per
+        bone.
+
+        A nested session shares the queue of the session around it, so
+        deferred work always runs in the order it was queued, whichever
+        session leaves edit mode first.
+    """
+    def __init__(self, obj):
+        self.obj = obj
+        self.pose_queue = []
+        self.outer = None
+
+    def __enter__(self):
+        global _edit_session
+        self.outer = _edit_session
+        if self.outer is not None:
+            self.pose_queue = self.outer.pose_queue
+        _edit_session = self
+        set_mode('EDIT')
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _edit_session
+        try:
+            set_mode('OBJECT')
+        finally:
+            _edit_session = self.outer
+        return False
+
+    def defer(self, func, *args):
+        """ Queues func(*args) to run once pose bones are available.
+        """
+        self.pose_queue.append((func, args))
+
+    def flush(self):
+        # Emptied in place, the list may be shared with nested sessions
+        queue = self.pose_queue[:]
+        del self.pose_queue[:]
+        for func, args in queue:
+            func(*args)
+
+
+def get_edit_session():
+    """ Returns the active EditSession, or None.
+    """
+    return _edit_session
+
+
 #=======================
 # Bone manipulation
 #=======================
 
+@profiled('bone')
 def new_bone(obj, bone_name):
     """ Adds a new bone to the given armature object.
         Returns the resulting bone's name.
@@ -206,13 +290,15 @@ def new_bone(obj, bone_name):
         edit_bone.head = (0, 0, 0)
         edit_bone.tail = (0, 1, 0)
         edit_bone.roll = 0
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.mode_set(mode='EDIT')
+        if _edit_session is None:
+            bpy.ops.object.mode_set(mode='OBJECT')
+            bpy.ops.object.mode_set(mode='EDIT')
         return name
     else:
         raise MetarigError("Can't add new bone '%s' outside of edit mode" % bone_name)
 
 
+@profiled('bone')
 def copy_bone_simple(obj, bone_name, assign_name=''):
     """ Makes a copy of the given bone in the given armature object.
         but only copies head, tail positions and roll. Does not
@@ -243,6 +329,7 @@ def copy_bone_simple(obj, bone_name, assign_name=''):
         raise MetarigError("Cannot copy bones outside of edit mode")
 
 
+@profiled('bone')
 def copy_bone(obj, bone_name, assign_name=''):
     """ Makes a copy of the given bone in the given armature object.
         Returns the resulting bone's name.
@@ -279,46 +366,54 @@ def copy_bone(obj, bone_name, assign_name=''):
         edit_bone_2.bbone_in = edit_bone_1.bbone_in
         edit_bone_2.bbone_out = edit_bone_1.bbone_out
 
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-        # Get the pose bones
-        pose_bone_1 = obj.pose.bones[bone_name_1]
-        pose_bone_2 = obj.pose.bones[bone_name_2]
-
-        # Copy pose bone attributes
-        pose_bone_2.rotation_mode = pose_bone_1.rotation_mode
-        pose_bone_2.rotation_axis_angle = tuple(pose_bone_1.rotation_axis_angle)
-        pose_bone_2.rotation_euler = tuple(pose_bone_1.rotation_euler)
-        pose_bone_2.rotation_quaternion = tuple(pose_bone_1.rotation_quaternion)
-
-        pose_bone_2.lock_location = tuple(pose_bone_1.lock_location)
-        pose_bone_2.lock_scale = tuple(pose_bone_1.lock_scale)
-        pose_bone_2.lock_rotation = tuple(pose_bone_1.lock_rotation)
-        pose_bone_2.lock_rotation_w = pose_bone_1.lock_rotation_w
-        pose_bone_2.lock_rotations_4d = pose_bone_1.lock_rotations_4d
-
-        # Copy custom properties
-        for key in pose_bone_1.keys():
-            if key != "_RNA_UI" \
-            and key != "rigify_parameters" \
-            and key != "rigify_type":
-                prop1 = rna_idprop_ui_prop_get(pose_bone_1, key, create=False)
-                prop2 = rna_idprop_ui_prop_get(pose_bone_2, key, create=True)
-                pose_bone_2[key] = pose_bone_1[key]
-                for key in prop1.keys():
-                    prop2[key] = prop1[key]
-
-        bpy.ops.object.mode_set(mode='EDIT')
+        if _edit_session is not None:
+            _edit_session.defer(copy_pose_bone, obj, bone_name_1, bone_name_2)
+        else:
+            bpy.ops.object.mode_set(mode='OBJECT')
+            copy_pose_bone(obj, bone_name_1, bone_name_2)
+            bpy.ops.object.mode_set(mode='EDIT')
 
         return bone_name_2
     else:
         raise MetarigError("Cannot copy bones outside of edit mode")
 
 
+def copy_pose_bone(obj, bone_name_1, bone_name_2):
+    """ Copies pose bone attributes and custom properties from one bone
+        to another.  Must be called outside of edit mode.
+    """
+    # Get the pose bones
+    pose_bone_1 = obj.pose.bones[bone_name_1]
+    pose_bone_2 = obj.pose.bones[bone_name_2]
+
+    # Copy pose bone attributes
+    pose_bone_2.rotation_mode = pose_bone_1.rotation_mode
+    pose_bone_2.rotation_axis_angle = tuple(pose_bone_1.rotation_axis_angle)
+    pose_bone_2.rotation_euler = tuple(pose_bone_1.rotation_euler)
+    pose_bone_2.rotation_quaternion = tuple(pose_bone_1.rotation_quaternion)
+
+    pose_bone_2.lock_location = tuple(pose_bone_1.lock_location)
+    pose_bone_2.lock_scale = tuple(pose_bone_1.lock_scale)
+    pose_bone_2.lock_rotation = tuple(pose_bone_1.lock_rotation)
+    pose_bone_2.lock_rotation_w = pose_bone_1.lock_rotation_w
+    pose_bone_2.lock_rotations_4d = pose_bone_1.lock_rotations_4d
+
+    # Copy custom properties
+    for key in pose_bone_1.keys():
+        if key != "_RNA_UI" \
+        and key != "rigify_parameters" \
+        and key != "rigify_type":
+            prop1 = rna_idprop_ui_prop_get(pose_bone_1, key, create=False)
+            prop2 = rna_idprop_ui_prop_get(pose_bone_2, key, create=True)
+            pose_bone_2[key] = pose_bone_1[key]
+            for key in prop1.keys():
+                prop2[key] = prop1[key]
+
+
 def flip_bone(obj, bone_name):
     """ Flips an edit bone.
     """
-    if bone_name not in obj.data.bones:
+    if bone_name not in obj.data.edit_bones:
         raise MetarigError("flip_bone(): bone '%s' not found, cannot copy it" % bone_name)
 
     if obj == bpy.context.active_object and bpy.context.mode == 'EDIT_ARMATURE':
@@ -335,7 +430,7 @@ def flip_bone(obj, bone_name):
 def put_bone(obj, bone_name, pos):
     """ Places a bone at the given position.
     """
-    if bone_name not in obj.data.bones:
+    if bone_name not in obj.data.edit_bones:
         raise MetarigError("put_bone(): bone '%s' not found, cannot move it" % bone_name)
 
     if obj == bpy.context.active_object and bpy.context.mode == 'EDIT_ARMATURE':
@@ -356,7 +451,7 @@ def make_nonscaling_child(obj, bone_name, location, child_name_postfix=""):
         from scaling with their parents.  The named bone is assumed to be
         an ORG bone.
     """
-    if bone_name not in obj.data.bones:
+    if bone_name not in obj.data.edit_bones:
         raise MetarigError("make_nonscaling_child(): bone '%s' not found, cannot copy it" % bone_name)
 
     if obj == bpy.context.active_object and bpy.context.mode == 'EDIT_ARMATURE':
@@ -387,28 +482,33 @@ def make_nonscaling_child(obj, bone_name, location, child_name_postfix=""):
         put_bone(obj, child, location)
         put_bone(obj, intermediate_parent, location)
 
-        # Object mode
-        bpy.ops.object.mode_set(mode='OBJECT')
-        pb = obj.pose.bones
-
         # Add constraints
-        con = pb[child].constraints.new('COPY_LOCATION')
-        con.name = "parent_loc"
-        con.target = obj
-        con.subtarget = intermediate_parent
-
-        con = pb[child].constraints.new('COPY_ROTATION')
-        con.name = "parent_loc"
-        con.target = obj
-        con.subtarget = intermediate_parent
-
-        bpy.ops.object.mode_set(mode='EDIT')
+        if _edit_session is not None:
+            _edit_session.defer(_nonscaling_child_constraints, obj, child, intermediate_parent)
+        else:
+            bpy.ops.object.mode_set(mode='OBJECT')
+            _nonscaling_child_constraints(obj, child, intermediate_parent)
+            bpy.ops.object.mode_set(mode='EDIT')
 
         return child
     else:
         raise MetarigError("Cannot make nonscaling child outside of edit mode")
 
 
+def _nonscaling_child_constraints(obj, child, intermediate_parent):
+    pb = obj.pose.bones
+
+    con = pb[child].constraints.new('COPY_LOCATION')
+    con.name = "parent_loc"
+    con.target = obj
+    con.subtarget = intermediate_parent
+
+    con = pb[child].constraints.new('COPY_ROTATION')
+    con.name = "parent_loc"
+    con.target = obj
+    con.subtarget = intermediate_parent
+
+
 #=============================================
 # Widget creation
 #=============================================
@@ -468,8 +568,79 @@ def create_circle_polygon(number_verts, axis, radius=1.0, head_tail=0.0):
     return verts, edges
 
 
-def create_widget(rig, bone_name, bone_transform_name=None):
+def widget_shape_key(rig, shape):
+    """ Returns the string key of a widget shape of a rig, given as a tuple
+        of the shape name and its parameters.  Meshes are only shared within
+        one rig, so editing a widget or forcing a widget update can't change
+        the widgets of other rigs.
+    """
+    shape = tuple(round(v, 5) if isinstance(v, float) else v for v in shape)
+    return repr(('WGTS_' + rig.name,) + shape)
+
+
+_widget_meshes = None  # Shared widget mesh names by shape key, see index_widget_meshes()
+
+
+def index_widget_meshes():
+    """ Indexes the shared widget meshes of the file by shape key.
+    """
+    global _widget_meshes
+    _widget_meshes = {}
+    for m in bpy.data.meshes:
+        if WGT_SHAPE_PROP in m:
+            _widget_meshes[m[WGT_SHAPE_PROP]] = m.name
+
+
+def find_widget_mesh(key):
+    """ Returns the shared widget mesh with the given shape key, or None.
+        Meshes are looked up in the index built by clear_widget_registry(),
+        and kept current by set_widget_shape().
+    """
+    if _widget_meshes is None:
+        index_widget_meshes()
+    mesh = bpy.data.meshes.get(_widget_meshes.get(key, ''))
+    if mesh is None or mesh.get(WGT_SHAPE_PROP) != key:
+        return None
+    return mesh
+
+
+def set_widget_shape(mesh, key, rig, name):
+    mesh.name = WGT_PREFIX + rig.name + '_' + name
+    mesh[WGT_SHAPE_PROP] = key
+    if _widget_meshes is None:
+        index_widget_meshes()
+    _widget_meshes[key] = mesh.name
+
+
+_widget_objects = {}  # Widget objects made or updated by create_widget(), by name
+
+
+def clear_widget_registry():
+    """ Starts a new generation: forgets the widget objects of the last
+        one, and indexes the shared widget meshes once.
+    """
+    _widget_objects.clear()
+    index_widget_meshes()
+
+
+def get_widget_object(name):
+    """ Returns the widget object create_widget() made or updated under
+        name since the last clear_widget_registry(), or None.
+    """
+    return _widget_objects.get(name)
+
+
+@profiled('widget')
+def create_widget(rig, bone_name, bone_transform_name=None, shape=None, subsurf=0):
     """ Creates an empty widget object for a bone, and returns the object.
+        shape is a tuple of the widget's shape name and parameters.  Widgets
+        with the same shape share one mesh: if that mesh already exists, the
+        new widget object uses it and None is returned, as if the widget
+        already existed.
+
+        subsurf is the level of a subdivision surface modifier for the
+        widget object.  It is added to every new object, shared mesh or
+        not, so callers don't need the object for it.
     """
     if bone_transform_name is None:
         bone_transform_name = bone_name
@@ -483,6 +654,7 @@ def create_widget(rig, bone_name, bone_transform_name=None):
         # Move object to bone position, in case it changed
         obj = scene.objects[obj_name]
         obj_to_bone(obj, rig, bone_transform_name)
+        _widget_objects[obj.name] = obj
 
         return None
     else:
@@ -493,10 +665,17 @@ def create_widget(rig, bone_name, bone_transform_name=None):
             bpy.data.objects[obj_name].user_clear()
             bpy.data.objects.remove(bpy.data.objects[obj_name])
 
-        # Create mesh object
-        mesh = bpy.data.meshes.new(obj_name)
+        # Create mesh object, sharing the mesh of the same shape
+        key = widget_shape_key(rig, shape) if shape is not None else None
+        mesh = find_widget_mesh(key) if key else None
+        shared = mesh is not None
+        if not shared:
+            mesh = bpy.data.meshes.new(obj_name)
+            if key:
+                set_widget_shape(mesh, key, rig, shape[0])
         obj = bpy.data.objects.new(obj_name, mesh)
         scene.objects.link(obj)
+        _widget_objects[obj.name] = obj
 
         # Move object to bone position and set layers
         obj_to_bone(obj, rig, bone_transform_name)
@@ -505,27 +684,60 @@ def create_widget(rig, bone_name, bone_transform_name=None):
             obj.parent = bpy.data.objects[wgts_group_name]
         obj.layers = WGT_LAYERS
 
-        return obj
+        if subsurf:
+            mod = obj.modifiers.new("subsurf", 'SUBSURF')
+            mod.levels = subsurf
+
+        return None if shared else obj
+
+
+def share_widget_meshes(rig, objects):
+    """ Makes widget objects of a rig with identical geometry share one
+        mesh, for widgets built without a shape key.  Unused duplicates are
+        removed.
+    """
+    for obj in objects:
+        mesh = obj.data
+        if mesh is None or WGT_SHAPE_PROP in mesh:
+            continue
+
+        co = [0.0] * (len(mesh.vertices) * 3)
+        mesh.vertices.foreach_get('co', co)
+        edges = [0] * (len(mesh.edges) * 2)
+        mesh.edges.foreach_get('vertices', edges)
+        polygons = [tuple(p.vertices) for p in mesh.polygons]
+        geometry = repr(([round(v, 5) for v in co], edges, polygons))
+        key = widget_shape_key(rig, ('geometry', hashlib.sha1(geometry.encode('utf-8')).hexdigest()))
+
+        shared = find_widget_mesh(key)
+        if shared is None:
+            set_widget_shape(mesh, key, rig, 'mesh')
+        elif shared != mesh:
+            obj.data = shared
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
 
 
 # Common Widgets
 
+@profiled('widget')
 def create_line_widget(rig, bone_name, bone_transform_name=None):
     """ Creates a basic line widget, a line that spans the length of the bone.
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('line',))
     if obj is not None:
         mesh = obj.data
         mesh.from_pydata([(0, 0, 0), (0, 1, 0)], [(0, 1)], [])
         mesh.update()
 
 
+@profiled('widget')
 def create_circle_widget(rig, bone_name, radius=1.0, head_tail=0.0, with_line=False, bone_transform_name=None):
     """ Creates a basic circle widget, a circle around the y-axis.
         radius: the radius of the circle
         head_tail: where along the length of the bone the circle is (0.0=head, 1.0=tail)
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('circle', radius, head_tail, with_line))
     if obj is not None:
         verts, edges = create_circle_polygon(32, 'Y', radius, head_tail)
 
@@ -540,10 +752,11 @@ def create_circle_widget(rig, bone_name, radius=1.0, head_tail=0.0, with_line=Fa
         return None
 
 
+@profiled('widget')
 def create_cube_widget(rig, bone_name, radius=0.5, bone_transform_name=None):
     """ Creates a basic cube widget.
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('cube', radius))
     if obj is not None:
         r = radius
         verts = [(r, r, r), (r, -r, r), (-r, -r, r), (-r, r, r), (r, r, -r), (r, -r, -r), (-r, -r, -r), (-r, r, -r)]
@@ -553,10 +766,11 @@ def create_cube_widget(rig, bone_name, radius=0.5, bone_transform_name=None):
         mesh.update()
 
 
+@profiled('widget')
 def create_chain_widget(rig, bone_name, radius=0.5, invert=False, bone_transform_name=None):
     """Creates a basic chain widget
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('chain', radius, invert))
     if obj != None:
         r = radius
         rh = radius/2
@@ -570,10 +784,11 @@ def create_chain_widget(rig, bone_name, radius=0.5, invert=False, bone_transform
         mesh.update()
 
 
+@profiled('widget')
 def create_sphere_widget(rig, bone_name, bone_transform_name=None):
     """ Creates a basic sphere widget, three pependicular overlapping circles.
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('sphere',))
     if obj is not None:
         verts_x, edges_x = create_circle_polygon(16, 'X', 0.5)
         verts_y, edges_y = create_circle_polygon(16, 'Y', 0.5)
@@ -594,11 +809,12 @@ def create_sphere_widget(rig, bone_name, bone_transform_name=None):
         mesh.update()
 
 
+@profiled('widget')
 def create_limb_widget(rig, bone_name, bone_transform_name=None):
     """ Creates a basic limb widget, a line that spans the length of the
         bone, with a circle around the center.
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('limb',))
     if obj is not None:
         verts, edges = create_circle_polygon(32, "Y", 0.25, 0.5)
         verts.append((0, 0, 0))
@@ -609,10 +825,11 @@ def create_limb_widget(rig, bone_name, bone_transform_name=None):
         mesh.update()
 
 
+@profiled('widget')
 def create_bone_widget(rig, bone_name, bone_transform_name=None):
     """ Creates a basic bone widget, a simple obolisk-esk shape.
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('bone',))
     if obj is not None:
         verts = [(0.04, 1.0, -0.04), (0.1, 0.0, -0.1), (-0.1, 0.0, -0.1), (-0.04, 1.0, -0.04), (0.04, 1.0, 0.04), (0.1, 0.0, 0.1), (-0.1, 0.0, 0.1), (-0.04, 1.0, 0.04)]
         edges = [(1, 2), (0, 1), (0, 3), (2, 3), (4, 5), (5, 6), (6, 7), (4, 7), (1, 5), (0, 4), (2, 6), (3, 7)]
@@ -621,10 +838,11 @@ def create_bone_widget(rig, bone_name, bone_transform_name=None):
         mesh.update()
 
 
+@profiled('widget')
 def create_compass_widget(rig, bone_name, bone_transform_name=None):
     """ Creates a compass-shaped widget.
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('compass',))
     if obj is not None:
         verts, edges = create_circle_polygon(32, "Z", 1.0, 0.0)
         i = 0
@@ -638,10 +856,11 @@ def create_compass_widget(rig, bone_name, bone_transform_name=None):
         mesh.update()
 
 
+@profiled('widget')
 def create_root_widget(rig, bone_name, bone_transform_name=None):
     """ Creates a widget for the root bone.
     """
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('root',))
     if obj is not None:
         verts = [(0.7071067690849304, 0.7071067690849304, 0.0), (0.7071067690849304, -0.7071067690849304, 0.0), (-0.7071067690849304, 0.7071067690849304, 0.0), (-0.7071067690849304, -0.7071067690849304, 0.0), (0.8314696550369263, 0.5555701851844788, 0.0), (0.8314696550369263, -0.5555701851844788, 0.0), (-0.8314696550369263, 0.5555701851844788, 0.0), (-0.8314696550369263, -0.5555701851844788, 0.0), (0.9238795042037964, 0.3826834261417389, 0.0), (0.9238795042037964, -0.3826834261417389, 0.0), (-0.9238795042037964, 0.3826834261417389, 0.0), (-0.9238795042037964, -0.3826834261417389, 0.0), (0.9807852506637573, 0.19509035348892212, 0.0), (0.9807852506637573, -0.19509035348892212, 0.0), (-0.9807852506637573, 0.19509035348892212, 0.0), (-0.9807852506637573, -0.19509035348892212, 0.0), (0.19509197771549225, 0.9807849526405334, 0.0), (0.19509197771549225, -0.9807849526405334, 0.0), (-0.19509197771549225, 0.9807849526405334, 0.0), (-0.19509197771549225, -0.9807849526405334, 0.0), (0.3826850652694702, 0.9238788485527039, 0.0), (0.3826850652694702, -0.9238788485527039, 0.0), (-0.3826850652694702, 0.9238788485527039, 0.0), (-0.3826850652694702, -0.9238788485527039, 0.0), (0.5555717945098877, 0.8314685821533203, 0.0), (0.5555717945098877, -0.8314685821533203, 0.0), (-0.5555717945098877, 0.8314685821533203, 0.0), (-0.5555717945098877, -0.8314685821533203, 0.0), (0.19509197771549225, 1.2807848453521729, 0.0), (0.19509197771549225, -1.2807848453521729, 0.0), (-0.19509197771549225, 1.2807848453521729, 0.0), (-0.19509197771549225, -1.2807848453521729, 0.0), (1.280785322189331, 0.19509035348892212, 0.0), (1.280785322189331, -0.19509035348892212, 0.0), (-1.280785322189331, 0.19509035348892212, 0.0), (-1.280785322189331, -0.19509035348892212, 0.0), (0.3950919806957245, 1.2807848453521729, 0.0), (0.3950919806957245, -1.2807848453521729, 0.0), (-0.3950919806957245, 1.2807848453521729, 0.0), (-0.3950919806957245, -1.2807848453521729, 0.0), (1.280785322189331, 0.39509034156799316, 0.0), (1.280785322189331, -0.39509034156799316, 0.0), (-1.280785322189331, 0.39509034156799316, 0.0), (-1.280785322189331, -0.39509034156799316, 0.0), (0.0, 1.5807849168777466, 0.0), (0.0, -1.5807849168777466, 0.0), (1.5807852745056152, 0.0, 0.0), (-1.5807852745056152, 0.0, 0.0)]
         edges = [(0, 4), (1, 5), (2, 6), (3, 7), (4, 8), (5, 9), (6, 10), (7, 11), (8, 12), (9, 13), (10, 14), (11, 15), (16, 20), (17, 21), (18, 22), (19, 23), (20, 24), (21, 25), (22, 26), (23, 27), (0, 24), (1, 25), (2, 26), (3, 27), (16, 28), (17, 29), (18, 30), (19, 31), (12, 32), (13, 33), (14, 34), (15, 35), (28, 36), (29, 37), (30, 38), (31, 39), (32, 40), (33, 41), (34, 42), (35, 43), (36, 44), (37, 45), (38, 44), (39, 45), (40, 46), (41, 46), (42, 47), (43, 47)]
@@ -650,8 +869,9 @@ def create_root_widget(rig, bone_name, bone_transform_name=None):
         mesh.update()
 
 
+@profiled('widget')
 def create_neck_bend_widget(rig, bone_name, radius=1.0, head_tail=0.0, bone_transform_name=None):
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('neck_bend', radius, head_tail))
     size = 2.0
     if obj != None:
         v = [(-0.08855080604553223 * size, 0.7388765811920166 * size, -0.3940150737762451 * size),
@@ -719,8 +939,9 @@ def create_neck_bend_widget(rig, bone_name, radius=1.0, head_tail=0.0, bone_tran
         mesh.update()
 
 
+@profiled('widget')
 def create_neck_tweak_widget(rig, bone_name, size=1.0, bone_transform_name=None):
-    obj = create_widget(rig, bone_name, bone_transform_name)
+    obj = create_widget(rig, bone_name, bone_transform_name, shape=('neck_tweak', size))
 
     if obj != None:
         verts = [(0.3535533845424652 * size, 0.3535533845424652 * size, 0.0 * size),
@@ -943,47 +1164,130 @@ def align_bone_y_axis(obj, bone, vec):
 # Misc
 #=============================================
 
+_rna_properties = {}  # {RNA struct identifier: names of its writable properties}
+
+
+def rna_writable_properties(data):
+    """ Returns the names of the writable properties of an RNA struct, read
+        once per struct type from bl_rna.properties.
+    """
+    rna = data.bl_rna
+    names = _rna_properties.get(rna.identifier)
+    if names is None:
+        names = [prop.identifier for prop in rna.properties
+                 if not prop.is_readonly
+                 and prop.type != 'COLLECTION'
+                 and not prop.identifier.startswith("error_")
+                 and prop.identifier not in ("rna_type", "group", "is_valid")]
+        _rna_properties[rna.identifier] = names
+    return names
+
+
 def copy_attributes(a, b):
-    keys = dir(a)
-    for key in keys:
-        if not key.startswith("_") \
-        and not key.startswith("error_") \
-        and key != "group" \
-        and key != "is_valid" \
-        and key != "rna_type" \
-        and key != "bl_rna":
-            try:
-                setattr(b, key, getattr(a, key))
-            except AttributeError:
-                pass
+    for key in rna_writable_properties(a):
+        try:
+            setattr(b, key, getattr(a, key))
+        except AttributeError:
+            pass
+
+
+KEYFRAME_ARRAYS = (("co", 2), ("handle_left", 2), ("handle_right", 2),
+                   ("amplitude", 1), ("back", 1), ("period", 1))
+KEYFRAME_ENUMS = ("interpolation", "handle_left_type", "handle_right_type", "easing", "type")
+
+
+def copy_keyframe_points(a, b):
+    """ Replaces the keyframe points of fcurve b with those of fcurve a,
+        adding them all at once and transferring their values as flat
+        arrays.
+    """
+    src = a.keyframe_points
+    dst = b.keyframe_points
+    for point in reversed(list(dst)):
+        dst.remove(point, fast=True)
+    count = len(src)
+    dst.add(count)
+
+    for prop, size in KEYFRAME_ARRAYS:
+        values = [0.0] * (count * size)
+        src.foreach_get(prop, values)
+        dst.foreach_set(prop, values)
+
+    for prop in KEYFRAME_ENUMS:
+        values = [0] * count
+        try:
+            src.foreach_get(prop, values)
+            dst.foreach_set(prop, values)
+        except (TypeError, RuntimeError):
+            # Enums without raw array access
+            for k1, k2 in zip(src, dst):
+                setattr(k2, prop, getattr(k1, prop))
+
+    b.update()
+
+
+_module_cache = {}  # {module name: (module, source mtime)}
+
+
+def developer_reload_enabled():
+    """ Returns True if the add-on preferences ask for rig modules to be
+        reloaded on every lookup.
+    """
+    try:
+        return bpy.context.user_preferences.addons[MODULE_NAME].preferences.developer_reload
+    except (AttributeError, KeyError):
+        return False
+
+
+def clear_module_cache():
+    _module_cache.clear()
+
+
+def _module_mtime(module):
+    try:
+        return os.path.getmtime(module.__file__)
+    except (AttributeError, TypeError, OSError):
+        return None
+
+
+def load_module(name):
+    """ Imports a module relative to the add-on, reloading it only when its
+        source changed since the last lookup (or always, in developer
+        reload mode).
+    """
+    cached = _module_cache.get(name)
+    if cached is not None and not developer_reload_enabled():
+        module, mtime = cached
+        if _module_mtime(module) == mtime:
+            return module
+
+    full_name = MODULE_NAME + name
+    loaded = full_name in sys.modules
+    module = importlib.import_module(name, package=MODULE_NAME)
+    if loaded:
+        # Already imported before the cache knew about it, or out of date
+        importlib.reload(module)
+
+    _module_cache[name] = (module, _module_mtime(module))
+    return module
 
 
 def get_rig_type(rig_type):
     """ Fetches a rig module by name, and returns it.
     """
-    name = ".%s.%s" % (RIG_DIR, rig_type)
-    submod = importlib.import_module(name, package=MODULE_NAME)
-    importlib.reload(submod)
-    return submod
+    return load_module(".%s.%s" % (RIG_DIR, rig_type))
 
 
 def get_metarig_module(metarig_name, path=METARIG_DIR):
     """ Fetches a rig module by name, and returns it.
     """
-
-    name = ".%s.%s" % (path, metarig_name)
-    submod = importlib.import_module(name, package=MODULE_NAME)
-    importlib.reload(submod)
-    return submod
+    return load_module(".%s.%s" % (path, metarig_name))
 
 
 def get_ui_template_module(template_name):
     """ Fetches a ui template module by name, and returns it.
     """
-    name = ".%s.%s" % (TEMPLATE_DIR, template_name)
-    submod = importlib.import_module(name, package=MODULE_NAME)
-    importlib.reload(submod)
-    return submod
+    return load_module(".%s.%s" % (TEMPLATE_DIR, template_name))
 
 
 def connected_children_names(obj, bone_name):
@@ -1283,19 +1587,68 @@ def gamma_correct(color):
 #=============================================
 
 
-def get_keyed_frames(rig):
-    frames = []
-    if rig.animation_data:
-        if rig.animation_data.action:
-            fcus = rig.animation_data.action.fcurves
-            for fc in fcus:
-                for kp in fc.keyframe_points:
-                    if kp.co[0] not in frames:
-                        frames.append(kp.co[0])
+class ActionIndex:
+    """ Keyed frames of an action, read once: bone name -> channel -> sorted
+        list of keyed frames.  The channel is the rest of the fcurve's data
+        path after the bone, e.g. 'location' or '["pole_vector"]'.  Fcurves
+        that don't belong to a pose bone are indexed under the bone None.
+    """
+    def __init__(self, action):
+        self.action = action
+        self.bones = {}
+        self.fcurves = {}
+        all_frames = set()
+
+        if action:
+            for fcu in action.fcurves:
+                count = len(fcu.keyframe_points)
+                co = [0.0] * (count * 2)
+                fcu.keyframe_points.foreach_get('co', co)
+                keyed = set(co[0::2])
+                all_frames |= keyed
+
+                bone, channel = self.split_data_path(fcu.data_path)
+                channels = self.bones.setdefault(bone, {})
+                channels[channel] = sorted(keyed | set(channels.get(channel, ())))
+                self.fcurves.setdefault(bone, []).append(fcu)
+
+        self.all_frames = sorted(all_frames)
+
+    @staticmethod
+    def split_data_path(data_path):
+        """ Splits an fcurve data path into (bone name, channel).
+        """
+        match = re.match(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]\.?(.*)$', data_path)
+        if match:
+            return match.group(1), match.group(2)
+        return None, data_path
 
-    frames.sort()
+    def bone_frames(self, *bones):
+        """ Returns the sorted frames on which any of the bones is keyed.
+        """
+        frames = set()
+        for bone in bones:
+            for keyed in self.bones.get(bone, {}).values():
+                frames.update(keyed)
+        return sorted(frames)
+
+    def find(self, bone, channel):
+        """ Returns the fcurves of a bone channel.
+        """
+        path = 'pose.bones["%s"]' % bone
+        path += channel if channel.startswith('[') else '.' + channel
+        return [fcu for fcu in self.fcurves.get(bone, []) if fcu.data_path == path]
 
-    return frames
+
+def get_action_index(rig):
+    """ Returns the ActionIndex of the rig's active action.
+    """
+    action = rig.animation_data.action if rig.animation_data else None
+    return ActionIndex(action)
+
+
+def get_keyed_frames(rig):
+    return get_action_index(rig).all_frames
 
 
 def bones_in_frame(f, rig, *args):
@@ -1307,37 +1660,22 @@ def bones_in_frame(f, rig, *args):
     :return:
     """
 
-    if rig.animation_data and rig.animation_data.action:
-        fcus = rig.animation_data.action.fcurves
-    else:
-        return False
-
-    for fc in fcus:
-        animated_frames = [kp.co[0] for kp in fc.keyframe_points]
-        for bone in args:
-            if bone in fc.data_path.split('"') and f in animated_frames:
-                return True
-
-    return False
+    return f in get_action_index(rig).bone_frames(*args)
 
 
-def overwrite_prop_animation(rig, bone, prop_name, value, frames):
-    act = rig.animation_data.action
-    if not act:
-        return
-
-    bone_name = bone.name
-    curve = None
-
-    for fcu in act.fcurves:
-        words = fcu.data_path.split('"')
-        if words[0] == "pose.bones[" and words[1] == bone_name and words[-2] == prop_name:
-            curve = fcu
-            break
-
-    if not curve:
+def overwrite_prop_animation(rig, bone, prop_name, value, frames, index=None):
+    if not rig.animation_data or not rig.animation_data.action:
         return
 
-    for kp in curve.keyframe_points:
-        if kp.co[0] in frames:
-            kp.co[1] = value
+    if index is None:
+        index = get_action_index(rig)
+
+    frames = set(frames)
+    for fcu in index.find(bone.name, '["%s"]' % prop_name):
+        count = len(fcu.keyframe_points)
+        co = [0.0] * (count * 2)
+        fcu.keyframe_points.foreach_get('co', co)
+        for i in range(count):
+            if co[2*i] in frames:
+                co[2*i + 1] = value
+        fcu.keyframe_points.foreach_set('co', co)